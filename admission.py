@@ -0,0 +1,214 @@
+# admission.py
+# Admission control in front of the routers. When Mongo slows down, requests used
+# to pile up waiting for a pooled connection until socketTimeoutMS gave up on them,
+# long after their callers had. Now at most MAX_IN_FLIGHT requests (the size of the
+# Mongo pool) run at once, with tighter limits for expensive routes in ROUTE_LIMITS.
+# The rest wait in a queue where reads go ahead of writes, for at most
+# QUEUE_DEADLINE_S. A request whose estimated wait (requests ahead of it, times the
+# average service time, over the concurrency) is already past the deadline is
+# turned away at once: 503 with Retry-After, instead of a timeout later.
+#
+# /ping, /health, /metrics and /stats skip admission entirely so probes and scrapes
+# keep answering under overload, as does the progress stream, which holds its
+# connection open for as long as the client listens.
+import asyncio
+import math
+import re
+import time
+from collections import deque
+
+from db import MAX_POOL_SIZE
+from metrics import REGISTRY
+
+ADMISSION_ENABLED = True
+MAX_IN_FLIGHT = MAX_POOL_SIZE
+# per route, keyed like "GET /bets/{id}"; routes that stream whole collections
+# or hold a connection for long get a smaller share of the pool
+ROUTE_LIMITS = {
+    "GET /users/export": 2,
+    "GET /groups/export": 2,
+    "GET /bets/export": 2,
+    "POST /users/import": 1,
+    "POST /groups/import": 1,
+    "POST /bets/import": 1,
+}
+QUEUE_DEADLINE_S = 1.0
+# queued requests beyond this are shed regardless of the estimate
+MAX_QUEUE = 1000
+EXEMPT_PATHS = {"/ping", "/health", "/metrics", "/stats"}
+EXEMPT_SUFFIXES = ("/progress/stream",)
+# weight of the latest request in the service time average
+EWMA_ALPHA = 0.1
+
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+_OID = re.compile(r"/[0-9a-fA-F]{24}(?=/|$)")
+
+
+def route_key(method: str, path: str) -> str:
+    # the router hasn't run yet, so ids in the path are folded by shape
+    return f"{method} {_OID.sub('/{id}', path.rstrip('/') or '/')}"
+
+
+class _Waiter:
+    __slots__ = ("fut", "route", "enqueued")
+
+    def __init__(self, fut: asyncio.Future, route: str):
+        self.fut = fut
+        self.route = route
+        self.enqueued = time.perf_counter()
+
+
+class Admission:
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT, route_limits: dict | None = None,
+                 deadline: float = QUEUE_DEADLINE_S, max_queue: int = MAX_QUEUE,
+                 enabled: bool = ADMISSION_ENABLED, registry=REGISTRY):
+        self.max_in_flight = max_in_flight
+        self.route_limits = ROUTE_LIMITS if route_limits is None else route_limits
+        self.deadline = deadline
+        self.max_queue = max_queue
+        self.enabled = enabled
+        self.registry = registry
+        self.in_flight = 0
+        self.route_in_flight: dict[str, int] = {}
+        # reads are admitted before writes
+        self.queues = {"read": deque(), "write": deque()}
+        # seconds from admission to the end of the response, routes in ROUTE_LIMITS
+        # excluded since they don't draw from the shared capacity the same way
+        self.service_time = 0.05
+        self.admitted = 0
+        self.exempt = 0
+        self.shed = 0
+        self.timed_out = 0
+
+    def _fits(self, route: str) -> bool:
+        if self.in_flight >= self.max_in_flight:
+            return False
+        limit = self.route_limits.get(route)
+        return limit is None or self.route_in_flight.get(route, 0) < limit
+
+    def _take(self, route: str):
+        self.in_flight += 1
+        self.route_in_flight[route] = self.route_in_flight.get(route, 0) + 1
+
+    def release(self, route: str, seconds: float):
+        self.in_flight -= 1
+        self.route_in_flight[route] -= 1
+        if route not in self.route_limits:
+            self.service_time += EWMA_ALPHA * (seconds - self.service_time)
+        self._wake()
+
+    def _wake(self):
+        # a waiter held back by its route limit doesn't block the ones behind it
+        for q in self.queues.values():
+            for w in list(q):
+                if self.in_flight >= self.max_in_flight:
+                    return
+                if w.fut.done():
+                    q.remove(w)
+                elif self._fits(w.route):
+                    q.remove(w)
+                    self._take(w.route)
+                    w.fut.set_result(None)
+
+    def _drop(self, klass: str, w: _Waiter):
+        try:
+            self.queues[klass].remove(w)
+        except ValueError:
+            pass
+
+    def estimated_wait(self, klass: str) -> float:
+        ahead = len(self.queues["read"])
+        if klass == "write":
+            ahead += len(self.queues["write"])
+        return (ahead + 1) * self.service_time / self.max_in_flight
+
+    async def acquire(self, route: str, klass: str) -> float | None:
+        # None once admitted, otherwise the Retry-After in seconds
+        queued = len(self.queues["read"]) + len(self.queues["write"])
+        if not queued and self._fits(route):
+            self._take(route)
+            self.admitted += 1
+            return None
+        wait = self.estimated_wait(klass)
+        if wait > self.deadline or queued >= self.max_queue:
+            self.shed += 1
+            return wait
+        w = _Waiter(asyncio.get_running_loop().create_future(), route)
+        self.queues[klass].append(w)
+        # whatever holds up the queue may not hold up this route
+        self._wake()
+        try:
+            await asyncio.wait_for(w.fut, self.deadline)
+        except asyncio.TimeoutError:
+            self._drop(klass, w)
+            self.timed_out += 1
+            return max(wait, self.deadline)
+        except BaseException:
+            # the client went away, possibly right after being admitted
+            if w.fut.done() and not w.fut.cancelled():
+                self.release(route, 0.0)
+            else:
+                self._drop(klass, w)
+            raise
+        finally:
+            self.registry.observe_queue_wait(klass, time.perf_counter() - w.enqueued)
+        self.admitted += 1
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "queued_reads": len(self.queues["read"]),
+            "queued_writes": len(self.queues["write"]),
+            "service_time_ms": self.service_time * 1000,
+            "estimated_wait_ms": self.estimated_wait("write") * 1000,
+            "admitted": self.admitted,
+            "exempt": self.exempt,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+        }
+
+
+ADMISSION = Admission()
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, admission: Admission = ADMISSION):
+        self.app = app
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.admission.enabled:
+            return await self.app(scope, receive, send)
+        path = scope["path"]
+        if path in EXEMPT_PATHS or path.endswith(EXEMPT_SUFFIXES):
+            self.admission.exempt += 1
+            return await self.app(scope, receive, send)
+
+        route = route_key(scope["method"], path)
+        klass = "read" if scope["method"] in READ_METHODS else "write"
+        retry_after = await self.admission.acquire(route, klass)
+        if retry_after is not None:
+            return await _busy(send, retry_after)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.admission.release(route, time.perf_counter() - t0)
+
+
+async def _busy(send, retry_after: float):
+    body = b'{"detail":"Server busy, retry later"}'
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,112 @@
+# bench/bet_history.py
+# A group with --finished finished bets, stored the old way (every id in
+# past_bet_ids) and the capped way (the last past_bets.RECENT_PAST_BETS ids, the
+# history read from bets). Times what the endpoints do at the Mongo level against a
+# local mongod, in a throwaway database: reading and shaping the group, finishing
+# one more bet, and reading history pages from the front and from deep in.
+#
+#   python -m bench.bet_history --finished 10000 --runs 50
+import argparse
+import asyncio
+import statistics
+from datetime import datetime, timedelta, UTC
+
+import bson
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from bench.timing import percentile, timed
+from db import create_client
+from indexes import ensure_indexes
+from past_bets import RECENT_PAST_BETS, push_past_bet_op
+from routers.bets import normalize_bet
+from routers.groups import normalize_group
+from serialize import respond, group_shape, bet_shape
+
+BENCH_DB = "hackathon_bench"
+PAGE = 50
+
+
+def make_bets(gid: ObjectId, n: int) -> list[dict]:
+    start = datetime.now(UTC) - timedelta(days=7 * n)
+    return [
+        {
+            "_id": ObjectId(),
+            "group_id": gid,
+            "title": f"bet {i}",
+            "user_progress": [],
+            "start_date": start + timedelta(days=7 * i),
+            "end_date": start + timedelta(days=7 * i + 7),
+            "status": "finished",
+            "meta": {},
+        }
+        for i in range(n)
+    ]
+
+
+async def get_group(groups, gid: ObjectId) -> int:
+    # a cache miss in GET /groups/{id}: read, normalize for the cache, encode
+    doc = await groups.find_one({"_id": gid})
+    respond(normalize_group(doc), group_shape, normalize_group)
+    return len(bson.encode(doc))
+
+
+async def finish(groups, gid: ObjectId, capped: bool) -> int:
+    bid = ObjectId()
+    if capped:
+        await groups.bulk_write([push_past_bet_op(gid, bid)])
+    else:
+        await groups.bulk_write([UpdateOne({"_id": gid}, {"$addToSet": {"past_bet_ids": bid}})])
+    return 0
+
+
+async def history(bets, gid: ObjectId, before: ObjectId | None) -> int:
+    filt = {"group_id": gid, "status": "finished"}
+    if before is not None:
+        filt["_id"] = {"$lt": before}
+    docs = await bets.find(filt).sort("_id", -1).limit(PAGE).to_list(PAGE)
+    respond(docs, bet_shape, normalize_bet)
+    return sum(len(bson.encode(d)) for d in docs)
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--finished", type=int, default=10_000, help="finished bets in the group")
+    ap.add_argument("--runs", type=int, default=50)
+    args = ap.parse_args()
+
+    client = await create_client()
+    db = client[BENCH_DB]
+    await ensure_indexes(db)
+    groups, bets = db["groups"], db["bets"]
+    old_gid, new_gid = ObjectId(), ObjectId()
+    old_bets, new_bets = make_bets(old_gid, args.finished), make_bets(new_gid, args.finished)
+    for i in range(0, args.finished, 1000):
+        await bets.insert_many(old_bets[i:i + 1000] + new_bets[i:i + 1000])
+    base = {"description": None, "user_ids": [], "created_at": datetime.now(UTC), "is_active": True}
+    await groups.insert_many([
+        {**base, "_id": old_gid, "name": "uncapped", "past_bet_ids": [b["_id"] for b in old_bets]},
+        {**base, "_id": new_gid, "name": "capped", "past_bet_ids": [b["_id"] for b in new_bets[-RECENT_PAST_BETS:]]},
+    ])
+    deep = new_bets[len(new_bets) // 2]["_id"]
+
+    cases = {
+        "get group, uncapped": lambda: get_group(groups, old_gid),
+        "get group, capped": lambda: get_group(groups, new_gid),
+        "finish, $addToSet uncapped": lambda: finish(groups, old_gid, capped=False),
+        "finish, capped $push": lambda: finish(groups, new_gid, capped=True),
+        f"history, first {PAGE}": lambda: history(bets, new_gid, None),
+        f"history, {PAGE} from the middle": lambda: history(bets, new_gid, deep),
+    }
+    print(f"groups with {args.finished} finished bets")
+    for name, fn in cases.items():
+        ms, size = await timed(fn, args.runs)
+        print(f"{name:>30}: {size:>10} bytes read  median {statistics.median(ms):8.2f} ms"
+              f"  p95 {percentile(sorted(ms), 0.95):8.2f} ms")
+
+    await client.drop_database(BENCH_DB)
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
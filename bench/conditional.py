@@ -0,0 +1,110 @@
+# bench/conditional.py
+# Bandwidth and latency of a mobile client refreshing a group screen over a slow
+# link: the group, its current bet and the group's bet list, fetched --refreshes
+# times with a progress update landing on the bet every --write-every refreshes.
+# Four clients: plain, conditional (If-None-Match with the last ETag), compressed
+# (Accept-Encoding: br, gzip), and both. The link adds --rtt ms per request and
+# sends response bytes (status line, headers, body) at --kbps.
+#
+#   python -m bench.conditional --fake --kbps 400 --rtt 150 --refreshes 30
+#
+# Needs httpx, see bench/requirements.txt.
+import argparse
+import asyncio
+import statistics
+
+import httpx
+
+import main as app_main
+from bench.replay import in_process_client
+from bench.seed import seed
+from bench.timing import percentile, timed
+
+
+class ThrottledTransport(httpx.AsyncBaseTransport):
+    def __init__(self, inner: httpx.AsyncBaseTransport, kbps: float, rtt_ms: float):
+        self.inner = inner
+        self.bytes_per_s = kbps * 1000 / 8
+        self.rtt = rtt_ms / 1000
+        self.wire_bytes = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        resp = await self.inner.handle_async_request(request)
+        # still encoded: what would cross the link
+        raw = b"".join([chunk async for chunk in resp.aiter_raw()])
+        size = len(raw) + 17 + sum(len(k) + len(v) + 4 for k, v in resp.headers.raw)
+        self.wire_bytes += size
+        await asyncio.sleep(self.rtt + size / self.bytes_per_s)
+        return httpx.Response(resp.status_code, headers=resp.headers, content=raw, request=request)
+
+
+async def refresh_screen(http: httpx.AsyncClient, paths: list[str], etags: dict, conditional: bool) -> int:
+    not_modified = 0
+    for path in paths:
+        headers = {"If-None-Match": etags[path]} if conditional and path in etags else {}
+        r = await http.get(path, headers=headers)
+        if r.status_code == 304:
+            not_modified += 1
+            continue
+        r.raise_for_status()
+        if "etag" in r.headers:
+            etags[path] = r.headers["etag"]
+    return not_modified
+
+
+async def run_client(app_client: httpx.AsyncClient, args, paths, progress_path, conditional, encoding) -> dict:
+    inner = app_client._transport
+    link = ThrottledTransport(inner, args.kbps, args.rtt)
+    headers = {"Accept-Encoding": encoding}
+    etags: dict = {}
+    ms, not_modified = [], 0
+    async with httpx.AsyncClient(transport=link, base_url="http://app", headers=headers) as http:
+        for i in range(args.refreshes):
+            if i and i % args.write_every == 0:
+                # someone else's progress: the bet changes, the group doesn't
+                await app_client.post(progress_path, params={"progress": i % 100})
+            one, n = await timed(lambda: refresh_screen(http, paths, etags, conditional), 1)
+            ms.extend(one)
+            not_modified += n
+    return {
+        "kb": link.wire_bytes / 1000,
+        "not_modified": not_modified,
+        "median_ms": statistics.median(ms),
+        "p95_ms": percentile(sorted(ms), 0.95),
+    }
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--fake", action="store_true", help="in-process app on the memory backend")
+    ap.add_argument("--kbps", type=float, default=400, help="link bandwidth, kilobits/s")
+    ap.add_argument("--rtt", type=float, default=150, help="round trip per request, ms")
+    ap.add_argument("--refreshes", type=int, default=30)
+    ap.add_argument("--write-every", type=int, default=5, help="refreshes between progress updates")
+    ap.add_argument("--members", type=int, default=40)
+    args = ap.parse_args()
+
+    async with in_process_client(args.fake) as app_client:
+        db = app_main.app.state.mongo[app_main.DB_NAME]
+        ids = await seed(db, users=args.members * 5, groups=5, members=args.members, bets=20)
+        bid, uids = next(b for b in ids["bets"] if b[1])
+        bet = (await app_client.get(f"/bets/{bid}")).json()
+        gid = bet["group_id"]
+        paths = [f"/groups/{gid}", f"/bets/{bid}", f"/bets?group_id={gid}&limit=50"]
+        progress_path = f"/bets/{bid}/progress/{uids[0]}"
+
+        cases = {
+            "plain": (False, "identity"),
+            "conditional": (True, "identity"),
+            "compressed": (False, "br, gzip"),
+            "conditional + compressed": (True, "br, gzip"),
+        }
+        print(f"{args.refreshes} refreshes of {len(paths)} requests at {args.kbps:.0f} kbit/s, {args.rtt:.0f} ms rtt")
+        for name, (conditional, encoding) in cases.items():
+            r = await run_client(app_client, args, paths, progress_path, conditional, encoding)
+            print(f"{name:>26}: {r['kb']:>9.1f} kB  {r['not_modified']:>4} x 304  "
+                  f"refresh median {r['median_ms']:8.1f} ms  p95 {r['p95_ms']:8.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+# bench/group_overview.py
+# GET /groups/{id}/overview (one aggregation) vs the client fan-out it replaces:
+# get the group, then every member, then the current bet. Measured at the Mongo
+# level against a local mongod, in a throwaway database.
+#
+#   python -m bench.group_overview --members 50 --runs 50
+import argparse
+import asyncio
+import statistics
+
+from bson import ObjectId
+
+from bench.seed import seed
+from bench.timing import percentile, timed
+from db import create_client
+from routers.groups import overview_pipeline, shape_overview
+
+BENCH_DB = "hackathon_bench"
+
+
+async def fan_out(db, gid: ObjectId, concurrent: bool):
+    group = await db["groups"].find_one({"_id": gid})
+    users = db["users"]
+    if concurrent:
+        await asyncio.gather(*(users.find_one({"_id": uid}, {"password_hash": 0}) for uid in group["user_ids"]))
+    else:
+        for uid in group["user_ids"]:
+            await users.find_one({"_id": uid}, {"password_hash": 0})
+    if group.get("current_bet_id"):
+        await db["bets"].find_one({"_id": group["current_bet_id"]})
+
+
+async def overview(db, gid: ObjectId):
+    docs = await db["groups"].aggregate(overview_pipeline(gid)).to_list(1)
+    shape_overview(docs[0])
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--members", type=int, default=50)
+    ap.add_argument("--bets", type=int, default=20)
+    ap.add_argument("--runs", type=int, default=50)
+    args = ap.parse_args()
+
+    client = await create_client()
+    db = client[BENCH_DB]
+    ids = await seed(db, users=args.members * 4, groups=4, members=args.members, bets=args.bets)
+    gid = ObjectId(ids["groups"][0])
+
+    cases = {
+        "fan-out (sequential)": lambda: fan_out(db, gid, concurrent=False),
+        "fan-out (concurrent)": lambda: fan_out(db, gid, concurrent=True),
+        "overview aggregation": lambda: overview(db, gid),
+    }
+    for name, fn in cases.items():
+        ms, _ = await timed(fn, args.runs)
+        print(f"{name:>22}: median {statistics.median(ms):8.2f} ms  p95 {percentile(sorted(ms), 0.95):8.2f} ms")
+
+    await client.drop_database(BENCH_DB)
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
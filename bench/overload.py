@@ -0,0 +1,153 @@
+# bench/overload.py
+# Load test for admission.py: the in-process app on the memory backend, made to behave
+# like a Mongo that has slowed down (every operation holds one of --pool
+# connections for --latency ms), driven open loop at --rate, past what the pool can
+# serve. Run once with admission off and once with it on. Off, every request queues for a connection and p99 grows
+# with the length of the run; on, excess requests get a fast 503 and p99 stays
+# near the queue deadline. /ping is mixed in to show probes still answer.
+#
+#   python -m bench.overload --rate 800 --requests 8000 --pool 10 --latency 20
+#
+# Needs httpx, see bench/requirements.txt.
+import argparse
+import asyncio
+import inspect
+from contextlib import asynccontextmanager
+
+import httpx
+
+import main as app_main
+from admission import ADMISSION
+from bench.replay import replay, print_report
+from bench.seed import seed, traffic
+from db import DB_NAME
+from memstore import MemoryClient
+
+
+class SlowPool:
+    # stands in for a connection pool in front of a server that answers in latency s
+    def __init__(self, size: int, latency: float):
+        self.sem = asyncio.Semaphore(size)
+        self.latency = latency
+
+    async def hold(self):
+        if self.latency:
+            async with self.sem:
+                await asyncio.sleep(self.latency)
+
+
+class Slow:
+    # wraps a client, database or collection; awaited calls and cursors go through the pool
+    def __init__(self, target, pool: SlowPool):
+        self._target = target
+        self._pool = pool
+
+    def __getitem__(self, name):
+        return Slow(self._target[name], self._pool)
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if isinstance(attr, (str, int, float, bool, type(None))):
+            return attr
+        if not callable(attr):
+            return Slow(attr, self._pool)
+
+        def call(*args, **kwargs):
+            res = attr(*args, **kwargs)
+            if inspect.isawaitable(res):
+                return self._timed(res)
+            if hasattr(res, "to_list"):
+                return SlowCursor(res, self._pool)
+            return res
+        return call
+
+    async def _timed(self, aw):
+        await self._pool.hold()
+        return await aw
+
+
+class SlowCursor:
+    def __init__(self, cursor, pool: SlowPool):
+        self._cursor = cursor
+        self._pool = pool
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            res = attr(*args, **kwargs)
+            if inspect.isawaitable(res):
+                return Slow._timed(self, res)
+            return SlowCursor(res, self._pool) if hasattr(res, "to_list") else res
+        return call
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        await self._pool.hold()
+        async for doc in self._cursor:
+            yield doc
+
+
+@asynccontextmanager
+async def slow_app(pool: SlowPool):
+    app = app_main.app
+    client = MemoryClient()
+
+    async def create_slow_client():
+        return Slow(client, pool)
+
+    app_main.create_client = create_slow_client
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=60) as http:
+            yield http
+
+
+async def run(args):
+    pool = SlowPool(args.pool, 0)
+    # the app may run as many requests at once as the emulated pool has connections
+    ADMISSION.max_in_flight = args.pool
+    async with slow_app(pool) as http:
+        db = app_main.app.state.mongo[DB_NAME]
+        ids = await seed(db, args.users, args.groups, args.members, args.bets)
+        entries = traffic(ids, args.requests)
+        for i in range(0, len(entries), 20):
+            entries[i] = {"method": "GET", "path": "/ping"}
+        pool.latency = args.latency / 1000
+
+        for enabled in (False, True):
+            ADMISSION.enabled = enabled
+            before = ADMISSION.stats()
+            result = await replay(http, entries, args.concurrency, args.rate)
+            after = ADMISSION.stats()
+            total = result["total"]
+            print(f"\nadmission {'on' if enabled else 'off'}: {args.rate:.0f} req/s offered, "
+                  f"{(total['count'] - total['errors']) / total['seconds']:.0f} req/s served, "
+                  f"{after['shed'] - before['shed']} shed, {after['timed_out'] - before['timed_out']} timed out")
+            print_report({"routes": {k: v for k, v in result["routes"].items() if k == "GET /ping"},
+                          "total": total})
+            # let the backlog drain before the next run
+            while ADMISSION.in_flight:
+                await asyncio.sleep(0.1)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rate", type=float, default=800, help="offered load, requests/s")
+    ap.add_argument("--requests", type=int, default=8_000)
+    ap.add_argument("--concurrency", type=int, default=2_000, help="client connections; enough to keep the rate up")
+    ap.add_argument("--pool", type=int, default=10, help="emulated Mongo connections")
+    ap.add_argument("--latency", type=float, default=20, help="ms each Mongo operation holds a connection")
+    ap.add_argument("--users", type=int, default=500)
+    ap.add_argument("--groups", type=int, default=50)
+    ap.add_argument("--members", type=int, default=20)
+    ap.add_argument("--bets", type=int, default=3)
+    asyncio.run(run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# bench/pagination.py
+# Page-N latency for list_bets: skip/limit vs the keyset `after` cursor.
+# Needs a local mongod; seeds a throwaway database and drops it afterwards.
+#
+#   python -m bench.pagination --docs 250000 --page 1000 --limit 200
+import argparse
+import statistics
+from datetime import datetime, timedelta, UTC
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+from bench.timing import timed_sync
+from db import MONGO_URI
+
+BENCH_DB = "hackathon_bench"
+
+
+def seed(col, n: int, group_id: ObjectId):
+    col.drop()
+    now = datetime.now(UTC)
+    batch = []
+    for i in range(n):
+        batch.append({
+            "group_id": group_id,
+            "title": f"bet {i}",
+            "user_progress": [],
+            "start_date": now,
+            "end_date": now + timedelta(days=7),
+            "status": "planned",
+            "meta": {},
+        })
+        if len(batch) == 10_000:
+            col.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        col.insert_many(batch, ordered=False)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=250_000)
+    ap.add_argument("--page", type=int, default=1000)
+    ap.add_argument("--limit", type=int, default=200)
+    ap.add_argument("--runs", type=int, default=20)
+    args = ap.parse_args()
+
+    client = MongoClient(MONGO_URI)
+    col = client[BENCH_DB]["bets"]
+    need = args.page * args.limit
+    if args.docs < need:
+        raise SystemExit(f"--docs must be at least page*limit ({need})")
+    seed(col, args.docs, ObjectId())
+
+    skip = (args.page - 1) * args.limit
+    # the last _id of the previous page is what the client would hold in its cursor
+    last = list(col.find({}, {"_id": 1}).sort("_id", 1).skip(skip - 1).limit(1))[0]["_id"]
+
+    def by_skip():
+        list(col.find({}).sort("_id", 1).skip(skip).limit(args.limit))
+
+    def by_cursor():
+        list(col.find({"_id": {"$gt": last}}).sort("_id", 1).limit(args.limit))
+
+    for name, fn in (("skip", by_skip), ("after", by_cursor)):
+        ms, _ = timed_sync(fn, args.runs)
+        print(f"page {args.page:>5} {name:>5}: median {statistics.median(ms):8.2f} ms  max {max(ms):8.2f} ms")
+
+    client.drop_database(BENCH_DB)
+
+
+if __name__ == "__main__":
+    main()
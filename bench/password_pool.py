@@ -0,0 +1,73 @@
+# bench/password_pool.py
+# Event-loop latency while logins saturate password verification.
+# A probe task sleeps 1 ms in a loop and records how late it wakes up; with the
+# KDF inline the lag tracks the hash time, with the pool it should stay flat.
+#
+#   python -m bench.password_pool --logins 200 --concurrency 50
+import argparse
+import asyncio
+import statistics
+import time
+
+from bench.timing import percentile
+from passwords import PasswordPool
+from utils import hash_password, verify_password
+
+
+async def probe(lags: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append((time.perf_counter() - t0 - 0.001) * 1000)
+
+
+async def run(mode: str, stored: str, logins: int, concurrency: int, pool_size: int) -> dict:
+    pool = PasswordPool(size=pool_size) if mode == "pool" else None
+    sem = asyncio.Semaphore(concurrency)
+    lags: list[float] = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(lags, stop))
+
+    async def login():
+        async with sem:
+            if pool is not None:
+                await pool.verify("hunter2", stored)
+            else:
+                verify_password("hunter2", stored)
+                await asyncio.sleep(0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await probe_task
+    if pool is not None:
+        pool.close()
+    lags.sort()
+    return {
+        "mode": mode,
+        "logins_per_s": logins / elapsed,
+        "lag_p50_ms": statistics.median(lags),
+        "lag_p99_ms": percentile(lags, 0.99),
+        "lag_max_ms": lags[-1],
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--logins", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--pool-size", type=int, default=4)
+    args = ap.parse_args()
+
+    stored = hash_password("hunter2")
+    for mode in ("inline", "pool"):
+        r = asyncio.run(run(mode, stored, args.logins, args.concurrency, args.pool_size))
+        print(
+            f"{r['mode']:>6}: {r['logins_per_s']:7.1f} logins/s  loop lag "
+            f"p50 {r['lag_p50_ms']:7.2f} ms  p99 {r['lag_p99_ms']:7.2f} ms  max {r['lag_max_ms']:7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
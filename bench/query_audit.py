@@ -0,0 +1,345 @@
+# bench/query_audit.py
+# Audits the query plans behind every router endpoint. The app runs in-process
+# against a seeded local mongod and every route in routers/*.py is called with the
+# filter combinations clients use. A command listener records each query that
+# reaches the server, and each distinct query shape is then run again through
+# explain("executionStats"). A shape is flagged when it:
+#
+#   - scans the collection (COLLSCAN, or a $lookup that reports collectionScans)
+#   - sorts in memory (SORT plan stage, or a $sort stage left in the pipeline)
+#   - examines many more documents than it returns
+#
+# Exits 1 when flagged shapes appear, or when routes were left unexercised. With
+# --baseline, only flags missing from the baseline count, so a known gap doesn't
+# fail every run. Seeding replaces the users/groups/bets data, hence --wipe.
+#
+#   python -m bench.query_audit --wipe --out audit.json
+#   python -m bench.query_audit --wipe --baseline audit.json   # as a CI check
+import argparse
+import asyncio
+import copy
+import json
+import sys
+import time
+from collections import defaultdict
+
+from pymongo import monitoring
+
+import main as app_main
+from bench.replay import in_process_client
+from bench.seed import seed
+
+# commands that filter documents and can be explained; inserts, getMore, index
+# and admin commands are not queries
+EXPLAINABLE = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+# fields the driver adds to a command that explain doesn't accept
+DRIVER_FIELDS = {"lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "autocommit", "startTransaction"}
+
+# a query may examine this many docs per doc returned before it's flagged
+MAX_EXAMINED_RATIO = 10
+# ...as long as it examined at least this many; tiny scans aren't worth flagging
+MIN_EXAMINED = 100
+
+# routes that can't be driven in-process, with where their queries are covered
+SKIPPED_ROUTES = {
+    "GET /bets/{bet_id}/progress/stream": "needs a change stream; its snapshot read is the _id lookup of GET /bets/{id}",
+}
+
+
+def _shape(value):
+    # keep operators and field names, drop the values, so one query with different
+    # ids is one shape
+    if isinstance(value, dict):
+        return {k: _shape(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_shape(v) for v in value[:1]] + (["..."] if len(value) > 1 else [])
+    return "?"
+
+
+def _statements(command_name: str, cmd: dict):
+    # update/delete commands carry a list of statements, each explained on its own
+    if command_name == "update":
+        for stmt in cmd["updates"]:
+            yield {"update": cmd["update"], "updates": [stmt]}, {"q": stmt["q"], "u": stmt["u"]}
+    elif command_name == "delete":
+        for stmt in cmd["deletes"]:
+            yield {"delete": cmd["delete"], "deletes": [stmt]}, {"q": stmt["q"]}
+    else:
+        body = {k: v for k, v in cmd.items() if k in ("filter", "sort", "projection", "fields", "pipeline", "query", "update", "hint")}
+        yield cmd, body
+
+
+class QueryCapture(monitoring.CommandListener):
+    # registered globally before the app creates its client; requests are driven one
+    # at a time so the current route label applies to everything in between
+    def __init__(self):
+        self.label = "<startup>"
+        self.shapes: dict[str, dict] = {}
+
+    def started(self, event):
+        if event.command_name not in EXPLAINABLE:
+            return
+        cmd = {k: v for k, v in copy.deepcopy(dict(event.command)).items() if k not in DRIVER_FIELDS}
+        collection = cmd.get(event.command_name)
+        for explain_cmd, body in _statements(event.command_name, cmd):
+            key = f"{collection}.{event.command_name} {json.dumps(_shape(body), sort_keys=True)}"
+            entry = self.shapes.get(key)
+            if entry is None:
+                entry = self.shapes[key] = {
+                    "collection": collection,
+                    "command": event.command_name,
+                    "database": event.database_name,
+                    "explain": explain_cmd,
+                    "routes": [],
+                }
+            if self.label not in entry["routes"]:
+                entry["routes"].append(self.label)
+
+    def succeeded(self, event): pass
+    def failed(self, event): pass
+
+
+def _walk(node):
+    if isinstance(node, dict):
+        yield node
+        for v in node.values():
+            yield from _walk(v)
+    elif isinstance(node, list):
+        for v in node:
+            yield from _walk(v)
+
+
+def analyze(explain: dict) -> dict:
+    # the layout differs between find/aggregate/write explains and server versions,
+    # so look for the interesting parts wherever they are
+    stages: set[str] = set()
+    examined = keys = returned = collection_scans = 0
+    pipeline_sort = False
+    for node in _walk(explain):
+        for plan_key in ("winningPlan", "executionStages"):
+            if isinstance(node.get(plan_key), dict):
+                stages |= {n["stage"] for n in _walk(node[plan_key]) if isinstance(n.get("stage"), str)}
+        stats = node.get("executionStats")
+        if isinstance(stats, dict) and "totalDocsExamined" in stats:
+            examined += stats.get("totalDocsExamined", 0)
+            keys += stats.get("totalKeysExamined", 0)
+            returned += stats.get("nReturned", 0)
+        if isinstance(node.get("collectionScans"), int):
+            collection_scans += node["collectionScans"]
+        if "$sort" in node and isinstance(node["$sort"], dict) and "sortKey" in node["$sort"]:
+            pipeline_sort = True
+    flags = []
+    if "COLLSCAN" in stages or collection_scans:
+        flags.append("COLLSCAN")
+    if "SORT" in stages or pipeline_sort:
+        flags.append("IN_MEMORY_SORT")
+    ratio = examined / max(returned, 1)
+    if examined >= MIN_EXAMINED and ratio > MAX_EXAMINED_RATIO:
+        flags.append("EXAMINED_RATIO")
+    return {
+        "stages": sorted(stages),
+        "docs_examined": examined,
+        "keys_examined": keys,
+        "returned": returned,
+        "ratio": round(ratio, 1),
+        "flags": flags,
+    }
+
+
+def router_routes(app) -> set[str]:
+    # "METHOD /prefix/path" for every route of the included routers
+    routes = set()
+    for r in app.routes:
+        ctx = getattr(r, "include_context", None)
+        router = getattr(r, "original_router", None)
+        if ctx is None or router is None:
+            continue
+        for route in router.routes:
+            path = "/" + "/".join(p for p in (ctx.prefix.strip("/"), route.path_format.strip("/")) if p)
+            for method in route.methods:
+                routes.add(f"{method} {path}")
+    return routes
+
+
+async def drive(client, capture: QueryCapture, ids: dict) -> set[str]:
+    # calls every router endpoint, reads first and destructive calls last; returns
+    # the route templates that were hit
+    hit = set()
+    users, groups = ids["users"], ids["groups"]
+    bid, members = ids["bets"][-1]
+    gid = groups[-1]
+    uid = members[0]
+    outsider = next(u for u in users if u not in set(members))
+    planned = {"title": "audit", "group_id": gid, "start_date": "2030-01-01T00:00:00Z",
+               "end_date": "2030-01-08T00:00:00Z"}
+
+    async def call(template: str, method: str, path: str, **kw):
+        capture.label = f"{method} {template}"
+        r = await client.request(method, path, **kw)
+        if r.status_code >= 500:
+            raise SystemExit(f"{method} {path} failed with {r.status_code}: {r.text[:200]}")
+        hit.add(capture.label)
+        return r
+
+    # users
+    await call("/users", "GET", "/users/")
+    r = await call("/users", "GET", "/users/", params={"limit": 5})
+    await call("/users", "GET", "/users/", params={"after": r.headers["X-Next-Cursor"], "limit": 5})
+    await call("/users", "GET", "/users/", params={"email": "user1@example.com"})
+    await call("/users/export", "GET", "/users/export")
+    await call("/users/search", "GET", "/users/search", params={"q": "USER1"})
+    await call("/users/search", "GET", "/users/search", params={"q": "user1", "fields": "username", "limit": 5})
+    await call("/users/{id}", "GET", f"/users/{uid}")
+    r = await call("/users/{id}/bets", "GET", f"/users/{uid}/bets", params={"limit": 2})
+    await call("/users/{id}/bets", "GET", f"/users/{uid}/bets", params={"after": r.headers["X-Next-Cursor"], "limit": 2})
+    await call("/users/{id}/bets", "GET", f"/users/{uid}/bets", params={"status": "active"})
+    await call("/users/login", "POST", "/users/login", json={"email": "user1@example.com", "password": "x"})
+    r = await call("/users", "POST", "/users/", json={
+        "profile_url": "https://cdn.example.com/u/audit.png", "username": "audit",
+        "email": "audit@example.com", "average_spending": 1, "password": "audit-password"})
+    new_user = r.json()["_id"]
+    await call("/users/import", "POST", "/users/import", content=json.dumps({
+        "profile_url": "x", "username": "audit2", "email": "audit2@example.com",
+        "average_spending": 1, "password": "audit-password"}).encode())
+    await call("/users/{id}", "PATCH", f"/users/{new_user}", json={"average_spending": 2})
+    await call("/users/{id}", "PATCH", f"/users/{new_user}", json={"username": "Audit-Renamed"})
+
+    # groups
+    await call("/groups", "GET", "/groups")
+    r = await call("/groups", "GET", "/groups", params={"limit": 5})
+    await call("/groups", "GET", "/groups", params={"after": r.headers["X-Next-Cursor"], "limit": 5})
+    await call("/groups", "GET", "/groups", params={"name": "group-1"})
+    await call("/groups/export", "GET", "/groups/export")
+    await call("/groups/search", "GET", "/groups/search", params={"q": "Group-1"})
+    await call("/groups/{id}", "GET", f"/groups/{gid}")
+    await call("/groups/{id}/overview", "GET", f"/groups/{gid}/overview")
+    await call("/groups/{id}/stats", "GET", f"/groups/{gid}/stats")
+    r = await call("/groups/{id}/bets/history", "GET", f"/groups/{gid}/bets/history", params={"limit": 2})
+    await call("/groups/{id}/bets/history", "GET", f"/groups/{gid}/bets/history",
+               params={"after": r.headers["X-Next-Cursor"], "limit": 2})
+    r = await call("/groups", "POST", "/groups", json={"name": "audit-group"})
+    new_group = r.json()["_id"]
+    await call("/groups/import", "POST", "/groups/import", content=b'{"name": "audit-group-2"}')
+    await call("/groups/{id}", "PATCH", f"/groups/{new_group}", json={"description": "audited"})
+    await call("/groups/{id}", "PATCH", f"/groups/{new_group}", json={"name": "Audit-Group-Renamed"})
+    await call("/groups/{group_id}/join/{user_id}", "POST", f"/groups/{gid}/join/{outsider}")
+    await call("/groups/{group_id}/leave/{user_id}", "POST", f"/groups/{gid}/leave/{outsider}")
+
+    # bets
+    await call("/bets", "GET", "/bets")
+    r = await call("/bets", "GET", "/bets", params={"limit": 5})
+    await call("/bets", "GET", "/bets", params={"after": r.headers["X-Next-Cursor"], "limit": 5})
+    await call("/bets", "GET", "/bets", params={"group_id": gid})
+    await call("/bets", "GET", "/bets", params={"status": "active"})
+    await call("/bets", "GET", "/bets", params={"group_id": gid, "status": "active"})
+    await call("/bets/export", "GET", "/bets/export", params={"group_id": gid})
+    await call("/bets/export", "GET", "/bets/export", params={"status": "active"})
+    await call("/bets/{id}", "GET", f"/bets/{bid}")
+    await call("/bets/{bet_id}/progress/{user_id}", "POST", f"/bets/{bid}/progress/{uid}", params={"progress": 42})
+    await call("/bets/{bet_id}/progress/{user_id}", "POST", f"/bets/{bid}/progress/{outsider}", params={"progress": 1})
+    await call("/bets/{bet_id}/progress/history", "GET", f"/bets/{bid}/progress/history")
+    await call("/bets/{bet_id}/progress/history", "GET", f"/bets/{bid}/progress/history",
+               params={"user_id": uid, "unit": "minute"})
+    await call("/bets/{bet_id}/progress:batch", "POST", f"/bets/{bid}/progress:batch",
+               json=[{"user_id": u, "progress": 50} for u in members[:5]])
+    await call("/bets/progress:batch", "POST", "/bets/progress:batch",
+               json=[{"bet_id": b, "user_id": us[0], "progress": 50} for b, us in ids["bets"][-5:] if us])
+    r = await call("/bets", "POST", "/bets", json=planned)
+    new_bet = r.json()["_id"]
+    await call("/bets/import", "POST", "/bets/import", content=json.dumps(planned).encode())
+    await call("/bets/{id}", "PATCH", f"/bets/{new_bet}", json={"title": "audited"})
+    await call("/bets/{bet_id}/activate", "POST", f"/bets/{new_bet}/activate")
+    await call("/bets/{bet_id}/finish", "POST", f"/bets/{new_bet}/finish")
+
+    # deletes last
+    await call("/bets/{id}", "DELETE", f"/bets/{new_bet}")
+    await call("/groups/{id}", "DELETE", f"/groups/{new_group}")
+    await call("/users/{id}", "DELETE", f"/users/{new_user}")
+    return hit
+
+
+async def explain_all(db_client, capture: QueryCapture) -> list[dict]:
+    results = []
+    for key, entry in capture.shapes.items():
+        db = db_client[entry["database"]]
+        t0 = time.perf_counter()
+        explained = await db.command({"explain": entry["explain"], "verbosity": "executionStats"})
+        result = analyze(explained)
+        result.update({
+            "shape": key,
+            "routes": entry["routes"],
+            "explain_ms": round((time.perf_counter() - t0) * 1000, 1),
+        })
+        results.append(result)
+    return results
+
+
+def regressions(results: list[dict], baseline: dict | None) -> list[str]:
+    known = defaultdict(set)
+    for r in (baseline or {}).get("shapes", []):
+        known[r["shape"]] |= set(r["flags"])
+    out = []
+    for r in results:
+        new = [f for f in r["flags"] if f not in known[r["shape"]]]
+        if new:
+            out.append(f"{', '.join(new)}: {r['shape']} (from {', '.join(r['routes'])})")
+    return out
+
+
+def print_report(results: list[dict]):
+    print(f"{'flags':<30} {'examined':>9} {'returned':>9} {'ratio':>7}  shape")
+    for r in sorted(results, key=lambda r: (not r["flags"], r["shape"])):
+        print(f"{','.join(r['flags']) or '-':<30} {r['docs_examined']:>9} {r['returned']:>9} {r['ratio']:>7}  {r['shape']}")
+        print(f"{'':<59}  {' / '.join(r['stages'])}  <- {', '.join(r['routes'])}")
+
+
+async def run(args) -> dict:
+    capture = QueryCapture()
+    # must be registered before the app creates its client to be picked up
+    monitoring.register(capture)
+    # background work would issue queries that can't be attributed to a route
+    app_main.SCHEDULER_ENABLED = False
+    app_main.CHANGE_STREAM_ENABLED = False
+    app_main.PROGRESS_BUFFER_ENABLED = False
+    async with in_process_client(fake=False) as client:
+        mongo = app_main.app.state.mongo
+        ids = await seed(mongo[app_main.DB_NAME], args.users, args.groups, args.members, args.bets)
+        capture.shapes.clear()
+        hit = await drive(client, capture, ids)
+        results = await explain_all(mongo, capture)
+    missing = sorted(router_routes(app_main.app) - hit - set(SKIPPED_ROUTES))
+    return {"shapes": results, "unexercised_routes": missing}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=5_000)
+    ap.add_argument("--groups", type=int, default=500)
+    ap.add_argument("--members", type=int, default=25)
+    ap.add_argument("--bets", type=int, default=5, help="bets per group")
+    ap.add_argument("--out", help="write the audit JSON here")
+    ap.add_argument("--baseline", help="audit JSON whose flags are accepted")
+    ap.add_argument("--wipe", action="store_true", help=f"allow replacing the data in {app_main.DB_NAME}")
+    args = ap.parse_args()
+    if not args.wipe:
+        raise SystemExit(f"refusing to replace users/groups/bets in {app_main.DB_NAME!r} without --wipe")
+
+    report = asyncio.run(run(args))
+    print_report(report["shapes"])
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    problems = regressions(report["shapes"], baseline)
+    problems += [f"route not exercised: {r}" for r in report["unexercised_routes"]]
+    if problems:
+        print("\n" + "\n".join(problems), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
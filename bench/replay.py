@@ -0,0 +1,203 @@
+# bench/replay.py
+# Replays a recorded request log against the app and reports latency percentiles
+# and throughput per route template. Results are written as JSON so runs can be
+# compared; --baseline fails the run when a route's p95 regresses past --threshold.
+#
+# Log format: one JSON object per line with "method", "path" and optional "query"
+# and "json" (request body). bench/seed.py writes one matching its dataset.
+#
+#   # against a running server (local mongod behind it)
+#   python -m bench.replay --url http://localhost:8000 --log bench/traffic.jsonl \
+#       --concurrency 64 --rate 2000 --out run.json --baseline base.json
+#   # fully in-process, on the memory backend (memstore.py), with a synthesized dataset
+#   python -m bench.replay --fake --synth 20000 --users 2000 --groups 200
+#
+# Needs httpx, see bench/requirements.txt.
+import argparse
+import asyncio
+import json
+import platform
+import re
+import sys
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime, UTC
+
+import httpx
+
+import db
+import main as app_main
+from bench.seed import seed, traffic
+from bench.timing import percentile
+
+
+def load_log(path: str, limit: int | None) -> list[dict]:
+    entries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entries.append(json.loads(line))
+            if limit and len(entries) >= limit:
+                break
+    return entries
+
+
+_OID = re.compile(r"/[0-9a-fA-F]{24}(?=/|$)")
+
+
+# groups concrete paths by shape, e.g. /bets/{id}/progress/{id}; done on the path
+# rather than through the app's router so it works the same for remote targets
+def route_name(method: str, path: str) -> str:
+    return f"{method} {_OID.sub('/{id}', path)}"
+
+
+async def replay(client: httpx.AsyncClient, entries: list[dict], concurrency: int, rate: float) -> dict:
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+    queue: asyncio.Queue = asyncio.Queue()
+    for i, e in enumerate(entries):
+        queue.put_nowait((i, e))
+    start = time.perf_counter()
+
+    async def worker():
+        while True:
+            try:
+                i, e = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            # open loop when a rate is set: latency counts from the scheduled send time,
+            # so a slow server can't hide queueing delay (coordinated omission)
+            scheduled = start + i / rate if rate else time.perf_counter()
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            name = route_name(e["method"], e["path"])
+            try:
+                r = await client.request(e["method"], e["path"], params=e.get("query"), json=e.get("json"))
+                if r.status_code >= 500:
+                    errors[name] += 1
+            except httpx.HTTPError:
+                errors[name] += 1
+            latencies[name].append((time.perf_counter() - scheduled) * 1000)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    routes = {}
+    for name, ms in sorted(latencies.items()):
+        ms.sort()
+        routes[name] = {
+            "count": len(ms),
+            "errors": errors[name],
+            "rps": len(ms) / elapsed,
+            "p50_ms": percentile(ms, 0.50),
+            "p95_ms": percentile(ms, 0.95),
+            "p99_ms": percentile(ms, 0.99),
+        }
+    all_ms = sorted(x for ms in latencies.values() for x in ms)
+    total = {
+        "count": len(all_ms),
+        "errors": sum(errors.values()),
+        "rps": len(all_ms) / elapsed,
+        "p50_ms": percentile(all_ms, 0.50),
+        "p95_ms": percentile(all_ms, 0.95),
+        "p99_ms": percentile(all_ms, 0.99),
+        "seconds": elapsed,
+    }
+    return {"routes": routes, "total": total}
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    for name, base in baseline["routes"].items():
+        cur = current["routes"].get(name)
+        if cur is None:
+            continue
+        if base["p95_ms"] > 0 and cur["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {base['p95_ms']:.2f} -> {cur['p95_ms']:.2f} ms")
+        if cur["errors"] > base["errors"]:
+            regressions.append(f"{name}: errors {base['errors']} -> {cur['errors']}")
+    return regressions
+
+
+def print_report(result: dict):
+    print(f"{'route':<48} {'count':>7} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    rows = list(result["routes"].items()) + [("TOTAL", result["total"])]
+    for name, r in rows:
+        print(f"{name:<48} {r['count']:>7} {r['errors']:>5} {r['rps']:>8.1f} "
+              f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+
+
+@asynccontextmanager
+async def in_process_client(fake: bool):
+    app = app_main.app
+    if fake:
+        db.STORAGE_BACKEND = "memory"
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app") as client:
+            yield client
+
+
+async def run(args) -> dict:
+    if args.url:
+        client_cm = httpx.AsyncClient(base_url=args.url, timeout=30)
+    else:
+        client_cm = in_process_client(args.fake)
+    async with client_cm as client:
+        if args.synth:
+            db = app_main.app.state.mongo[app_main.DB_NAME]
+            ids = await seed(db, args.users, args.groups, args.members, args.bets)
+            entries = traffic(ids, args.synth)
+        else:
+            entries = load_log(args.log, args.limit)
+        return await replay(client, entries, args.concurrency, args.rate)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    target = ap.add_mutually_exclusive_group()
+    target.add_argument("--url", help="base url of a running server")
+    target.add_argument("--fake", action="store_true", help="in-process app on the memory backend")
+    ap.add_argument("--log", default="bench/traffic.jsonl")
+    ap.add_argument("--limit", type=int, help="replay only the first N log entries")
+    ap.add_argument("--synth", type=int, help="in-process only: seed a dataset and replay N synthesized requests")
+    ap.add_argument("--users", type=int, default=2_000)
+    ap.add_argument("--groups", type=int, default=200)
+    ap.add_argument("--members", type=int, default=25)
+    ap.add_argument("--bets", type=int, default=5)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--rate", type=float, default=0, help="requests/s, 0 for as fast as possible")
+    ap.add_argument("--out", help="write results JSON here")
+    ap.add_argument("--baseline", help="results JSON to compare against")
+    ap.add_argument("--threshold", type=float, default=0.2, help="allowed p95 regression, 0.2 = 20%%")
+    args = ap.parse_args()
+    if args.synth and args.url:
+        ap.error("--synth seeds through the app's own client, use it without --url")
+
+    result = asyncio.run(run(args))
+    result["meta"] = {
+        "started_at": datetime.now(UTC).isoformat(),
+        "target": args.url or ("in-process fake" if args.fake else "in-process"),
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "python": platform.python_version(),
+    }
+    print_report(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        for r in regressions:
+            print(f"REGRESSION {r}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
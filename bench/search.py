@@ -0,0 +1,107 @@
+# bench/search.py
+# Latency of username type-ahead as the users collection grows: the prefix range on
+# the username_lc index (search.prefix_search, what GET /users/search runs) vs the
+# case-insensitive anchored regex a client filter would need, which can't use an
+# index and scans. The collection is grown to each of --sizes in turn, and at every
+# size --runs lookups of 1 to 4 character prefixes of existing names are timed.
+# Against a local mongod in a throwaway database, or the memory backend with --fake.
+#
+#   python -m bench.search --sizes 10000,100000,1000000 --runs 200
+import argparse
+import asyncio
+import random
+import re
+import statistics
+
+from bson import ObjectId
+
+import db as db_module
+from bench.timing import percentile, timed
+from indexes import ensure_indexes
+from search import prefix_search, folded, SEARCH_LIMIT
+from serialize import user_shape
+
+BENCH_DB = "hackathon_bench"
+BATCH = 5_000
+SYLLABLES = ["ka", "lo", "mi", "ra", "ve", "an", "jo", "el", "sa", "ni", "to", "be", "Ch", "Ma", "Li", "Zo"]
+# the regex case scans, so it stops here
+MAX_REGEX_SIZE = 100_000
+
+
+def make_users(rng: random.Random, start: int, n: int) -> list[dict]:
+    out = []
+    for i in range(start, start + n):
+        name = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) + str(i)
+        out.append({
+            "_id": ObjectId(),
+            "profile_url": f"https://cdn.example.com/u/{i}.png",
+            "username": name,
+            **folded("username", name),
+            "email": f"user{i}@example.com",
+            "group_ids": [],
+            "average_spending": 10.0,
+            "password_hash": "",
+        })
+    return out
+
+
+async def indexed(users, q: str) -> int:
+    projection = {f: 1 for f in user_shape.getters if f != "_id"}
+    return len(await prefix_search(users, "username", q, projection, SEARCH_LIMIT))
+
+
+async def regex(users, q: str) -> int:
+    filt = {"username": {"$regex": "^" + re.escape(q), "$options": "i"}}
+    return len(await users.find(filt, {"password_hash": 0}).limit(SEARCH_LIMIT).to_list(None))
+
+
+async def lookups(fn, users, queries: list[str]) -> list[float]:
+    it = iter(queries)
+    ms, _ = await timed(lambda: fn(users, next(it)), len(queries))
+    return ms
+
+
+def summary(ms: list[float]) -> str:
+    s = sorted(ms)
+    return (f"median {statistics.median(s):8.2f} ms  p95 {percentile(s, 0.95):8.2f} ms"
+            f"  p99 {percentile(s, 0.99):8.2f} ms")
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10000,100000,1000000", help="collection sizes to measure at, ascending")
+    ap.add_argument("--runs", type=int, default=200, help="lookups per size and case")
+    ap.add_argument("--fake", action="store_true", help="memory backend (memstore.py) instead of a mongod")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    if args.fake:
+        db_module.STORAGE_BACKEND = "memory"
+
+    rng = random.Random(args.seed)
+    client = await db_module.create_client()
+    db = client[BENCH_DB]
+    await ensure_indexes(db)
+    users = db["users"]
+    names: list[str] = []
+    for size in sorted(int(s) for s in args.sizes.split(",")):
+        while len(names) < size:
+            docs = make_users(rng, len(names), min(BATCH, size - len(names)))
+            await users.insert_many(docs, ordered=False)
+            names.extend(d["username"] for d in docs)
+        # prefixes of real names, in the case the user happened to type
+        queries = []
+        for _ in range(args.runs):
+            name = rng.choice(names)
+            q = name[:rng.randint(1, 4)]
+            queries.append(q.lower() if rng.random() < 0.5 else q)
+        print(f"{size} users")
+        print(f"{'prefix range, username_lc':>28}: {summary(await lookups(indexed, users, queries))}")
+        if size <= MAX_REGEX_SIZE:
+            print(f"{'regex ^q, case-insensitive':>28}: {summary(await lookups(regex, users, queries))}")
+
+    await client.drop_database(BENCH_DB)
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
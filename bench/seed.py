@@ -0,0 +1,148 @@
+# bench/seed.py
+# Synthesizes a realistic dataset (users, groups, bets with large user_progress
+# arrays) and a matching traffic log for bench/replay.py.
+#
+# Seeding replaces the users, groups and bets collections of the configured
+# database, so it refuses to run without --wipe.
+#
+#   python -m bench.seed --wipe --users 20000 --groups 2000 --members 25 --bets 5 \
+#       --traffic bench/traffic.jsonl --requests 50000
+import argparse
+import asyncio
+import json
+import random
+from datetime import datetime, timedelta, UTC
+
+from bson import ObjectId
+
+from db import create_client, DB_NAME
+from past_bets import RECENT_PAST_BETS
+from search import fold
+
+BATCH = 5_000
+
+
+async def insert_batched(col, docs):
+    for i in range(0, len(docs), BATCH):
+        await col.insert_many(docs[i:i + BATCH], ordered=False)
+
+
+async def seed(db, users: int, groups: int, members: int, bets: int, seed: int = 1) -> dict:
+    rng = random.Random(seed)
+    now = datetime.now(UTC)
+    for name in ("users", "groups", "bets"):
+        await db[name].delete_many({})
+
+    user_docs = [
+        {
+            "_id": ObjectId(),
+            "profile_url": f"https://cdn.example.com/u/{i}.png",
+            "username": f"user{i}",
+            "username_lc": fold(f"user{i}"),
+            "email": f"user{i}@example.com",
+            "group_ids": [],
+            "average_spending": round(rng.lognormvariate(3, 0.8), 2),
+            "password_hash": "",
+        }
+        for i in range(users)
+    ]
+    group_docs, bet_docs = [], []
+    for g in range(groups):
+        gid = ObjectId()
+        member_docs = rng.sample(user_docs, min(members, len(user_docs)))
+        for u in member_docs:
+            u["group_ids"].append(gid)
+        member_ids = [u["_id"] for u in member_docs]
+        group_bets = []
+        for b in range(bets):
+            start = now + timedelta(days=7 * (b - bets + 1))
+            status = "active" if b == bets - 1 else "finished"
+            group_bets.append({
+                "_id": ObjectId(),
+                "group_id": gid,
+                "title": f"group {g} bet {b}",
+                "user_progress": [
+                    {"user_id": uid, "progress": round(rng.random() * 100, 1), "last_updated": now}
+                    for uid in member_ids
+                ],
+                "start_date": start,
+                "end_date": start + timedelta(days=7),
+                "status": status,
+                "meta": {"stake": str(rng.choice([5, 10, 20]))},
+            })
+        bet_docs.extend(group_bets)
+        group_docs.append({
+            "_id": gid,
+            "name": f"group-{g}",
+            "name_lc": fold(f"group-{g}"),
+            "description": None,
+            "user_ids": member_ids,
+            "current_bet_id": group_bets[-1]["_id"] if group_bets else None,
+            "past_bet_ids": [b["_id"] for b in group_bets[:-1]][-RECENT_PAST_BETS:],
+            "created_at": now,
+            "is_active": True,
+        })
+
+    await insert_batched(db["users"], user_docs)
+    await insert_batched(db["groups"], group_docs)
+    await insert_batched(db["bets"], bet_docs)
+    return {
+        "users": [str(u["_id"]) for u in user_docs],
+        "groups": [str(g["_id"]) for g in group_docs],
+        "bets": [(str(b["_id"]), [str(p["user_id"]) for p in b["user_progress"]]) for b in bet_docs],
+    }
+
+
+# (weight, request builder) pairs; roughly what the mobile app does on a busy evening
+def traffic(ids: dict, n: int, seed: int = 1) -> list[dict]:
+    rng = random.Random(seed)
+    active_bets = [b for b in ids["bets"] if b[1]]
+
+    def progress():
+        bid, uids = rng.choice(active_bets)
+        uid = rng.choice(uids)
+        return {"method": "POST", "path": f"/bets/{bid}/progress/{uid}", "query": {"progress": round(rng.random() * 100, 1)}}
+
+    mix = [
+        (30, progress),
+        (25, lambda: {"method": "GET", "path": f"/bets/{rng.choice(ids['bets'])[0]}"}),
+        (15, lambda: {"method": "GET", "path": f"/groups/{rng.choice(ids['groups'])}"}),
+        (10, lambda: {"method": "GET", "path": f"/users/{rng.choice(ids['users'])}"}),
+        (10, lambda: {"method": "GET", "path": "/bets", "query": {"group_id": rng.choice(ids["groups"]), "limit": 50}}),
+        (10, lambda: {"method": "GET", "path": "/groups", "query": {"limit": 50}}),
+    ]
+    weights = [w for w, _ in mix]
+    builders = [b for _, b in mix]
+    return [rng.choices(builders, weights)[0]() for _ in range(n)]
+
+
+def write_traffic(path: str, entries: list[dict]):
+    with open(path, "w") as f:
+        for e in entries:
+            f.write(json.dumps(e) + "\n")
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=20_000)
+    ap.add_argument("--groups", type=int, default=2_000)
+    ap.add_argument("--members", type=int, default=25)
+    ap.add_argument("--bets", type=int, default=5, help="bets per group")
+    ap.add_argument("--traffic", default="bench/traffic.jsonl")
+    ap.add_argument("--requests", type=int, default=50_000)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--wipe", action="store_true", help=f"allow replacing the data in {DB_NAME}")
+    args = ap.parse_args()
+    if not args.wipe:
+        raise SystemExit(f"refusing to replace users/groups/bets in {DB_NAME!r} without --wipe")
+
+    client = await create_client()
+    ids = await seed(client[DB_NAME], args.users, args.groups, args.members, args.bets, args.seed)
+    client.close()
+    write_traffic(args.traffic, traffic(ids, args.requests, args.seed))
+    print(f"seeded {args.users} users, {args.groups} groups, {args.groups * args.bets} bets; "
+          f"wrote {args.requests} requests to {args.traffic}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+# bench/serialization.py
+# Parity check and microbenchmark for the fast response path in serialize.py.
+# For every list/get endpoint shape it builds BSON-like documents, encodes them the
+# old way (normalize_* then response-model validation and JSON dump, which is what
+# FastAPI does for response_model) and the fast way, asserts the bytes are equal,
+# then times both. Exits non-zero on any parity mismatch. No database needed.
+#
+#   python -m bench.serialization --items 200 --participants 20
+import argparse
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pydantic import TypeAdapter
+
+from models import BetOut, GroupOut, UserOut
+from routers.bets import normalize_bet
+from routers.groups import normalize_group
+from routers.users import normalize_user
+from serialize import respond, bet_shape, group_shape, user_shape
+
+
+def now_ms() -> datetime:
+    # what comes back from mongo: naive UTC with millisecond precision
+    t = datetime.utcnow() - timedelta(seconds=random.randint(0, 10 ** 6))
+    return t.replace(microsecond=t.microsecond // 1000 * 1000)
+
+
+def make_bet(participants: int) -> dict:
+    return {
+        "_id": ObjectId(),
+        "group_id": ObjectId(),
+        "title": f"Walk {random.randint(1, 99)}k steps ☃",
+        "user_progress": [
+            {"user_id": ObjectId(), "progress": random.choice([0, 1, 12.5, random.random() * 100]), "last_updated": now_ms()}
+            for _ in range(participants)
+        ],
+        "start_date": now_ms(),
+        "end_date": now_ms(),
+        "status": random.choice(["planned", "active", "finished"]),
+        "meta": {"stake": "5", "unit": "steps"},
+    }
+
+
+def make_group(members: int) -> dict:
+    return {
+        "_id": ObjectId(),
+        "name": f"group-{random.random()}",
+        "description": random.choice([None, "weekend \"runners\""]),
+        "user_ids": [ObjectId() for _ in range(members)],
+        "past_bet_ids": [ObjectId() for _ in range(5)],
+        "current_bet_id": random.choice([None, ObjectId()]),
+        "created_at": now_ms(),
+        "is_active": random.choice([True, False]),
+    }
+
+
+def make_user(groups: int) -> dict:
+    return {
+        "_id": ObjectId(),
+        "profile_url": "https://example.com/p.png",
+        "username": f"user{random.randint(0, 10 ** 6)}",
+        "email": f"user{random.randint(0, 10 ** 6)}@example.com",
+        "group_ids": [ObjectId() for _ in range(groups)],
+        "average_spending": random.choice([0, 25, 12.75]),
+    }
+
+
+def current_path(adapter: TypeAdapter, normalize, payload) -> bytes:
+    if isinstance(payload, list):
+        value = [normalize(d) for d in payload]
+    else:
+        value = normalize(payload)
+    return adapter.dump_json(adapter.validate_python(value), by_alias=True)
+
+
+def fast_path(shape, normalize, payload) -> bytes:
+    return respond(payload, shape, normalize).body
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--items", type=int, default=200)
+    ap.add_argument("--participants", type=int, default=20)
+    ap.add_argument("--number", type=int, default=50)
+    args = ap.parse_args()
+
+    cases = [
+        ("list_bets", BetOut, normalize_bet, bet_shape, [make_bet(args.participants) for _ in range(args.items)]),
+        ("get_bet", BetOut, normalize_bet, bet_shape, make_bet(args.participants)),
+        ("list_groups", GroupOut, normalize_group, group_shape, [make_group(args.participants) for _ in range(args.items)]),
+        ("get_group", GroupOut, normalize_group, group_shape, make_group(args.participants)),
+        ("list_users", UserOut, normalize_user, user_shape, [make_user(5) for _ in range(args.items)]),
+        ("get_user", UserOut, normalize_user, user_shape, make_user(5)),
+    ]
+    failed = False
+    for name, model, normalize, shape, payload in cases:
+        adapter = TypeAdapter(list[model] if isinstance(payload, list) else model)
+        old = current_path(adapter, normalize, payload)
+        new = fast_path(shape, normalize, payload)
+        parity = old == new
+        failed |= not parity
+        t_old = timeit.timeit(lambda: current_path(adapter, normalize, payload), number=args.number) / args.number
+        t_new = timeit.timeit(lambda: fast_path(shape, normalize, payload), number=args.number) / args.number
+        print(
+            f"{name:>12}: parity {'ok' if parity else 'MISMATCH'}  {len(old):>8} bytes  "
+            f"current {t_old * 1e3:8.3f} ms  fast {t_new * 1e3:8.3f} ms  x{t_old / t_new:5.1f}"
+        )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# bench/sparse_fields.py
+# Response size and server-side cost of ?fields= on bets with large user_progress
+# arrays: the full document vs a title,status fieldset. Each case does what the
+# endpoint does (find with the fieldset's projection, shape, encode), against a
+# local mongod in a throwaway database.
+#
+#   python -m bench.sparse_fields --participants 500 --bets 50 --runs 50
+import argparse
+import asyncio
+import statistics
+from datetime import datetime, timedelta, UTC
+
+from bson import ObjectId
+
+from bench.timing import percentile, timed
+from db import create_client
+from models import BetOut
+from routers.bets import normalize_bet
+from serialize import respond, fieldset, bet_shape
+
+BENCH_DB = "hackathon_bench"
+
+
+def make_bet(gid: ObjectId, participants: int) -> dict:
+    now = datetime.now(UTC)
+    return {
+        "group_id": gid,
+        "title": "Walk 10k steps a day",
+        "user_progress": [
+            {"user_id": ObjectId(), "progress": round(i * 0.37 % 100, 1), "last_updated": now}
+            for i in range(participants)
+        ],
+        "start_date": now,
+        "end_date": now + timedelta(days=7),
+        "status": "active",
+        "meta": {"stake": "10", "unit": "steps"},
+    }
+
+
+async def get_one(col, bid: ObjectId, fields: str | None) -> int:
+    shape, model, projection = fieldset(bet_shape, BetOut, fields)
+    doc = await col.find_one({"_id": bid}, projection)
+    return len(respond(doc, shape, normalize_bet, model=model).body)
+
+
+async def list_page(col, gid: ObjectId, limit: int, fields: str | None) -> int:
+    shape, model, projection = fieldset(bet_shape, BetOut, fields)
+    docs = await col.find({"group_id": gid}, projection).sort("_id", 1).limit(limit).to_list(limit)
+    return len(respond(docs, shape, normalize_bet, model=model).body)
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--participants", type=int, default=500)
+    ap.add_argument("--bets", type=int, default=50, help="bets in the listed page")
+    ap.add_argument("--fields", default="title,status")
+    ap.add_argument("--runs", type=int, default=50)
+    args = ap.parse_args()
+
+    client = await create_client()
+    col = client[BENCH_DB]["bets"]
+    gid = ObjectId()
+    res = await col.insert_many([make_bet(gid, args.participants) for _ in range(args.bets)])
+    bid = res.inserted_ids[0]
+
+    cases = {
+        "get, full": lambda: get_one(col, bid, None),
+        f"get, fields={args.fields}": lambda: get_one(col, bid, args.fields),
+        f"list {args.bets}, full": lambda: list_page(col, gid, args.bets, None),
+        f"list {args.bets}, fields={args.fields}": lambda: list_page(col, gid, args.bets, args.fields),
+    }
+    print(f"bets with {args.participants} participants")
+    for name, fn in cases.items():
+        ms, size = await timed(fn, args.runs)
+        print(f"{name:>36}: {size:>10} bytes  median {statistics.median(ms):8.2f} ms"
+              f"  p95 {percentile(sorted(ms), 0.95):8.2f} ms")
+
+    await client.drop_database(BENCH_DB)
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
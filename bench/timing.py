@@ -0,0 +1,29 @@
+# bench/timing.py
+# Latency helpers shared by the bench scripts.
+import time
+
+
+def percentile(sorted_ms: list[float], q: float) -> float:
+    if not sorted_ms:
+        return 0.0
+    return sorted_ms[min(len(sorted_ms) - 1, round(q * (len(sorted_ms) - 1)))]
+
+
+async def timed(fn, runs: int):
+    # awaits fn() runs times; returns the latencies in ms and the last result
+    out, result = [], None
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        result = await fn()
+        out.append((time.perf_counter() - t0) * 1000)
+    return out, result
+
+
+def timed_sync(fn, runs: int):
+    # timed() for plain functions
+    out, result = [], None
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        result = fn()
+        out.append((time.perf_counter() - t0) * 1000)
+    return out, result
@@ -0,0 +1,84 @@
+# bench/user_bets.py
+# GET /users/{id}/bets (one query on the user_progress.user_id index, returning only
+# the user's own progress entry) vs what clients do today: read the user, then
+# GET /bets?group_id= for each of their groups and filter locally. Measured at the
+# Mongo level against a local mongod, in a throwaway database, for the user who is
+# in the most groups.
+#
+#   python -m bench.user_bets --users 200 --groups 200 --members 25 --bets 5 --runs 50
+import argparse
+import asyncio
+import statistics
+
+import bson
+from bson import ObjectId
+
+from bench.seed import seed
+from bench.timing import percentile, timed
+from db import create_client
+from indexes import ensure_indexes
+from serialize import bet_shape
+
+BENCH_DB = "hackathon_bench"
+
+
+async def multi_call(db, uid: ObjectId, concurrent: bool) -> tuple[int, int]:
+    user = await db["users"].find_one({"_id": uid}, {"password_hash": 0})
+    bets = db["bets"]
+
+    async def group_bets(gid):
+        return await bets.find({"group_id": gid}).sort("_id", 1).to_list(None)
+
+    if concurrent:
+        pages = await asyncio.gather(*(group_bets(gid) for gid in user["group_ids"]))
+    else:
+        pages = [await group_bets(gid) for gid in user["group_ids"]]
+    docs = [d for page in pages for d in page]
+    mine = [d for d in docs if any(p["user_id"] == uid for p in d.get("user_progress", []))]
+    return len(mine), sum(len(bson.encode(d)) for d in docs)
+
+
+async def single_query(db, uid: ObjectId) -> tuple[int, int]:
+    projection = {f: 1 for f in bet_shape.getters if f != "_id"}
+    projection["user_progress"] = {"$elemMatch": {"user_id": uid}}
+    docs = await db["bets"].find({"user_progress.user_id": uid}, projection).sort("_id", 1).to_list(None)
+    return len(docs), sum(len(bson.encode(d)) for d in docs)
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--groups", type=int, default=200)
+    ap.add_argument("--members", type=int, default=25)
+    ap.add_argument("--bets", type=int, default=5, help="bets per group")
+    ap.add_argument("--runs", type=int, default=50)
+    args = ap.parse_args()
+
+    client = await create_client()
+    db = client[BENCH_DB]
+    await ensure_indexes(db)
+    await seed(db, users=args.users, groups=args.groups, members=args.members, bets=args.bets)
+    user = await db["users"].aggregate([
+        {"$project": {"n": {"$size": "$group_ids"}}},
+        {"$sort": {"n": -1}},
+        {"$limit": 1},
+    ]).to_list(1)
+    uid, groups = user[0]["_id"], user[0]["n"]
+
+    cases = {
+        "per-group calls (sequential)": lambda: multi_call(db, uid, concurrent=False),
+        "per-group calls (concurrent)": lambda: multi_call(db, uid, concurrent=True),
+        "GET /users/{id}/bets query": lambda: single_query(db, uid),
+    }
+    print(f"user in {groups} groups")
+    for name, fn in cases.items():
+        ms, (bets, size) = await timed(fn, args.runs)
+        print(f"{name:>30}: {bets:>4} bets  {size:>10} bytes read  median {statistics.median(ms):8.2f} ms"
+              f"  p95 {percentile(sorted(ms), 0.95):8.2f} ms")
+
+    await client.drop_database(BENCH_DB)
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+# cache.py
+# Bounded read-through cache for single-document GETs. Holds already-normalized
+# documents keyed by _id, with LRU eviction, a TTL and a size cap. Every write path
+# must call invalidate() for the ids it touches.
+import time
+from collections import OrderedDict
+
+CACHE_ENABLED = True
+CACHE_TTL_S = 30.0
+CACHE_MAX_ENTRIES = 10_000
+
+
+class DocCache:
+    def __init__(
+        self,
+        ttl: float = CACHE_TTL_S,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        enabled: bool = CACHE_ENABLED,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._data: OrderedDict = OrderedDict()
+        # invalidation bookkeeping so a read that raced a write can't put stale data
+        # back: every invalidation bumps the generation and remembers it per key
+        self._generation = 0
+        self._invalidated: OrderedDict = OrderedDict()
+        self._floor = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    # read this before fetching from Mongo and hand it back to put()
+    def generation(self) -> int:
+        return self._generation
+
+    def put(self, key, value, generation: int):
+        if not self.enabled:
+            return
+        if generation < self._floor or self._invalidated.get(key, -1) > generation:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *keys):
+        self._generation += 1
+        for key in keys:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+            self._invalidated[key] = self._generation
+            self._invalidated.move_to_end(key)
+        while len(self._invalidated) > self.max_entries:
+            _, gen = self._invalidated.popitem(last=False)
+            self._floor = max(self._floor, gen)
+
+    def clear(self):
+        self._generation += 1
+        self._floor = self._generation
+        self._data.clear()
+        self._invalidated.clear()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+def create_caches() -> dict[str, DocCache]:
+    return {name: DocCache() for name in ("bets", "groups", "users")}
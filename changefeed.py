@@ -0,0 +1,164 @@
+# changefeed.py
+# Tails a change stream on the watched collections. Every event invalidates the
+# matching in-process cache entry, so several uvicorn workers converge on the same
+# data, and bet changes are fanned out to live progress subscribers.
+# Change streams need a replica set; a single-node one is enough for local work:
+#   mongod --replSet rs0 && mongosh --eval "rs.initiate()"
+import asyncio
+import logging
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pymongo.errors import OperationFailure, PyMongoError
+
+CHANGE_STREAM_ENABLED = True
+WATCHED_COLLECTIONS = ("bets", "groups", "users")
+SUBSCRIBER_QUEUE_SIZE = 16
+RETRY_BACKOFF_S = (0.5, 1, 2, 5, 10)
+
+# server error code for "The $changeStream stage is only supported on replica sets"
+NOT_A_REPLICA_SET = 40573
+# the driver already retried a resumable error once; anything else (e.g.
+# ChangeStreamHistoryLost, the token fell off the oplog) can't resume from the token
+RESUMABLE_LABEL = "ResumableChangeStreamError"
+
+log = logging.getLogger(__name__)
+
+
+class Subscription:
+    def __init__(self, bet_id: ObjectId, maxsize: int):
+        self.bet_id = bet_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+
+class ProgressBroker:
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subs: dict[ObjectId, set[Subscription]] = {}
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, bet_id: ObjectId) -> Subscription:
+        sub = Subscription(bet_id, self.queue_size)
+        self._subs.setdefault(bet_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        subs = self._subs.get(sub.bet_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subs[sub.bet_id]
+
+    def has_subscribers(self, bet_id: ObjectId) -> bool:
+        return bet_id in self._subs
+
+    def publish(self, bet_id: ObjectId, event: dict):
+        for sub in self._subs.get(bet_id, ()):
+            self.published += 1
+            try:
+                sub.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # events carry the whole user_progress snapshot, so dropping the
+                # oldest one for a slow consumer loses nothing but an intermediate state
+                sub.queue.get_nowait()
+                sub.queue.put_nowait(event)
+                sub.dropped += 1
+                self.dropped += 1
+
+    def stats(self) -> dict:
+        return {
+            "bets": len(self._subs),
+            "subscribers": sum(len(s) for s in self._subs.values()),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
+
+
+def progress_event(bet_id: ObjectId, doc: dict | None) -> dict:
+    if doc is None:
+        return {"_id": str(bet_id), "deleted": True}
+    return jsonable_encoder({
+        "_id": str(bet_id),
+        "status": doc.get("status"),
+        "user_progress": [
+            {**p, "user_id": str(p.get("user_id"))} for p in doc.get("user_progress") or []
+        ],
+    })
+
+
+class ChangeFeed:
+    def __init__(self, db, caches: dict, broker: ProgressBroker):
+        self.db = db
+        self.caches = caches
+        self.broker = broker
+        self.available = True
+        self.events = 0
+        self.restarts = 0
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                # don't let a dead feed take the rest of shutdown down with it
+                log.exception("change feed task failed")
+            self._task = None
+
+    async def _run(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": list(WATCHED_COLLECTIONS)}}}]
+        resume_token = None
+        attempt = 0
+        while True:
+            try:
+                async with self.db.watch(
+                    pipeline, full_document="updateLookup", resume_after=resume_token
+                ) as stream:
+                    attempt = 0
+                    async for change in stream:
+                        resume_token = change["_id"]
+                        self._handle(change)
+            except OperationFailure as e:
+                if e.code == NOT_A_REPLICA_SET:
+                    log.warning("change streams unavailable (not a replica set), live updates disabled")
+                    self.available = False
+                    return
+                log.exception("change stream failed")
+                if not e.has_error_label(RESUMABLE_LABEL):
+                    # start from now; the caches are cleared below, which covers the gap
+                    resume_token = None
+            except PyMongoError:
+                log.exception("change stream failed")
+            except Exception:
+                # a bad event or a bug in _handle; keep tailing rather than let the
+                # task die while available still says True
+                log.exception("change stream handler failed")
+            # whatever we missed while reconnecting could be stale in the caches
+            for cache in self.caches.values():
+                cache.clear()
+            self.restarts += 1
+            await asyncio.sleep(RETRY_BACKOFF_S[min(attempt, len(RETRY_BACKOFF_S) - 1)])
+            attempt += 1
+
+    def _handle(self, change: dict):
+        self.events += 1
+        coll = change["ns"]["coll"]
+        key = change.get("documentKey", {}).get("_id")
+        if key is None:
+            return
+        cache = self.caches.get(coll)
+        if cache is not None:
+            cache.invalidate(key)
+        if coll == "bets" and self.broker.has_subscribers(key):
+            self.broker.publish(key, progress_event(key, change.get("fullDocument")))
+
+    def stats(self) -> dict:
+        return {"available": self.available, "events": self.events, "restarts": self.restarts}
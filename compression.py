@@ -0,0 +1,141 @@
+# compression.py
+# Negotiated gzip/brotli response compression. CompressionMiddleware compresses JSON
+# responses from COMPRESS_MIN_BYTES up (the list endpoints, in practice); exports
+# compress their stream as it goes with the same negotiation (export.py). Brotli is
+# preferred when the client accepts it and the brotli package is installed
+# (pip install brotli), gzip otherwise.
+#
+# Responses carrying an ETag are sent as they are: a strong ETag names one exact byte
+# sequence, and single documents gain more from a 304 than from compression.
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_ENABLED = True
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+# quality 11 is far too slow for compressing on the fly
+BROTLI_QUALITY = 4
+COMPRESSIBLE_TYPES = {"application/json", "application/x-ndjson"}
+
+
+def negotiate(accept_encoding: str | None) -> str | None:
+    # the preferred encoding the client accepts; q=0 turns one off
+    prefs = {}
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name.strip():
+            prefs[name.strip()] = q
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if prefs.get(encoding, prefs.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._z = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._br.process(data) if self.encoding == "br" else self._z.compress(data)
+
+    def finish(self) -> bytes:
+        return self._br.finish() if self.encoding == "br" else self._z.flush()
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    c = Compressor(encoding)
+    return c.compress(data) + c.finish()
+
+
+async def compress_stream(chunks, encoding: str):
+    c = Compressor(encoding)
+    async for chunk in chunks:
+        out = c.compress(chunk)
+        if out:
+            yield out
+    yield c.finish()
+
+
+class CompressionStats:
+    def __init__(self):
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def stats(self) -> dict:
+        return {
+            "enabled": COMPRESSION_ENABLED,
+            "brotli": brotli is not None,
+            "compressed": self.compressed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
+
+
+COMPRESSION = CompressionStats()
+
+
+class CompressionMiddleware:
+    def __init__(self, app, min_bytes: int = COMPRESS_MIN_BYTES, counters: CompressionStats = COMPRESSION):
+        self.app = app
+        self.min_bytes = min_bytes
+        self.counters = counters
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not COMPRESSION_ENABLED:
+            return await self.app(scope, receive, send)
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        start = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough
+            if passthrough:
+                return await send(message)
+            if message["type"] == "http.response.start":
+                # held back until the first body message shows whether to compress
+                start = message
+                return
+            headers = MutableHeaders(scope=start)
+            passthrough = True
+            if headers.get("content-type", "").split(";")[0].strip() not in COMPRESSIBLE_TYPES:
+                await send(start)
+                return await send(message)
+            if "accept-encoding" not in headers.get("vary", "").lower():
+                headers.add_vary_header("Accept-Encoding")
+            body = message.get("body", b"")
+            # streamed bodies (exports) handle their own compression
+            if (encoding is None or message.get("more_body") or len(body) < self.min_bytes
+                    or "content-encoding" in headers or "etag" in headers):
+                await send(start)
+                return await send(message)
+            out = compress(body, encoding)
+            self.counters.compressed += 1
+            self.counters.bytes_in += len(body)
+            self.counters.bytes_out += len(out)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(out))
+            await send(start)
+            await send({"type": "http.response.body", "body": out})
+
+        await self.app(scope, receive, send_wrapper)
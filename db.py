@@ -1,15 +1,29 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 
+from memstore import MemoryClient
+from metrics import MongoCommandListener, MongoPoolListener
+
 MONGO_URI = "mongodb://localhost:27017"
 DB_NAME = "hackathon"
+# admission.py caps concurrent requests at this, so requests queue in the app
+# (with a deadline) rather than in the driver waiting for a connection
+MAX_POOL_SIZE = 100
+# "mongo": the server at MONGO_URI. "memory": memstore.py, the same client API held
+# in this process (nothing persists), for running the app and the benches without
+# a mongod
+STORAGE_BACKEND = "mongo"
 
-async def create_client() -> AsyncIOMotorClient:
+async def create_client() -> AsyncIOMotorClient | MemoryClient:
+    if STORAGE_BACKEND == "memory":
+        return MemoryClient()
     client = AsyncIOMotorClient(
         MONGO_URI,
         serverSelectionTimeoutMS=2000,
         connectTimeoutMS=2000,
         socketTimeoutMS=5000,
         retryWrites=True,
+        maxPoolSize=MAX_POOL_SIZE,
+        event_listeners=[MongoCommandListener(), MongoPoolListener()],
     )
     await client.admin.command("ping")
     return client
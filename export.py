@@ -0,0 +1,36 @@
+# export.py
+# Streaming NDJSON exports. One Mongo cursor sorted by _id feeds the response in
+# batches, so memory stays flat however big the collection is; a gzip or brotli
+# stream (compression.py) is compressed as it goes. Clients resume an interrupted
+# export by passing the last _id they received as `after`.
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from compression import negotiate, compress_stream
+from serialize import encode_line
+
+EXPORT_BATCH_SIZE = 1_000
+MAX_EXPORT_BATCH_SIZE = 10_000
+# hand bytes to the server in chunks of roughly this size
+CHUNK_BYTES = 64 * 1024
+
+
+async def _lines(cursor, shape, normalize, model):
+    buf = bytearray()
+    async for doc in cursor:
+        buf += encode_line(doc, shape, normalize, model)
+        if len(buf) >= CHUNK_BYTES:
+            yield bytes(buf)
+            buf.clear()
+    if buf:
+        yield bytes(buf)
+
+
+def ndjson_export(request: Request, cursor, shape, normalize, model) -> StreamingResponse:
+    body = _lines(cursor, shape, normalize, model)
+    headers = {"Cache-Control": "no-store", "Vary": "Accept-Encoding"}
+    encoding = negotiate(request.headers.get("accept-encoding"))
+    if encoding is not None:
+        body = compress_stream(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return StreamingResponse(body, media_type="application/x-ndjson", headers=headers)
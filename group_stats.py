@@ -0,0 +1,254 @@
+# group_stats.py
+# Materialized per-group summary behind GET /groups/{id}/stats, one document per
+# group in the group_stats collection. The write paths keep it current with $inc
+# deltas: join/leave move a member in or out, patch_user moves a member's spending
+# between buckets, and progress writes move a participant between completion
+# buckets. Reads are a single _id lookup whose size doesn't depend on the member
+# count; the median is only an estimate, interpolated from the spending buckets.
+# Completion is kept for open bets only: finishing or cancelling a bet removes its
+# entry, so the document doesn't grow with the group's history.
+#
+# Increments can drift: direct database edits, or a crash between a write and its
+# stats update. A rebuild recomputes the documents from users/groups/bets:
+#
+#   python group_stats.py                 # every group
+#   python group_stats.py --group <id>    # one group
+import argparse
+import asyncio
+from bisect import bisect_right
+from datetime import datetime, UTC
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+GROUP_STATS_ENABLED = True
+# upper bounds of the spending buckets; the last bucket is open-ended
+SPENDING_BUCKETS = (5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+# upper bounds of the progress buckets; progress >= 100 counts as completed
+COMPLETION_BUCKETS = (25, 50, 75, 100)
+# bets in these states have no completion entry
+CLOSED_STATUSES = ("finished", "cancelled")
+
+
+def _labels(bounds: tuple) -> tuple[str, ...]:
+    lows = (0,) + bounds
+    return tuple(f"{lo}-{hi}" for lo, hi in zip(lows, bounds)) + (f"{bounds[-1]}+",)
+
+
+SPENDING_LABELS = _labels(SPENDING_BUCKETS)
+COMPLETION_LABELS = _labels(COMPLETION_BUCKETS)
+
+
+def spending_bucket(value: float) -> str:
+    return SPENDING_LABELS[bisect_right(SPENDING_BUCKETS, value)]
+
+
+def completion_bucket(progress: float) -> str:
+    return COMPLETION_LABELS[bisect_right(COMPLETION_BUCKETS, progress)]
+
+
+def is_open(bet: dict) -> bool:
+    return bet.get("status") not in CLOSED_STATUSES
+
+
+def _touch() -> dict:
+    return {"$set": {"updated_at": datetime.now(UTC)}}
+
+
+def member_op(gid: ObjectId, spending: float, sign: int) -> UpdateOne:
+    # a member joined (sign=1) or left (sign=-1)
+    return UpdateOne(
+        {"_id": gid},
+        {"$inc": {
+            "member_count": sign,
+            "spending_sum": sign * spending,
+            f"spending_hist.{spending_bucket(spending)}": sign,
+        }, **_touch()},
+        upsert=True,
+    )
+
+
+def spending_ops(group_ids: list[ObjectId], old: float, new: float) -> list[UpdateOne]:
+    inc = {"spending_sum": new - old}
+    if spending_bucket(old) != spending_bucket(new):
+        inc[f"spending_hist.{spending_bucket(old)}"] = -1
+        inc[f"spending_hist.{spending_bucket(new)}"] = 1
+    return [UpdateOne({"_id": gid}, {"$inc": inc, **_touch()}, upsert=True) for gid in group_ids]
+
+
+def progress_inc(bid: ObjectId, old: float | None, new: float, inc: dict | None = None) -> dict:
+    # $inc fields for one participant's progress going from old (None: new entry) to
+    # new; pass inc to accumulate several changes to one group into one update
+    inc = {} if inc is None else inc
+    base = f"completion.{bid}"
+
+    def add(field, n):
+        inc[f"{base}.{field}"] = inc.get(f"{base}.{field}", 0) + n
+
+    if old is None:
+        add("participants", 1)
+        add("progress_sum", new)
+        add(f"buckets.{completion_bucket(new)}", 1)
+    else:
+        add("progress_sum", new - old)
+        if completion_bucket(old) != completion_bucket(new):
+            add(f"buckets.{completion_bucket(old)}", -1)
+            add(f"buckets.{completion_bucket(new)}", 1)
+    return inc
+
+
+def progress_op(gid: ObjectId, inc: dict) -> UpdateOne:
+    return UpdateOne({"_id": gid}, {"$inc": inc, **_touch()}, upsert=True)
+
+
+async def progress_before(bets, bids) -> dict[ObjectId, dict]:
+    # the bets a batch of progress writes touches, read before it's written: each
+    # bet's group, whether it's open, and its participants' progress, which the
+    # deltas are taken from
+    out = {}
+    projection = {"group_id": 1, "status": 1, "user_progress.user_id": 1, "user_progress.progress": 1}
+    async for doc in bets.find({"_id": {"$in": list(bids)}}, projection):
+        out[doc["_id"]] = {
+            "group_id": doc["group_id"],
+            "open": is_open(doc),
+            "progress": {p.get("user_id"): p.get("progress", 0.0) for p in doc.get("user_progress") or []},
+        }
+    return out
+
+
+def batch_progress_ops(before: dict[ObjectId, dict], writes) -> list[UpdateOne]:
+    # one update per group for (bet_id, user_id, progress) writes made after before
+    # was read; closed and missing bets have no completion entry
+    incs: dict[ObjectId, dict] = {}
+    for bid, uid, progress in writes:
+        bet = before.get(bid)
+        if bet is None or not bet["open"]:
+            continue
+        gid = bet["group_id"]
+        incs[gid] = progress_inc(bid, bet["progress"].get(uid), progress, incs.get(gid))
+    return [progress_op(gid, inc) for gid, inc in incs.items()]
+
+
+def bet_completion(entries: list[dict]) -> dict:
+    buckets: dict[str, int] = {}
+    for p in entries:
+        label = completion_bucket(p.get("progress", 0.0))
+        buckets[label] = buckets.get(label, 0) + 1
+    return {
+        "participants": len(entries),
+        "progress_sum": sum(p.get("progress", 0.0) for p in entries),
+        "buckets": buckets,
+    }
+
+
+# a bet created with, or patched to, a whole progress list
+def set_bet_op(gid: ObjectId, bid: ObjectId, entries: list[dict]) -> UpdateOne:
+    return UpdateOne(
+        {"_id": gid},
+        {"$set": {f"completion.{bid}": bet_completion(entries), "updated_at": datetime.now(UTC)}},
+        upsert=True,
+    )
+
+
+def unset_bet_op(gid: ObjectId, bid: ObjectId) -> UpdateOne:
+    return UpdateOne({"_id": gid}, {"$unset": {f"completion.{bid}": ""}, **_touch()})
+
+
+async def apply(col, ops: list[UpdateOne]):
+    if GROUP_STATS_ENABLED and ops:
+        await col.bulk_write(ops, ordered=False)
+
+
+def _median(hist: dict, count: int) -> float | None:
+    # linear interpolation inside the bucket holding the middle member; the buckets
+    # are coarse, so this is an estimate (0/10/20 gives 15, not 10)
+    if count <= 0:
+        return None
+    half = count / 2
+    seen = 0
+    lows = (0,) + SPENDING_BUCKETS
+    for i, label in enumerate(SPENDING_LABELS):
+        n = hist.get(label, 0)
+        if n > 0 and seen + n >= half:
+            if i == len(SPENDING_BUCKETS):
+                return float(lows[i])
+            return lows[i] + (SPENDING_BUCKETS[i] - lows[i]) * (half - seen) / n
+        seen += n
+    return None
+
+
+def shape_stats(gid: ObjectId, doc: dict | None, bid: ObjectId | None) -> dict:
+    doc = doc or {}
+    count = doc.get("member_count", 0)
+    hist = doc.get("spending_hist", {})
+    current = None
+    if bid is not None:
+        bet = (doc.get("completion") or {}).get(str(bid)) or {}
+        participants = bet.get("participants", 0)
+        buckets = bet.get("buckets", {})
+        current = {
+            "bet_id": str(bid),
+            "participants": participants,
+            "mean_progress": bet.get("progress_sum", 0.0) / participants if participants else None,
+            "distribution": {label: buckets.get(label, 0) for label in COMPLETION_LABELS},
+        }
+    return {
+        "group_id": str(gid),
+        "member_count": count,
+        "mean_spending": doc.get("spending_sum", 0.0) / count if count else None,
+        "median_spending_estimate": _median(hist, count),
+        "spending_distribution": {label: hist.get(label, 0) for label in SPENDING_LABELS},
+        "current_bet": current,
+        "updated_at": doc.get("updated_at"),
+    }
+
+
+async def compute(db, group: dict) -> dict:
+    # the full summary of one group, from scratch
+    doc = {"_id": group["_id"], "member_count": 0, "spending_sum": 0.0, "spending_hist": {}, "completion": {}}
+    async for u in db["users"].find({"_id": {"$in": group.get("user_ids") or []}}, {"average_spending": 1}):
+        s = float(u.get("average_spending", 0.0))
+        doc["member_count"] += 1
+        doc["spending_sum"] += s
+        label = spending_bucket(s)
+        doc["spending_hist"][label] = doc["spending_hist"].get(label, 0) + 1
+    open_bets = {"group_id": group["_id"], "status": {"$nin": list(CLOSED_STATUSES)}}
+    async for bet in db["bets"].find(open_bets, {"user_progress.progress": 1}):
+        if bet.get("user_progress"):
+            doc["completion"][str(bet["_id"])] = bet_completion(bet["user_progress"])
+    doc["updated_at"] = datetime.now(UTC)
+    return doc
+
+
+async def rebuild(db, gid: ObjectId | None = None) -> int:
+    # replaces the summaries of one or all groups; increments that land while a
+    # group is being recomputed can be lost, so run it when traffic is low
+    filt = {"_id": gid} if gid is not None else {}
+    n = 0
+    async for group in db["groups"].find(filt, {"user_ids": 1}):
+        await db["group_stats"].replace_one({"_id": group["_id"]}, await compute(db, group), upsert=True)
+        n += 1
+    if gid is None:
+        # summaries of groups that no longer exist
+        live = await db["groups"].distinct("_id")
+        await db["group_stats"].delete_many({"_id": {"$nin": live}})
+    return n
+
+
+async def main():
+    from db import create_client, DB_NAME
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--group", help="rebuild only this group id")
+    args = ap.parse_args()
+
+    client = await create_client()
+    try:
+        n = await rebuild(client[DB_NAME], ObjectId(args.group) if args.group else None)
+    finally:
+        client.close()
+    print(f"rebuilt stats for {n} group(s)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
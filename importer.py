@@ -0,0 +1,239 @@
+# importer.py
+# Streaming bulk import of users, groups and bets from NDJSON or CSV. Rows are
+# parsed as they arrive, validated against the *Create models and written with
+# unordered insert_many batches; a bad or duplicate row is reported by row number
+# instead of aborting the import. Used by the POST /<collection>/import endpoints
+# and runnable as a CLI:
+#
+#   python importer.py users partner-users.csv
+#   python importer.py bets nightly-bets.ndjson --batch-size 2000
+import argparse
+import asyncio
+import codecs
+import csv
+import inspect
+import json
+import sys
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+IMPORT_BATCH_SIZE = 1_000
+# keep the report bounded when a whole file is rejected
+MAX_REPORTED_ERRORS = 1_000
+
+DUPLICATE_KEY = 11000
+
+
+async def _lines(chunks):
+    # split an async byte stream into lines without buffering the whole body; lines
+    # stay bytes so a bad byte fails its own row, not the import
+    tail = b""
+    first = True
+    async for chunk in chunks:
+        tail += chunk
+        if first and len(tail) >= len(codecs.BOM_UTF8):
+            # editors that save "UTF-8 with BOM" would otherwise rename the first column
+            tail = tail.removeprefix(codecs.BOM_UTF8)
+            first = False
+        *lines, tail = tail.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r")
+    if first:
+        tail = tail.removeprefix(codecs.BOM_UTF8)
+    if tail:
+        yield tail.rstrip(b"\r")
+
+
+def _csv_cell(value: str):
+    # empty cells fall back to model defaults; list/dict cells are written as JSON
+    if value == "":
+        return None
+    if value[:1] in "[{":
+        return json.loads(value)
+    return value
+
+
+async def iter_rows(chunks, fmt: str):
+    # yields (row number, dict) or (row number, error message); quoted CSV fields
+    # can't span lines since rows are parsed one line at a time
+    header = None
+    row_no = 0
+    async for raw in _lines(chunks):
+        if not raw.strip():
+            continue
+        if fmt == "csv" and header is None:
+            # a bad byte in the header shows up as an unknown column on every row
+            header = next(csv.reader([raw.decode("utf-8", errors="replace")]))
+            continue
+        row_no += 1
+        try:
+            line = raw.decode("utf-8")
+            if fmt == "csv":
+                values = next(csv.reader([line]))
+                if len(values) != len(header):
+                    raise ValueError(f"expected {len(header)} columns, got {len(values)}")
+                row = {k: v for k, v in ((k, _csv_cell(v)) for k, v in zip(header, values)) if v is not None}
+            else:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError("expected a JSON object")
+        except ValueError as e:
+            yield row_no, f"unparseable row: {e}"
+            continue
+        yield row_no, row
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors: list[dict] = []
+
+    def fail(self, row: int, error: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "error": error})
+
+    def as_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": sorted(self.errors, key=lambda e: e["row"]),
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+async def _flush(col, batch: list[tuple[int, dict]], report: ImportReport, on_inserted):
+    if not batch:
+        return
+    docs = [doc for _, doc in batch]
+    failed: set[int] = set()
+    try:
+        await col.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        for err in e.details.get("writeErrors", []):
+            idx = err["index"]
+            failed.add(idx)
+            if err.get("code") == DUPLICATE_KEY:
+                key = ", ".join(f"{k}={v!r}" for k, v in (err.get("keyValue") or {}).items())
+                report.fail(batch[idx][0], f"duplicate: {key}" if key else "duplicate key")
+            else:
+                report.fail(batch[idx][0], err.get("errmsg", "write failed"))
+    inserted = [doc for i, doc in enumerate(docs) if i not in failed]
+    report.inserted += len(inserted)
+    if on_inserted is not None and inserted:
+        res = on_inserted(inserted)
+        if inspect.isawaitable(res):
+            await res
+
+
+async def import_rows(
+    col,
+    chunks,
+    fmt: str,
+    model,
+    to_storage,
+    password_pool=None,
+    batch_size: int = IMPORT_BATCH_SIZE,
+    on_inserted=None,
+) -> dict:
+    report = ImportReport()
+    pending: list[tuple[int, object]] = []
+
+    async def convert_and_flush():
+        batch = []
+        payloads = [(row_no, p) for row_no, p in pending]
+        hashes = [None] * len(payloads)
+        if password_pool is not None:
+            # hashed on the pool off the event loop, a chunk at a time so logins
+            # aren't stuck behind the whole batch
+            hashes = await password_pool.hash_many([p.password for _, p in payloads])
+        for (row_no, payload), pw_hash in zip(payloads, hashes):
+            try:
+                doc = to_storage(payload)
+            except HTTPException as e:
+                report.fail(row_no, str(e.detail))
+                continue
+            if pw_hash is not None:
+                doc["password_hash"] = pw_hash
+            batch.append((row_no, doc))
+        pending.clear()
+        await _flush(col, batch, report, on_inserted)
+
+    async for row_no, row in iter_rows(chunks, fmt):
+        report.rows += 1
+        if isinstance(row, str):
+            report.fail(row_no, row)
+            continue
+        try:
+            payload = model.model_validate(row)
+        except ValidationError as e:
+            report.fail(row_no, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+            continue
+        pending.append((row_no, payload))
+        if len(pending) >= batch_size:
+            await convert_and_flush()
+    await convert_and_flush()
+    return report.as_dict()
+
+
+def import_format(content_type: str | None, filename: str | None = None) -> str:
+    if (content_type or "").split(";")[0].strip() == "text/csv" or (filename or "").endswith(".csv"):
+        return "csv"
+    return "ndjson"
+
+
+async def _file_chunks(path: str, size: int = 64 * 1024):
+    with open(path, "rb") as f:
+        while chunk := f.read(size):
+            yield chunk
+
+
+async def main():
+    from db import create_client, DB_NAME
+    from models import UserCreate, GroupCreate, BetCreate
+    from passwords import PasswordPool
+    from routers.bets import bet_to_storage
+    from routers.groups import group_to_storage
+    from routers.users import user_to_storage
+
+    specs = {
+        "users": (UserCreate, user_to_storage),
+        "groups": (GroupCreate, group_to_storage),
+        "bets": (BetCreate, bet_to_storage),
+    }
+    ap = argparse.ArgumentParser()
+    ap.add_argument("collection", choices=sorted(specs))
+    ap.add_argument("path")
+    ap.add_argument("--format", choices=["ndjson", "csv"])
+    ap.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = ap.parse_args()
+
+    model, to_storage = specs[args.collection]
+    client = await create_client()
+    pool = PasswordPool() if args.collection == "users" else None
+    try:
+        report = await import_rows(
+            client[DB_NAME][args.collection],
+            _file_chunks(args.path),
+            args.format or import_format(None, args.path),
+            model,
+            to_storage,
+            password_pool=pool,
+            batch_size=args.batch_size,
+        )
+    finally:
+        if pool is not None:
+            pool.close()
+        client.close()
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    sys.exit(1 if report["failed"] else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,164 @@
+# indexes.py
+# Creates the indexes declared in models.INDEXES. Existing indexes are read with
+# list_indexes() and only the missing ones are built, in one create_indexes call
+# per collection with all collections in parallel, so a warm boot is a handful of
+# cheap reads. INDEX_MODE picks when that happens:
+#
+#   "startup"     build before serving requests (default)
+#   "background"  serve immediately, build in a task (queries that need a missing
+#                 index scan until it exists)
+#   "off"         don't touch indexes; run `python indexes.py` during deploys
+#
+# Only `python indexes.py` drops indexes: the ones in models.RETIRED_INDEXES, after
+# the missing ones are built so a query never loses the index it was using.
+import argparse
+import asyncio
+import logging
+import time
+
+from pymongo.errors import OperationFailure
+
+from models import INDEXES, RETIRED_INDEXES
+
+INDEX_MODE = "startup"
+
+log = logging.getLogger(__name__)
+
+
+def _key(spec) -> tuple:
+    return tuple((field, direction) for field, direction in spec.items())
+
+
+async def missing_indexes(col, wanted) -> list:
+    existing = {}
+    async for info in col.list_indexes():
+        existing[_key(info["key"])] = info
+    missing = []
+    for model in wanted:
+        doc = model.document
+        found = existing.get(_key(doc["key"]))
+        if found is None:
+            missing.append(model)
+        elif bool(found.get("unique")) != bool(doc.get("unique")):
+            # same keys with different options can't be created alongside; leave it to an operator
+            log.warning("%s: index %s exists with different options, skipping", col.name, found["name"])
+    return missing
+
+
+async def _ensure_collection(col, wanted) -> list[str]:
+    missing = await missing_indexes(col, wanted)
+    if not missing:
+        return []
+    return await col.create_indexes(missing)
+
+
+async def ensure_indexes(db, indexes=INDEXES) -> dict[str, list[str]]:
+    # returns the names of the indexes that were created, per collection
+    names = list(indexes)
+    results = await asyncio.gather(*(_ensure_collection(db[name], indexes[name]) for name in names))
+    created = dict(zip(names, results))
+    for name, built in created.items():
+        if built:
+            log.info("created indexes on %s: %s", name, ", ".join(built))
+    return created
+
+
+async def retired_indexes(col, retired) -> list[str]:
+    # names of the existing indexes whose keys are in retired
+    keys = {tuple(spec) for spec in retired}
+    return [info["name"] async for info in col.list_indexes() if _key(info["key"]) in keys]
+
+
+async def drop_retired(db, retired=RETIRED_INDEXES, dry_run: bool = False) -> dict[str, list[str]]:
+    dropped = {}
+    for name, specs in retired.items():
+        found = await retired_indexes(db[name], specs)
+        if not dry_run:
+            for index in found:
+                await db[name].drop_index(index)
+                log.info("dropped retired index %s on %s", index, name)
+        dropped[name] = found
+    return dropped
+
+
+class IndexBuild:
+    # runs ensure_indexes according to INDEX_MODE and remembers how it went for /stats
+    def __init__(self, db, mode: str = INDEX_MODE):
+        self.db = db
+        self.mode = mode
+        self.state = "pending"
+        self.created: dict[str, list[str]] = {}
+        self.elapsed_ms = 0.0
+        self._task: asyncio.Task | None = None
+
+    async def _run(self):
+        t0 = time.perf_counter()
+        self.state = "building"
+        try:
+            self.created = await ensure_indexes(self.db)
+            self.state = "ready"
+        except OperationFailure:
+            self.state = "failed"
+            log.exception("index build failed")
+            raise
+        finally:
+            self.elapsed_ms = (time.perf_counter() - t0) * 1000
+
+    async def start(self):
+        if self.mode == "startup":
+            await self._run()
+        elif self.mode == "background":
+            self._task = asyncio.create_task(self._run())
+            # retrieve the exception so a failed build doesn't log "never retrieved"
+            self._task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        else:
+            self.state = "skipped"
+
+    async def close(self):
+        # cancelling only stops waiting; a build already started keeps going server-side
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "state": self.state,
+            "created": sum(len(v) for v in self.created.values()),
+            "elapsed_ms": round(self.elapsed_ms, 1),
+        }
+
+
+async def main():
+    from db import create_client, DB_NAME
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dry-run", action="store_true", help="list missing and retired indexes without changing them")
+    args = ap.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    client = await create_client()
+    try:
+        db = client[DB_NAME]
+        if args.dry_run:
+            for name, wanted in INDEXES.items():
+                for model in await missing_indexes(db[name], wanted):
+                    print(f"{name}: {model.document['name']}")
+            for name, found in (await drop_retired(db, dry_run=True)).items():
+                for index in found:
+                    print(f"{name}: {index} (retired, would drop)")
+            return
+        t0 = time.perf_counter()
+        created = await ensure_indexes(db)
+        total = sum(len(v) for v in created.values())
+        dropped = sum(len(v) for v in (await drop_retired(db)).values())
+        print(f"created {total} and dropped {dropped} index(es) in {(time.perf_counter() - t0):.1f}s")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+# loader.py
+# DataLoader-style lookups of single documents by _id, under the GET /{id} routes.
+# Lookups made in the same event-loop tick are sent as one
+# find({"_id": {"$in": [...]}}), and identical lookups in that tick share one
+# result (singleflight). A lookup only ever joins a batch that hasn't been sent
+# yet, so its result was read after it asked: never older than what a direct
+# find_one would have returned. Callers share the returned document, so they must
+# copy before changing it.
+import asyncio
+
+from metrics import REGISTRY
+
+LOADER_ENABLED = True
+# send a batch early once it holds this many ids
+MAX_BATCH = 500
+
+
+class DocLoader:
+    def __init__(self, col, projection: dict | None = None, max_batch: int = MAX_BATCH,
+                 enabled: bool = LOADER_ENABLED, registry=REGISTRY):
+        self.col = col
+        self.projection = projection
+        self.max_batch = max_batch
+        self.enabled = enabled
+        self.registry = registry
+        # _id -> future for the batch that hasn't been sent yet
+        self._pending: dict = {}
+        self._scheduled = False
+        self._tasks: set[asyncio.Task] = set()
+        self.loads = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.fetched = 0
+        self.largest_batch = 0
+
+    async def load(self, key):
+        if not self.enabled:
+            return await self.col.find_one({"_id": key}, self.projection)
+        self.loads += 1
+        fut = self._pending.get(key)
+        if fut is None:
+            loop = asyncio.get_running_loop()
+            fut = self._pending[key] = loop.create_future()
+            if len(self._pending) >= self.max_batch:
+                self._dispatch()
+            elif not self._scheduled:
+                # runs after everything already runnable in this tick has had its turn
+                self._scheduled = True
+                loop.call_soon(self._dispatch)
+        else:
+            self.coalesced += 1
+        # shielded so one cancelled request doesn't cancel the lookup for the others
+        return await asyncio.shield(fut)
+
+    def _dispatch(self):
+        self._scheduled = False
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        task = asyncio.create_task(self._fetch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, batch: dict):
+        size = len(batch)
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, size)
+        self.registry.observe_batch(self.col.name, size)
+        try:
+            if size == 1:
+                doc = await self.col.find_one({"_id": next(iter(batch))}, self.projection)
+                docs = [doc] if doc else []
+            else:
+                docs = await self.col.find({"_id": {"$in": list(batch)}}, self.projection).to_list(None)
+        except Exception as e:
+            for fut in batch.values():
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        self.fetched += len(docs)
+        found = {d["_id"]: d for d in docs}
+        for key, fut in batch.items():
+            if not fut.done():
+                fut.set_result(found.get(key))
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "loads": self.loads,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "fetched": self.fetched,
+            "largest_batch": self.largest_batch,
+            # queue depth: ids waiting for the next batch, and batches on the wire
+            "pending": len(self._pending),
+            "inflight": len(self._tasks),
+        }
+
+
+def create_loaders(db) -> dict[str, DocLoader]:
+    return {
+        "bets": DocLoader(db["bets"]),
+        "groups": DocLoader(db["groups"]),
+        "users": DocLoader(db["users"], {"password_hash": 0}),
+    }
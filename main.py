@@ -1,42 +1,103 @@
 # main.py
+import logging
+import time
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 
+from admission import AdmissionMiddleware, ADMISSION
+from compression import CompressionMiddleware, COMPRESSION
 from db import create_client, DB_NAME
+from cache import create_caches
+from indexes import IndexBuild
+from loader import create_loaders
+from metrics import MetricsMiddleware, REGISTRY
+from changefeed import ChangeFeed, ProgressBroker, CHANGE_STREAM_ENABLED
+from passwords import PasswordPool, PoolFull
+from progress_buffer import ProgressBuffer, PROGRESS_BUFFER_ENABLED
+from progress_history import ProgressHistory, PROGRESS_HISTORY_ENABLED
+from scheduler import BetScheduler, SCHEDULER_ENABLED
 from routers.users import router as users_router
 from routers.groups import router as groups_router
 from routers.bets import router as bets_router
 
+log = logging.getLogger(__name__)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    t0 = time.perf_counter()
     # connect once and store the client on app.state
     app.state.mongo = await create_client()
     db = app.state.mongo[DB_NAME]
 
-    # create indexes
-    await db["users"].create_index("email", unique=True)
-    await db["users"].create_index("group_ids")
+    app.state.indexes = IndexBuild(db)
+    await app.state.indexes.start()
+
+    app.state.caches = create_caches()
+    app.state.loaders = create_loaders(db)
+    app.state.password_pool = PasswordPool()
+
+    # always present; appends are dropped until start() finds a time-series collection
+    app.state.progress_history = ProgressHistory(db)
+    if PROGRESS_HISTORY_ENABLED:
+        await app.state.progress_history.start()
+
+    app.state.progress_buffer = None
+    if PROGRESS_BUFFER_ENABLED:
+        app.state.progress_buffer = ProgressBuffer(
+            db["bets"], cache=app.state.caches["bets"], history=app.state.progress_history,
+            stats_col=db["group_stats"],
+        )
+        app.state.progress_buffer.start()
+
+    app.state.progress_broker = None
+    app.state.changefeed = None
+    if CHANGE_STREAM_ENABLED:
+        app.state.progress_broker = ProgressBroker()
+        app.state.changefeed = ChangeFeed(db, app.state.caches, app.state.progress_broker)
+        app.state.changefeed.start()
 
-    await db["groups"].create_index("name", unique=True)
-    await db["groups"].create_index("user_ids")
-    await db["groups"].create_index("current_bet_id")
-    await db["groups"].create_index("past_bet_ids")
+    app.state.scheduler = None
+    if SCHEDULER_ENABLED:
+        app.state.scheduler = BetScheduler(db, app.state.caches)
+        app.state.scheduler.start()
 
-    await db["bets"].create_index([("group_id", 1), ("status", 1), ("start_date", 1)])
-    await db["bets"].create_index("user_progress.user_id")
+    log.info("startup took %.1f ms (indexes %s, %.1f ms)",
+             (time.perf_counter() - t0) * 1000, app.state.indexes.state, app.state.indexes.elapsed_ms)
 
     try:
         yield
     finally:
+        await app.state.indexes.close()
+        if app.state.scheduler is not None:
+            await app.state.scheduler.close()
+        if app.state.changefeed is not None:
+            await app.state.changefeed.close()
+        if app.state.progress_buffer is not None:
+            # flush whatever is still queued before the client goes away
+            await app.state.progress_buffer.close()
+        # after the buffer, whose last flush still appends points
+        await app.state.progress_history.close()
+        app.state.password_pool.close()
         app.state.mongo.close()
 
 app = FastAPI(lifespan=lifespan, openapi_url="/openapi.json", docs_url="/docs", redoc_url="/redoc")
+# the last one added runs first: metrics wrap admission so shed requests are counted,
+# and compression only spends CPU on admitted requests
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 # plug routers back in
 app.include_router(users_router, prefix="/users", tags=["users"])
 app.include_router(groups_router, prefix="/groups", tags=["groups"])
 app.include_router(bets_router, prefix="/bets", tags=["bets"])
 
+# the password pool's waiting room is full: same answer as admission control gives
+@app.exception_handler(PoolFull)
+async def password_pool_full(request: Request, exc: PoolFull):
+    return JSONResponse({"detail": "Server busy, retry later"}, status_code=503, headers={"Retry-After": "1"})
+
 @app.get("/health")
 async def health(request: Request):
     await request.app.state.mongo.admin.command("ping")
@@ -45,3 +106,42 @@ async def health(request: Request):
 @app.get("/ping")
 async def ping():
     return {"ok": True}
+
+def collect_stats(request: Request) -> dict:
+    buf = request.app.state.progress_buffer
+    feed = request.app.state.changefeed
+    broker = request.app.state.progress_broker
+    sched = request.app.state.scheduler
+    return {
+        "progress_buffer": buf.stats() if buf is not None else None,
+        "progress_history": request.app.state.progress_history.stats(),
+        "caches": {name: c.stats() for name, c in request.app.state.caches.items()},
+        "loaders": {name: l.stats() for name, l in request.app.state.loaders.items()},
+        "password_pool": request.app.state.password_pool.stats(),
+        "changefeed": feed.stats() if feed is not None else None,
+        "progress_broker": broker.stats() if broker is not None else None,
+        "scheduler": sched.stats() if sched is not None else None,
+        "indexes": request.app.state.indexes.stats(),
+        "admission": ADMISSION.stats(),
+        "compression": COMPRESSION.stats(),
+    }
+
+@app.get("/stats")
+async def stats(request: Request):
+    return collect_stats(request)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request):
+    # component counters from /stats become app_<component>_<name> gauges
+    gauges = {}
+    for component, values in collect_stats(request).items():
+        if component in ("caches", "loaders"):
+            label = component[:-1]
+            for name, component_stats in values.items():
+                for k, v in component_stats.items():
+                    gauges[f"app_{label}_{k}{{{label}=\"{name}\"}}"] = float(v)
+            continue
+        for k, v in (values or {}).items():
+            if isinstance(v, (int, float)):
+                gauges[f"app_{component}_{k}"] = float(v)
+    return PlainTextResponse(REGISTRY.render(gauges), media_type="text/plain; version=0.0.4")
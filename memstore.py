@@ -0,0 +1,1503 @@
+# memstore.py
+# In-memory storage backend: the part of Motor's client/database/collection API that
+# the routers, the background tasks, the CLIs and the benches use, held in this
+# process. db.STORAGE_BACKEND = "memory" makes create_client() return one, and the
+# app runs unchanged on it, without a mongod and without the network round trips.
+# Nothing persists across restarts.
+#
+# Documents are stored the way Mongo hands them back (every written value goes
+# through a bson round trip: naive UTC datetimes, millisecond precision) in a dict
+# by _id, and reads return copies. _id and every index created with create_indexes
+# is a sorted list of (key, _id) entries kept with bisect, multikey over arrays like
+# Mongo's. A find takes the index with the longest equality prefix on the filter,
+# and when its next field is the sort field it walks the index in order and stops at
+# skip + limit; anything an index can't narrow falls back to a scan of the dict.
+#
+# Covered: find/find_one (projections with $elemMatch, sort, skip, limit), inserts,
+# updates ($set, $unset, $inc, $min, $max, $push with $each/$slice, $addToSet, $pull,
+# the positional $, upserts), replaces and deletes in their single, many,
+# find_one_and_* and bulk_write forms, unique indexes, count_documents, distinct,
+# the aggregation stages the app builds ($match, $sort, $skip, $limit, $project,
+# $addFields, $unwind, $lookup, $group, $count) and database change streams.
+# Not covered: transactions, update pipelines, TTL expiry, explain.
+#
+# tests/test_memstore.py runs the routers' query and update shapes against this and,
+# where one answers, a real mongod; a shape the app starts sending belongs there.
+import asyncio
+import itertools
+import re
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta, UTC
+
+import bson
+from bson import ObjectId
+from pymongo import (
+    DeleteMany, DeleteOne, IndexModel, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne,
+)
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure, WriteError
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+DUPLICATE_KEY = 11000
+# below this many new entries an index takes them one by one, above it sorts once
+BULK_INDEX_THRESHOLD = 64
+
+_TOP = (99,)
+
+
+async def _round_trip():
+    # every call gives the event loop a turn, as waiting on the server would, so
+    # concurrent requests interleave the way they do against Mongo
+    await asyncio.sleep(0)
+
+
+# values
+
+def _stored(value):
+    # what Mongo would hand back for value
+    return bson.decode(bson.encode({"v": value}))["v"]
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+
+def _k(v) -> tuple:
+    # comparison key in BSON's cross-type order: null < numbers < strings < objects
+    # < arrays < binary < ObjectId < booleans < dates
+    if v is None:
+        return (1,)
+    if isinstance(v, bool):
+        return (8, v)
+    if isinstance(v, (int, float)):
+        return (2, v)
+    if isinstance(v, str):
+        return (3, v)
+    if isinstance(v, dict):
+        return (4, tuple((k, _k(x)) for k, x in v.items()))
+    if isinstance(v, (list, tuple)):
+        return (5, tuple(_k(x) for x in v))
+    if isinstance(v, bytes):
+        return (6, v)
+    if isinstance(v, ObjectId):
+        return (7, v.binary)
+    if isinstance(v, datetime):
+        return (9, v.astimezone(UTC).replace(tzinfo=None) if v.tzinfo else v)
+    return (10, str(v))
+
+
+def _resolve(value, parts: list[str]) -> list:
+    # every value a dotted path reaches, descending into arrays the way queries do
+    if not parts:
+        return [value]
+    if isinstance(value, dict):
+        if parts[0] not in value:
+            return []
+        return _resolve(value[parts[0]], parts[1:])
+    if isinstance(value, list):
+        out = []
+        if parts[0].isdigit() and int(parts[0]) < len(value):
+            out.extend(_resolve(value[int(parts[0])], parts[1:]))
+        for e in value:
+            if isinstance(e, dict):
+                out.extend(_resolve(e, parts))
+        return out
+    return []
+
+
+def _expand(found: list):
+    # an array matches on itself and on each of its elements
+    for v in found:
+        yield v
+        if isinstance(v, list):
+            yield from v
+
+
+# queries
+
+def _is_ops(cond) -> bool:
+    return isinstance(cond, dict) and bool(cond) and all(k.startswith("$") for k in cond)
+
+
+def _eq(found: list, value) -> bool:
+    if value is None and not found:
+        return True
+    if isinstance(value, re.Pattern):
+        return any(isinstance(v, str) and value.search(v) for v in _expand(found))
+    key = _k(value)
+    return any(_k(v) == key for v in _expand(found))
+
+
+def _in(found: list, values) -> bool:
+    return any(_eq(found, v) for v in values)
+
+
+def _compare(found: list, value, test) -> bool:
+    key = _k(value)
+    # type bracketing: only values of the same type compare
+    return any(k[0] == key[0] and test(k, key) for k in map(_k, _expand(found)))
+
+
+def _elem_match(found: list, cond) -> bool:
+    for v in found:
+        if not isinstance(v, list):
+            continue
+        for e in v:
+            if _is_ops(cond):
+                if all(_OPS[op]([e], arg, cond) for op, arg in cond.items() if op != "$options"):
+                    return True
+            elif isinstance(e, dict) and _match(e, cond):
+                return True
+    return False
+
+
+def _regex(found: list, pattern, cond) -> bool:
+    if not isinstance(pattern, re.Pattern):
+        flags = 0
+        for c in cond.get("$options", ""):
+            flags |= {"i": re.I, "m": re.M, "s": re.S, "x": re.X}.get(c, 0)
+        pattern = re.compile(pattern, flags)
+    return _eq(found, pattern)
+
+
+_OPS = {
+    "$eq": lambda found, arg, cond: _eq(found, arg),
+    "$ne": lambda found, arg, cond: not _eq(found, arg),
+    "$in": lambda found, arg, cond: _in(found, arg),
+    "$nin": lambda found, arg, cond: not _in(found, arg),
+    "$gt": lambda found, arg, cond: _compare(found, arg, lambda a, b: a > b),
+    "$gte": lambda found, arg, cond: _compare(found, arg, lambda a, b: a >= b),
+    "$lt": lambda found, arg, cond: _compare(found, arg, lambda a, b: a < b),
+    "$lte": lambda found, arg, cond: _compare(found, arg, lambda a, b: a <= b),
+    "$exists": lambda found, arg, cond: bool(found) == bool(arg),
+    "$size": lambda found, arg, cond: any(isinstance(v, list) and len(v) == arg for v in found),
+    "$all": lambda found, arg, cond: all(_eq(found, v) for v in arg),
+    "$elemMatch": lambda found, arg, cond: _elem_match(found, arg),
+    "$regex": _regex,
+    "$options": lambda found, arg, cond: True,
+    "$not": lambda found, arg, cond: not _field_matches(found, arg),
+}
+
+
+def _field_matches(found: list, cond) -> bool:
+    if _is_ops(cond):
+        for op, arg in cond.items():
+            test = _OPS.get(op)
+            if test is None:
+                raise OperationFailure(f"unknown operator: {op}", 2)
+            if not test(found, arg, cond):
+                return False
+        return True
+    return _eq(found, cond)
+
+
+def _match(doc: dict, filt: dict) -> bool:
+    for key, cond in filt.items():
+        if key == "$and":
+            ok = all(_match(doc, f) for f in cond)
+        elif key == "$or":
+            ok = any(_match(doc, f) for f in cond)
+        elif key == "$nor":
+            ok = not any(_match(doc, f) for f in cond)
+        elif key.startswith("$"):
+            raise OperationFailure(f"unknown top level operator: {key}", 2)
+        else:
+            ok = _field_matches(_resolve(doc, key.split(".")), cond)
+        if not ok:
+            return False
+    return True
+
+
+# projections
+
+def _include(value, tree):
+    if tree is True:
+        return _copy(value)
+    if isinstance(value, dict):
+        out = {}
+        for k, v in value.items():
+            sub = tree.get(k)
+            if sub is True:
+                out[k] = _copy(v)
+            elif sub is not None and isinstance(v, (dict, list)):
+                out[k] = _include(v, sub)
+        return out
+    return [_include(e, tree) for e in value if isinstance(e, (dict, list))]
+
+
+def _project_special(value, spec: dict):
+    if "$elemMatch" in spec:
+        for e in value if isinstance(value, list) else []:
+            if _elem_match([[e]], spec["$elemMatch"]):
+                return [_copy(e)]
+        return None
+    if "$slice" in spec and isinstance(value, list):
+        n = spec["$slice"]
+        if isinstance(n, list):
+            return _copy(value[n[0]:n[0] + n[1]] if n[0] >= 0 else value[n[0]:][:n[1]])
+        return _copy(value[n:] if n < 0 else value[:n])
+    return _copy(value)
+
+
+def _project(doc: dict, projection) -> dict:
+    if not projection:
+        return _copy(doc)
+    if not isinstance(projection, dict):
+        projection = {f: 1 for f in projection}
+    keep_id = bool(projection.get("_id", 1))
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    inclusion = any(isinstance(v, dict) or v for v in fields.values()) or (not fields and keep_id)
+    if not inclusion:
+        out = _copy(doc)
+        for path in fields:
+            _unset(out, path.split("."))
+        if not keep_id:
+            out.pop("_id", None)
+        return out
+    tree, special = {}, {}
+    for path, v in fields.items():
+        if isinstance(v, dict):
+            special[path] = v
+            continue
+        node = tree
+        parts = path.split(".")
+        for p in parts[:-1]:
+            node = node.setdefault(p, {})
+            if node is True:
+                break
+        else:
+            node[parts[-1]] = True
+    out = {}
+    for k, v in doc.items():
+        if k == "_id":
+            if keep_id:
+                out[k] = v
+        elif k in special:
+            r = _project_special(v, special[k])
+            if r is not None:
+                out[k] = r
+        elif k in tree:
+            sub = tree[k]
+            if sub is True:
+                out[k] = _copy(v)
+            elif isinstance(v, (dict, list)):
+                out[k] = _include(v, sub)
+    return out
+
+
+# sorting
+
+def _sort_spec(key_or_list, direction=None) -> list[tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [(k, d) for k, d in key_or_list]
+
+
+def _sort_key(doc: dict, path: str, direction: int) -> tuple:
+    # arrays sort by their smallest element ascending and their largest descending
+    vals = []
+    for v in _resolve(doc, path.split(".")):
+        if isinstance(v, list):
+            vals.extend(v)
+        else:
+            vals.append(v)
+    if not vals:
+        return (1,)
+    keys = map(_k, vals)
+    return min(keys) if direction > 0 else max(keys)
+
+
+def _sort_docs(docs: list[dict], spec: list[tuple[str, int]]) -> list[dict]:
+    for path, direction in reversed(spec):
+        docs.sort(key=lambda d: _sort_key(d, path, direction), reverse=direction < 0)
+    return docs
+
+
+# updates
+
+def _walk(doc: dict, parts: list[str], create: bool):
+    # the container holding parts[-1]
+    node = doc
+    for p in parts[:-1]:
+        if isinstance(node, list):
+            i = int(p) if p.isdigit() else -1
+            if not 0 <= i < len(node):
+                if not create:
+                    return None
+                raise WriteError(f"cannot use the part ({p}) to traverse the array", 28)
+            node = node[i]
+        elif isinstance(node, dict):
+            if node.get(p) is None:
+                if not create:
+                    return None
+                node[p] = {}
+            node = node[p]
+        else:
+            if not create:
+                return None
+            raise WriteError(f"cannot create field '{p}' in element {node!r}", 28)
+    return node
+
+
+def _get(node, key: str):
+    if isinstance(node, list):
+        return node[int(key)] if key.isdigit() and int(key) < len(node) else None
+    if isinstance(node, dict):
+        return node.get(key)
+    return None
+
+
+def _put(node, key: str, value):
+    if isinstance(node, list):
+        i = int(key)
+        node.extend([None] * (i + 1 - len(node)))
+        node[i] = value
+    elif isinstance(node, dict):
+        node[key] = value
+    else:
+        raise WriteError(f"cannot create field '{key}' in element {node!r}", 28)
+
+
+def _unset(doc: dict, parts: list[str]):
+    node = _walk(doc, parts, create=False)
+    if isinstance(node, dict):
+        node.pop(parts[-1], None)
+    elif isinstance(node, list) and parts[-1].isdigit() and int(parts[-1]) < len(node):
+        node[int(parts[-1])] = None
+
+
+def _array_at(doc: dict, parts: list[str], op: str) -> list:
+    node = _walk(doc, parts, create=True)
+    cur = _get(node, parts[-1])
+    if cur is None:
+        cur = []
+        _put(node, parts[-1], cur)
+    if not isinstance(cur, list):
+        raise WriteError(f"{op} needs an array at '{'.'.join(parts)}'", 2)
+    return cur
+
+
+def _number(doc: dict, parts: list[str], arg, op: str):
+    if not isinstance(arg, (int, float)) or isinstance(arg, bool):
+        raise WriteError(f"cannot {op} with non-numeric argument", 14)
+    node = _walk(doc, parts, create=True)
+    cur = _get(node, parts[-1])
+    if cur is not None and (not isinstance(cur, (int, float)) or isinstance(cur, bool)):
+        raise WriteError(f"cannot apply {op} to a value of non-numeric type at '{'.'.join(parts)}'", 14)
+    return node, cur
+
+
+def _set(doc, parts, arg):
+    _put(_walk(doc, parts, create=True), parts[-1], _stored(arg))
+
+
+def _inc(doc, parts, arg):
+    node, cur = _number(doc, parts, arg, "$inc")
+    _put(node, parts[-1], (cur or 0) + arg)
+
+
+def _min_max(pick):
+    def apply(doc, parts, arg):
+        node = _walk(doc, parts, create=True)
+        cur = _get(node, parts[-1])
+        if cur is None or pick(_k(arg), _k(cur)) == _k(arg):
+            _put(node, parts[-1], _stored(arg))
+    return apply
+
+
+def _push(doc, parts, arg):
+    cur = _array_at(doc, parts, "$push")
+    if isinstance(arg, dict) and "$each" in arg:
+        items = arg["$each"]
+        pos = arg.get("$position")
+        new = cur[:pos] + _stored(items) + cur[pos:] if pos is not None else cur + _stored(items)
+        n = arg.get("$slice")
+        if n is not None:
+            new = new[n:] if n < 0 else new[:n]
+        cur[:] = new
+    else:
+        cur.append(_stored(arg))
+
+
+def _add_to_set(doc, parts, arg):
+    cur = _array_at(doc, parts, "$addToSet")
+    items = arg["$each"] if isinstance(arg, dict) and "$each" in arg else [arg]
+    have = {_k(v) for v in cur}
+    for item in _stored(items):
+        if _k(item) not in have:
+            cur.append(item)
+            have.add(_k(item))
+
+
+def _pulled(e, cond) -> bool:
+    if _is_ops(cond):
+        return _field_matches([e], cond)
+    if isinstance(cond, dict) and isinstance(e, dict):
+        return _match(e, cond)
+    return _eq([e], cond)
+
+
+def _pull(doc, parts, arg):
+    node = _walk(doc, parts, create=False)
+    cur = _get(node, parts[-1]) if node is not None else None
+    if isinstance(cur, list):
+        cur[:] = [e for e in cur if not _pulled(e, arg)]
+
+
+_UPDATES = {
+    "$set": _set,
+    "$setOnInsert": _set,
+    "$unset": lambda doc, parts, arg: _unset(doc, parts),
+    "$inc": _inc,
+    "$min": _min_max(min),
+    "$max": _min_max(max),
+    "$push": _push,
+    "$addToSet": _add_to_set,
+    "$pull": _pull,
+}
+
+
+def _conditions(filt: dict):
+    for key, cond in filt.items():
+        if key == "$and":
+            for f in cond:
+                yield from _conditions(f)
+        elif not key.startswith("$"):
+            yield key, cond
+
+
+def _positional(doc: dict, path: str, filt: dict) -> str:
+    # resolves the first $ in path to the index of the array element the filter matched
+    head, _, tail = path.partition(".$")
+    arr = _get(_walk(doc, head.split("."), create=False) or {}, head.split(".")[-1])
+    conds = []
+    for key, cond in _conditions(filt):
+        if key == head:
+            conds.append(("e", cond))
+        elif key.startswith(head + "."):
+            conds.append(("e." + key[len(head) + 1:], cond))
+    if isinstance(arr, list) and conds:
+        for i, e in enumerate(arr):
+            if all(_field_matches(_resolve({"e": e}, k.split(".")), c) for k, c in conds):
+                return f"{head}.{i}{tail}"
+    raise WriteError("The positional operator did not find the match needed from the query.", 2)
+
+
+def _check_update(update):
+    if isinstance(update, list):
+        raise OperationFailure("update pipelines are not supported by the memory backend", 2)
+    if not update:
+        raise ValueError("update cannot be empty")
+    if not all(k.startswith("$") for k in update):
+        raise ValueError("update only works with $ operators")
+
+
+def _check_replacement(replacement):
+    if replacement and next(iter(replacement)).startswith("$"):
+        raise ValueError("replacement can not include $ operators")
+
+
+def _updated(doc: dict, update: dict, filt: dict, inserting: bool = False) -> dict:
+    out = _copy(doc)
+    for op, fields in update.items():
+        apply = _UPDATES.get(op)
+        if apply is None:
+            raise WriteError(f"Unknown modifier: {op}", 9)
+        if op == "$setOnInsert" and not inserting:
+            continue
+        for path, arg in fields.items():
+            if "$" in path.split("."):
+                path = _positional(out, path, filt)
+            apply(out, path.split("."), arg)
+    return out
+
+
+def _upsert_seed(filt: dict) -> dict:
+    # the equality conditions of the filter, as the start of an upserted document
+    doc = {}
+    for key, cond in _conditions(filt):
+        if _is_ops(cond):
+            if "$eq" not in cond:
+                continue
+            cond = cond["$eq"]
+        _set(doc, key.split("."), cond)
+    return doc
+
+
+# indexes
+
+class _Index:
+    def __init__(self, name: str, keys: list[tuple[str, int]], unique: bool = False):
+        self.name = name
+        self.keys = keys
+        self.fields = [f for f, _ in keys]
+        self.unique = unique
+        # (key, _k(_id), _id), key being one _k per field
+        self.entries: list[tuple] = []
+
+    def info(self) -> dict:
+        doc = {"v": 2, "key": dict(self.keys), "name": self.name}
+        if self.unique and self.name != "_id_":
+            doc["unique"] = True
+        return doc
+
+    def keys_of(self, doc: dict) -> set[tuple]:
+        per_field = []
+        for f in self.fields:
+            vals = set()
+            for v in _resolve(doc, f.split(".")):
+                if isinstance(v, list):
+                    vals.update(map(_k, v))
+                    if not v:
+                        vals.add((1,))
+                else:
+                    vals.add(_k(v))
+            per_field.append(vals or {(1,)})
+        return set(itertools.product(*per_field))
+
+    def taken(self, keys, idk) -> tuple | None:
+        # a key another document already holds
+        for key in keys:
+            i = bisect_left(self.entries, (key,))
+            while i < len(self.entries) and self.entries[i][0] == key:
+                if self.entries[i][1] != idk:
+                    return key
+                i += 1
+        return None
+
+    def add(self, entries: list[tuple]):
+        if len(entries) >= BULK_INDEX_THRESHOLD:
+            self.entries.extend(entries)
+            self.entries.sort()
+        else:
+            for e in entries:
+                insort(self.entries, e)
+
+    def remove(self, keys, idk):
+        for key in keys:
+            i = bisect_left(self.entries, (key, idk))
+            if i < len(self.entries) and self.entries[i][:2] == (key, idk):
+                del self.entries[i]
+
+    def scan(self, prefix: tuple, lo=None, hi=None, reverse: bool = False):
+        # _ids with key[:len(prefix)] == prefix and the next key part within
+        # (key, inclusive) bounds lo and hi, in key order
+        e = self.entries
+        if lo is None:
+            i = bisect_left(e, (prefix,))
+        else:
+            i = bisect_left(e, (prefix + ((lo[0],) if lo[1] else (lo[0], _TOP)),))
+        if hi is None:
+            j = bisect_left(e, (prefix + (_TOP,),))
+        else:
+            j = bisect_left(e, (prefix + ((hi[0], _TOP) if hi[1] else (hi[0],)),))
+        for x in (range(j - 1, i - 1, -1) if reverse else range(i, j)):
+            yield e[x][2]
+
+
+def _tighter(a, b, lower: bool):
+    if a is None:
+        return b
+    if (b[0] > a[0] if lower else b[0] < a[0]) or (b[0] == a[0] and not b[1]):
+        return b
+    return a
+
+
+def _bounds(cond):
+    # what an index can do with a top-level condition: ("eq", key), ("in", keys),
+    # ("range", lo, hi) or None
+    if not _is_ops(cond):
+        return None if isinstance(cond, (list, re.Pattern)) else ("eq", _k(cond))
+    if "$eq" in cond and not isinstance(cond["$eq"], (list, re.Pattern)):
+        return ("eq", _k(cond["$eq"]))
+    if "$in" in cond:
+        if any(isinstance(v, (list, re.Pattern)) for v in cond["$in"]):
+            return None
+        keys = sorted({_k(v) for v in cond["$in"]})
+        return ("eq", keys[0]) if len(keys) == 1 else ("in", keys)
+    lo = hi = None
+    for op, v in cond.items():
+        if op in ("$gt", "$gte"):
+            k = _k(v)
+            lo = _tighter(lo, (k, op == "$gte"), lower=True)
+            hi = _tighter(hi, ((k[0] + 1,), False), lower=False)
+        elif op in ("$lt", "$lte"):
+            k = _k(v)
+            hi = _tighter(hi, (k, op == "$lte"), lower=False)
+            lo = _tighter(lo, ((k[0],), True), lower=True)
+    return ("range", lo, hi) if lo is not None else None
+
+
+class _Plan:
+    def __init__(self, index: _Index, eq: tuple, tail):
+        self.index = index
+        self.eq = eq
+        self.tail = tail
+
+    def ordered_by(self) -> str | None:
+        n = len(self.eq)
+        if n < len(self.index.fields) and (self.tail is None or self.tail[0] == "range"):
+            return self.index.fields[n]
+        return None
+
+    def ids(self, reverse: bool = False):
+        if self.tail is None:
+            return self.index.scan(self.eq, reverse=reverse)
+        if self.tail[0] == "range":
+            return self.index.scan(self.eq, self.tail[1], self.tail[2], reverse)
+        keys = reversed(self.tail[1]) if reverse else self.tail[1]
+        return itertools.chain.from_iterable(self.index.scan(self.eq + (k,), reverse=reverse) for k in keys)
+
+
+def _id_values(cond) -> list | None:
+    if not _is_ops(cond):
+        return None if isinstance(cond, (list, dict, re.Pattern)) else [cond]
+    if set(cond) == {"$eq"}:
+        return [cond["$eq"]]
+    if set(cond) == {"$in"} and not any(isinstance(v, (list, dict, re.Pattern)) for v in cond["$in"]):
+        return list(cond["$in"])
+    return None
+
+
+# cursors
+
+class MemoryCursor:
+    def __init__(self, fetch, collection=None):
+        self._fetch = fetch
+        self._items: list | None = None
+        self._pos = 0
+        self.collection = collection
+        self._sort: list[tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = _sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, n: int):
+        self._skip = n
+        return self
+
+    def limit(self, n: int):
+        self._limit = abs(n)
+        return self
+
+    # the planner picks its own index; batching doesn't apply to memory
+    def hint(self, index):
+        return self
+
+    def batch_size(self, n: int):
+        return self
+
+    def max_time_ms(self, ms):
+        return self
+
+    def _next(self):
+        if self._items is None:
+            self._items = self._fetch(self)
+        while self._pos < len(self._items):
+            item = self._items[self._pos]
+            self._pos += 1
+            # a find yields ids and copies each document as it's reached, so a
+            # document deleted since the query ran is skipped
+            doc = item() if callable(item) else item
+            if doc is not None:
+                return doc
+        raise StopAsyncIteration
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._items is None:
+            await _round_trip()
+        return self._next()
+
+    async def next(self):
+        return await self.__anext__()
+
+    async def to_list(self, length: int | None = None) -> list:
+        if self._items is None:
+            await _round_trip()
+        out = []
+        while length is None or length <= 0 or len(out) < length:
+            try:
+                out.append(self._next())
+            except StopAsyncIteration:
+                break
+        return out
+
+    @property
+    def alive(self) -> bool:
+        return self._items is None or self._pos < len(self._items)
+
+    async def close(self):
+        self._items, self._pos = [], 0
+
+
+class MemoryChangeStream:
+    def __init__(self, database: "MemoryDatabase", pipeline, full_document):
+        self._database = database
+        self._filters = [stage["$match"] for stage in pipeline or [] if "$match" in stage]
+        self.full_document = full_document
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._closed = False
+        database._streams.add(self)
+
+    def _offer(self, event: dict):
+        if all(_match(event, f) for f in self._filters):
+            self._queue.put_nowait(event)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        return await self._queue.get()
+
+    async def next(self):
+        return await self.__anext__()
+
+    @property
+    def alive(self) -> bool:
+        return not self._closed
+
+    async def close(self):
+        self._closed = True
+        self._database._streams.discard(self)
+
+
+# collections
+
+def _bulk_result() -> dict:
+    return {
+        "writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+        "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": [],
+    }
+
+
+def _write_error(index: int, e: OperationFailure, op) -> dict:
+    return {**(e.details or {}), "index": index, "code": e.code, "errmsg": str(e), "op": op}
+
+
+class MemoryCollection:
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        self._docs: dict = {}
+        self._indexes: dict[str, _Index] = {"_id_": _Index("_id_", [("_id", 1)], unique=True)}
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.database.name}.{self.name}"
+
+    # planning
+
+    def _plan(self, filt: dict, sort_field: str | None) -> _Plan | None:
+        conds = {}
+        for key, cond in filt.items():
+            if not key.startswith("$"):
+                b = _bounds(cond)
+                if b is not None:
+                    conds[key] = b
+        best, best_score = None, None
+        for ix in self._indexes.values():
+            eq, tail = [], None
+            for f in ix.fields:
+                b = conds.get(f)
+                if b is None:
+                    break
+                if b[0] != "eq":
+                    tail = b
+                    break
+                eq.append(b[1])
+            plan = _Plan(ix, tuple(eq), tail)
+            if not eq and tail is None and (sort_field is None or ix.fields[0] != sort_field):
+                continue
+            score = (len(eq), tail is not None, plan.ordered_by() == sort_field, -len(ix.fields))
+            if best is None or score > best_score:
+                best, best_score = plan, score
+        return best
+
+    def _find_ids(self, filt: dict | None, sort=None, skip: int = 0, limit: int = 0) -> list:
+        filt = filt if isinstance(filt, dict) else ({} if filt is None else {"_id": filt})
+        sort = sort or []
+        sort_field = sort[0][0] if len(sort) == 1 else None
+        plan, ordered = None, None
+        lookup = _id_values(filt["_id"]) if "_id" in filt else None
+        if lookup is not None:
+            found = {_k(v): v for v in lookup if v in self._docs}
+            candidates = [found[k] for k in sorted(found)]
+            ordered = "_id"
+        else:
+            plan = self._plan(filt, sort_field)
+            ordered = plan.ordered_by() if plan is not None else None
+        streaming = not sort or (sort_field is not None and ordered == sort_field)
+        reverse = streaming and bool(sort) and sort[0][1] < 0
+        if plan is not None:
+            candidates = plan.ids(reverse)
+        elif lookup is None:
+            candidates = list(self._docs)
+        elif reverse:
+            candidates.reverse()
+
+        out, seen = [], set()
+        need = skip + limit if streaming and limit else 0
+        for _id in candidates:
+            if _id in seen:
+                continue
+            seen.add(_id)
+            doc = self._docs.get(_id)
+            if doc is not None and _match(doc, filt):
+                out.append(_id)
+                if need and len(out) >= need:
+                    break
+        if not streaming:
+            docs = _sort_docs([self._docs[i] for i in out], sort)
+            out = [d["_id"] for d in docs]
+        return out[skip:skip + limit] if limit else out[skip:]
+
+    # writes, all synchronous so that one call is atomic with respect to the others
+
+    def _emit(self, op: str, _id, doc: dict | None):
+        if self.database._streams:
+            self.database._emit(op, self.name, _id, doc)
+
+    def _unique_conflict(self, doc: dict, idk, keys: dict):
+        for ix in self._indexes.values():
+            if ix.unique and ix.name != "_id_":
+                key = ix.taken(keys[ix.name], idk)
+                if key is not None:
+                    self._duplicate(ix, doc)
+
+    def _duplicate(self, ix: _Index, doc: dict):
+        value = {f: (_resolve(doc, f.split(".")) or [None])[0] for f in ix.fields}
+        msg = (f"E11000 duplicate key error collection: {self.full_name} index: {ix.name} dup key: "
+               f"{{ {', '.join(f'{k}: {v!r}' for k, v in value.items())} }}")
+        raise DuplicateKeyError(msg, DUPLICATE_KEY, {
+            "code": DUPLICATE_KEY, "errmsg": msg, "keyPattern": dict(ix.keys), "keyValue": value,
+        })
+
+    def _insert_docs(self, docs: list[dict], ordered: bool, result: dict, offset: int = 0) -> list:
+        # new index entries are added per index at the end, in one sort for big batches
+        pending: dict[str, list] = {name: [] for name in self._indexes}
+        batch_keys: dict[str, dict] = {name: {} for name, ix in self._indexes.items() if ix.unique}
+        inserted = []
+        try:
+            for i, doc in enumerate(docs):
+                if "_id" not in doc:
+                    doc["_id"] = ObjectId()
+                try:
+                    # the server moves _id to the front of a new document
+                    stored = _stored({"_id": doc["_id"], **doc})
+                    _id = stored["_id"]
+                    idk = _k(_id)
+                    if _id in self._docs:
+                        self._duplicate(self._indexes["_id_"], stored)
+                    keys = {name: ix.keys_of(stored) for name, ix in self._indexes.items()}
+                    self._unique_conflict(stored, idk, keys)
+                    for name, taken in batch_keys.items():
+                        if any(taken.get(k, idk) != idk for k in keys[name]):
+                            self._duplicate(self._indexes[name], stored)
+                except OperationFailure as e:
+                    result["writeErrors"].append(_write_error(offset + i, e, doc))
+                    if ordered:
+                        break
+                    continue
+                for name, taken in batch_keys.items():
+                    taken.update(dict.fromkeys(keys[name], idk))
+                for name, ix_keys in keys.items():
+                    pending[name].extend((k, idk, _id) for k in ix_keys)
+                self._docs[_id] = stored
+                inserted.append(_id)
+                result["nInserted"] += 1
+        finally:
+            for name, entries in pending.items():
+                self._indexes[name].add(entries)
+            if inserted:
+                self.database._created.add(self.name)
+            for _id in inserted:
+                self._emit("insert", _id, self._docs[_id])
+        return inserted
+
+    def _replace_doc(self, old: dict, new: dict):
+        idk = _k(old["_id"])
+        changes = {}
+        for name, ix in self._indexes.items():
+            before, after = ix.keys_of(old), ix.keys_of(new)
+            if before != after:
+                changes[name] = (before - after, after - before)
+        for name, (_, added) in changes.items():
+            ix = self._indexes[name]
+            if ix.unique and ix.taken(added, idk) is not None:
+                self._duplicate(ix, new)
+        for name, (removed, added) in changes.items():
+            ix = self._indexes[name]
+            ix.remove(removed, idk)
+            ix.add([(k, idk, old["_id"]) for k in added])
+        self._docs[old["_id"]] = new
+
+    def _delete_doc(self, _id):
+        doc = self._docs.pop(_id)
+        idk = _k(_id)
+        for ix in self._indexes.values():
+            ix.remove(ix.keys_of(doc), idk)
+        self._emit("delete", _id, None)
+        return doc
+
+    def _update(self, filt: dict, update: dict, upsert: bool, multi: bool, replace: bool = False):
+        # (matched, modified, upserted _id, document before, document after)
+        ids = self._find_ids(filt, limit=0 if multi else 1)
+        matched = modified = 0
+        before = after = None
+        for _id in ids:
+            old = self._docs[_id]
+            if replace:
+                new = {"_id": _id, **_stored({k: v for k, v in update.items() if k != "_id"})}
+            else:
+                new = _updated(old, update, filt)
+            matched += 1
+            if new != old:
+                self._replace_doc(old, new)
+                modified += 1
+                self._emit("replace" if replace else "update", _id, new)
+            before, after = before or old, after or new
+        if ids or not upsert:
+            return matched, modified, None, before, after
+        seed = _upsert_seed(filt)
+        if replace:
+            doc = {"_id": seed["_id"]} if "_id" in seed else {}
+            doc.update(_stored(update))
+        else:
+            doc = _updated(seed, update, filt, inserting=True)
+        if "_id" not in doc:
+            doc = {"_id": ObjectId(), **doc}
+        result = _bulk_result()
+        self._insert_docs([doc], True, result)
+        if result["writeErrors"]:
+            err = result["writeErrors"][0]
+            raise DuplicateKeyError(err["errmsg"], err["code"], err)
+        return 0, 0, doc["_id"], None, self._docs[doc["_id"]]
+
+    # reads
+
+    def find(self, filter=None, projection=None, *, sort=None, skip: int = 0, limit: int = 0, **kwargs):
+        def fetch(cursor):
+            ids = self._find_ids(filter, cursor._sort, cursor._skip, cursor._limit)
+            return [lambda _id=_id: self._project_id(_id, projection) for _id in ids]
+
+        cursor = MemoryCursor(fetch, self)
+        if sort is not None:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    def _project_id(self, _id, projection):
+        doc = self._docs.get(_id)
+        return _project(doc, projection) if doc is not None else None
+
+    async def find_one(self, filter=None, projection=None, *args, sort=None, **kwargs):
+        await _round_trip()
+        ids = self._find_ids(filter, _sort_spec(sort) if sort else None, limit=1)
+        return _project(self._docs[ids[0]], projection) if ids else None
+
+    async def count_documents(self, filter: dict, skip: int = 0, limit: int = 0, **kwargs) -> int:
+        await _round_trip()
+        return len(self._find_ids(filter, skip=skip, limit=limit))
+
+    async def estimated_document_count(self, **kwargs) -> int:
+        await _round_trip()
+        return len(self._docs)
+
+    async def distinct(self, key: str, filter: dict | None = None, **kwargs) -> list:
+        await _round_trip()
+        seen = {}
+        for _id in self._find_ids(filter):
+            for v in _resolve(self._docs[_id], key.split(".")):
+                for x in (v if isinstance(v, list) else [v]):
+                    seen.setdefault(_k(x), x)
+        return [_copy(seen[k]) for k in sorted(seen)]
+
+    def aggregate(self, pipeline: list[dict], **kwargs) -> MemoryCursor:
+        def fetch(cursor):
+            stages = list(pipeline)
+            if stages and "$match" in stages[0]:
+                docs = [_copy(self._docs[i]) for i in self._find_ids(stages.pop(0)["$match"])]
+            else:
+                docs = [_copy(d) for d in self._docs.values()]
+            return self.database._pipeline(docs, stages)
+
+        return MemoryCursor(fetch, self)
+
+    # writes
+
+    async def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        await _round_trip()
+        result = _bulk_result()
+        self._insert_docs([document], True, result)
+        if result["writeErrors"]:
+            err = result["writeErrors"][0]
+            raise DuplicateKeyError(err["errmsg"], err["code"], err)
+        return InsertOneResult(document["_id"], True)
+
+    async def insert_many(self, documents, ordered: bool = True, **kwargs) -> InsertManyResult:
+        await _round_trip()
+        documents = list(documents)
+        result = _bulk_result()
+        self._insert_docs(documents, ordered, result)
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return InsertManyResult([d["_id"] for d in documents], True)
+
+    async def update_one(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        await _round_trip()
+        _check_update(update)
+        n, modified, upserted, _, _ = self._update(filter, update, upsert, multi=False)
+        return UpdateResult({"n": n or int(upserted is not None), "nModified": modified, "upserted": upserted}, True)
+
+    async def update_many(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        await _round_trip()
+        _check_update(update)
+        n, modified, upserted, _, _ = self._update(filter, update, upsert, multi=True)
+        return UpdateResult({"n": n or int(upserted is not None), "nModified": modified, "upserted": upserted}, True)
+
+    async def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        await _round_trip()
+        _check_replacement(replacement)
+        n, modified, upserted, _, _ = self._update(filter, replacement, upsert, multi=False, replace=True)
+        return UpdateResult({"n": n or int(upserted is not None), "nModified": modified, "upserted": upserted}, True)
+
+    async def delete_one(self, filter: dict, **kwargs) -> DeleteResult:
+        await _round_trip()
+        ids = self._find_ids(filter, limit=1)
+        for _id in ids:
+            self._delete_doc(_id)
+        return DeleteResult({"n": len(ids)}, True)
+
+    async def delete_many(self, filter: dict, **kwargs) -> DeleteResult:
+        await _round_trip()
+        ids = self._find_ids(filter)
+        for _id in ids:
+            self._delete_doc(_id)
+        return DeleteResult({"n": len(ids)}, True)
+
+    async def _find_and_modify(self, filter, update, projection, sort, upsert, return_document, replace):
+        await _round_trip()
+        filt = filter or {}
+        if sort:
+            # the sort picks the document; _update then matches it by _id
+            ids = self._find_ids(filt, _sort_spec(sort), limit=1)
+            if ids:
+                filt = {"$and": [filt, {"_id": ids[0]}]}
+        _, _, _, before, after = self._update(filt, update, upsert, multi=False, replace=replace)
+        doc = after if return_document == ReturnDocument.AFTER else before
+        return _project(doc, projection) if doc is not None else None
+
+    async def find_one_and_update(self, filter: dict, update: dict, projection=None, sort=None,
+                                  upsert: bool = False, return_document=ReturnDocument.BEFORE, **kwargs):
+        _check_update(update)
+        return await self._find_and_modify(filter, update, projection, sort, upsert, return_document, False)
+
+    async def find_one_and_replace(self, filter: dict, replacement: dict, projection=None, sort=None,
+                                   upsert: bool = False, return_document=ReturnDocument.BEFORE, **kwargs):
+        _check_replacement(replacement)
+        return await self._find_and_modify(filter, replacement, projection, sort, upsert, return_document, True)
+
+    async def find_one_and_delete(self, filter: dict, projection=None, sort=None, **kwargs):
+        await _round_trip()
+        ids = self._find_ids(filter, _sort_spec(sort) if sort else None, limit=1)
+        if not ids:
+            return None
+        return _project(self._delete_doc(ids[0]), projection)
+
+    async def bulk_write(self, requests, ordered: bool = True, **kwargs) -> BulkWriteResult:
+        await _round_trip()
+        result = _bulk_result()
+        for i, op in enumerate(requests):
+            try:
+                if isinstance(op, InsertOne):
+                    self._insert_docs([op._doc], True, result, offset=i)
+                    if ordered and result["writeErrors"]:
+                        break
+                elif isinstance(op, (UpdateOne, UpdateMany, ReplaceOne)):
+                    replace = isinstance(op, ReplaceOne)
+                    _check_replacement(op._doc) if replace else _check_update(op._doc)
+                    n, modified, upserted, _, _ = self._update(
+                        op._filter, op._doc, op._upsert, multi=isinstance(op, UpdateMany), replace=replace
+                    )
+                    result["nMatched"] += n
+                    result["nModified"] += modified
+                    if upserted is not None:
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": i, "_id": upserted})
+                elif isinstance(op, (DeleteOne, DeleteMany)):
+                    ids = self._find_ids(op._filter, limit=1 if isinstance(op, DeleteOne) else 0)
+                    for _id in ids:
+                        self._delete_doc(_id)
+                    result["nRemoved"] += len(ids)
+                else:
+                    raise TypeError(f"{op!r} is not a valid request")
+            except OperationFailure as e:
+                result["writeErrors"].append(_write_error(i, e, op))
+                if ordered:
+                    break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    # indexes
+
+    def list_indexes(self, **kwargs) -> MemoryCursor:
+        return MemoryCursor(lambda cursor: [ix.info() for ix in self._indexes.values()], self)
+
+    async def index_information(self) -> dict:
+        await _round_trip()
+        return {name: {k: v for k, v in ix.info().items() if k != "name"} for name, ix in self._indexes.items()}
+
+    async def create_indexes(self, indexes, **kwargs) -> list[str]:
+        await _round_trip()
+        names = []
+        for model in indexes:
+            doc = model.document
+            name = doc["name"]
+            if name not in self._indexes:
+                ix = _Index(name, list(doc["key"].items()), unique=bool(doc.get("unique")))
+                entries = [(k, _k(_id), _id) for _id, d in self._docs.items() for k in ix.keys_of(d)]
+                entries.sort()
+                if ix.unique:
+                    for a, b in zip(entries, entries[1:]):
+                        if a[0] == b[0] and a[1] != b[1]:
+                            self._duplicate(ix, self._docs[b[2]])
+                ix.entries = entries
+                self._indexes[name] = ix
+            names.append(name)
+        self.database._created.add(self.name)
+        return names
+
+    async def create_index(self, keys, **kwargs) -> str:
+        return (await self.create_indexes([IndexModel(keys, **kwargs)]))[0]
+
+    async def drop_index(self, name: str, **kwargs):
+        await _round_trip()
+        if name == "_id_" or name not in self._indexes:
+            raise OperationFailure(f"index not found with name [{name}]", 27)
+        del self._indexes[name]
+
+    async def drop(self, **kwargs):
+        await self.database.drop_collection(self.name)
+
+
+# databases and the client
+
+_TRUNC_SECONDS = {"millisecond": 0.001, "second": 1, "minute": 60, "hour": 3600, "day": 86400, "week": 7 * 86400}
+_TRUNC_MONTHS = {"month": 1, "quarter": 3, "year": 12}
+_WEEKDAYS = {"mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6}
+# $dateTrunc counts bins from here
+_TRUNC_REFERENCE = datetime(2000, 1, 1)
+
+
+def _date_trunc(doc, arg):
+    d = _expr(doc, arg["date"])
+    if d is None:
+        return None
+    d = d.astimezone(UTC).replace(tzinfo=None) if d.tzinfo else d
+    unit = _expr(doc, arg["unit"])
+    n = int(_expr(doc, arg.get("binSize", 1)))
+    if unit in _TRUNC_MONTHS:
+        months = (d.year - 2000) * 12 + d.month - 1
+        months -= months % (_TRUNC_MONTHS[unit] * n)
+        return datetime(2000 + months // 12, months % 12 + 1, 1)
+    ref = _TRUNC_REFERENCE
+    if unit == "week":
+        start = _WEEKDAYS[str(arg.get("startOfWeek", "sunday")).lower()[:3]]
+        ref += timedelta(days=(start - ref.weekday()) % 7)
+    step = timedelta(seconds=_TRUNC_SECONDS[unit] * n)
+    return ref + (d - ref) // step * step
+
+
+def _slice(doc, arg):
+    args = [_expr(doc, a) for a in arg]
+    arr = args[0]
+    if arr is None:
+        return None
+    if len(args) == 2:
+        n = args[1]
+        return arr[n:] if n < 0 else arr[:n]
+    pos, n = args[1], args[2]
+    return arr[pos:][:n] if pos < 0 else arr[pos:pos + n]
+
+
+def _if_null(doc, arg):
+    for a in arg:
+        v = _expr(doc, a)
+        if v is not None:
+            return v
+    return None
+
+
+_EXPRS = {
+    "$literal": lambda doc, arg: arg,
+    "$ifNull": _if_null,
+    "$slice": _slice,
+    "$size": lambda doc, arg: len(_expr(doc, arg[0] if isinstance(arg, list) else arg)),
+    "$dateTrunc": _date_trunc,
+    "$toLower": lambda doc, arg: (_expr(doc, arg[0] if isinstance(arg, list) else arg) or "").lower(),
+    "$toUpper": lambda doc, arg: (_expr(doc, arg[0] if isinstance(arg, list) else arg) or "").upper(),
+    "$concat": lambda doc, arg: "".join(_expr(doc, a) for a in arg),
+    "$add": lambda doc, arg: sum(_expr(doc, a) for a in arg),
+    "$subtract": lambda doc, arg: _expr(doc, arg[0]) - _expr(doc, arg[1]),
+}
+
+
+def _expr_path(value, parts: list[str]):
+    for i, p in enumerate(parts):
+        if isinstance(value, list):
+            vals = (_expr_path(e, parts[i:]) for e in value if isinstance(e, dict))
+            return [v for v in vals if v is not None]
+        if not isinstance(value, dict):
+            return None
+        value = value.get(p)
+    return value
+
+
+def _expr(doc: dict, e):
+    if isinstance(e, str):
+        if e == "$$ROOT":
+            return doc
+        if e.startswith("$"):
+            return _expr_path(doc, e[1:].split("."))
+        return e
+    if isinstance(e, list):
+        return [_expr(doc, x) for x in e]
+    if isinstance(e, dict):
+        if len(e) == 1 and next(iter(e)).startswith("$"):
+            op, arg = next(iter(e.items()))
+            fn = _EXPRS.get(op)
+            if fn is None:
+                raise OperationFailure(f"Unrecognized expression '{op}'", 168)
+            return fn(doc, arg)
+        return {k: _expr(doc, v) for k, v in e.items()}
+    return e
+
+
+def _acc_min(values):
+    values = [v for v in values if v is not None]
+    return min(values, key=_k) if values else None
+
+
+def _acc_max(values):
+    values = [v for v in values if v is not None]
+    return max(values, key=_k) if values else None
+
+
+_ACCUMULATORS = {
+    "$sum": lambda values: sum(v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool)),
+    "$avg": lambda values: (lambda n: sum(n) / len(n) if n else None)(
+        [v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool)]),
+    "$min": _acc_min,
+    "$max": _acc_max,
+    "$first": lambda values: values[0] if values else None,
+    "$last": lambda values: values[-1] if values else None,
+    "$push": list,
+    "$addToSet": lambda values: list({_k(v): v for v in values}.values()),
+}
+
+
+def _group(docs: list[dict], spec: dict) -> list[dict]:
+    groups: dict[tuple, tuple] = {}
+    for doc in docs:
+        gid = _expr(doc, spec["_id"])
+        key = _k(gid)
+        if key not in groups:
+            groups[key] = (gid, [])
+        groups[key][1].append(doc)
+    out = []
+    for gid, members in groups.values():
+        row = {"_id": gid}
+        for field, acc in spec.items():
+            if field == "_id":
+                continue
+            (op, arg), = acc.items()
+            fn = _ACCUMULATORS.get(op)
+            if fn is None:
+                raise OperationFailure(f"unknown group operator '{op}'", 15952)
+            row[field] = fn([_expr(d, arg) for d in members])
+        out.append(row)
+    return out
+
+
+def _project_stage(doc: dict, spec: dict) -> dict:
+    plain = {k: v for k, v in spec.items() if isinstance(v, (bool, int))}
+    computed = {k: v for k, v in spec.items() if k not in plain}
+    if any(v for k, v in plain.items() if k != "_id") or not computed:
+        out = _project(doc, plain or {"_id": 1})
+    else:
+        out = {"_id": doc["_id"]} if plain.get("_id", 1) and "_id" in doc else {}
+    for k, v in computed.items():
+        _put(_walk(out, k.split("."), create=True), k.split(".")[-1], _expr(doc, v))
+    return out
+
+
+def _unwind(docs: list[dict], spec) -> list[dict]:
+    spec = {"path": spec} if isinstance(spec, str) else spec
+    parts = spec["path"][1:].split(".")
+    keep = spec.get("preserveNullAndEmptyArrays", False)
+    out = []
+    for doc in docs:
+        arr = _expr_path(doc, parts)
+        if isinstance(arr, list) and arr:
+            for e in arr:
+                d = _copy(doc)
+                _put(_walk(d, parts, create=True), parts[-1], e)
+                out.append(d)
+        elif arr is not None and not isinstance(arr, list):
+            out.append(doc)
+        elif keep:
+            out.append(doc)
+    return out
+
+
+class MemoryDatabase:
+    def __init__(self, client: "MemoryClient", name: str):
+        self.client = client
+        self.name = name
+        self._collections: dict[str, MemoryCollection] = {}
+        # collections that exist as far as Mongo would say: written to or created
+        self._created: set[str] = set()
+        self._options: dict[str, dict] = {}
+        self._streams: set[MemoryChangeStream] = set()
+        self._event_ids = itertools.count(1)
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        return self.get_collection(name)
+
+    def get_collection(self, name: str, **kwargs) -> MemoryCollection:
+        col = self._collections.get(name)
+        if col is None:
+            col = self._collections[name] = MemoryCollection(self, name)
+        return col
+
+    async def create_collection(self, name: str, **options) -> MemoryCollection:
+        # time-series options are recorded, but the collection stores plain documents
+        if name in self._created:
+            raise CollectionInvalid(f"collection {name} already exists")
+        self._created.add(name)
+        self._options[name] = options
+        return self.get_collection(name)
+
+    async def list_collection_names(self, **kwargs) -> list[str]:
+        return sorted(self._created)
+
+    async def drop_collection(self, name: str, **kwargs):
+        self._collections.pop(name, None)
+        self._created.discard(name)
+        self._options.pop(name, None)
+
+    async def command(self, command, value=None, **kwargs) -> dict:
+        name = command if isinstance(command, str) else next(iter(command))
+        if name == "ping":
+            return {"ok": 1.0}
+        if name == "collMod":
+            target = value if isinstance(command, str) else command[name]
+            if target not in self._created:
+                raise OperationFailure(f"ns does not exist: {self.name}.{target}", 26)
+            self._options[target].update(kwargs)
+            return {"ok": 1.0}
+        raise OperationFailure(f"no such command: '{name}' in the memory backend", 59)
+
+    def watch(self, pipeline=None, full_document=None, resume_after=None, **kwargs) -> MemoryChangeStream:
+        # events from now on; there's no oplog to resume from
+        return MemoryChangeStream(self, pipeline, full_document)
+
+    def _emit(self, op: str, coll: str, _id, doc: dict | None):
+        event = {
+            "_id": {"_data": f"{next(self._event_ids):016x}"},
+            "operationType": op,
+            "ns": {"db": self.name, "coll": coll},
+            "documentKey": {"_id": _id},
+        }
+        for stream in list(self._streams):
+            e = event
+            if doc is not None and (op in ("insert", "replace") or stream.full_document == "updateLookup"):
+                e = {**event, "fullDocument": _copy(doc)}
+            stream._offer(e)
+
+    def _pipeline(self, docs: list[dict], stages: list[dict]) -> list[dict]:
+        for stage in stages:
+            (name, spec), = stage.items()
+            if name == "$match":
+                docs = [d for d in docs if _match(d, spec)]
+            elif name == "$sort":
+                docs = _sort_docs(docs, _sort_spec(spec))
+            elif name == "$skip":
+                docs = docs[spec:]
+            elif name == "$limit":
+                docs = docs[:spec]
+            elif name == "$project":
+                docs = [_project_stage(d, spec) for d in docs]
+            elif name in ("$addFields", "$set"):
+                for d in docs:
+                    for k, e in spec.items():
+                        _put(_walk(d, k.split("."), create=True), k.split(".")[-1], _expr(d, e))
+            elif name == "$unset":
+                for d in docs:
+                    for path in [spec] if isinstance(spec, str) else spec:
+                        _unset(d, path.split("."))
+            elif name == "$unwind":
+                docs = _unwind(docs, spec)
+            elif name == "$lookup":
+                docs = [self._lookup(d, spec) for d in docs]
+            elif name == "$group":
+                docs = _group(docs, spec)
+            elif name == "$count":
+                docs = [{spec: len(docs)}] if docs else []
+            else:
+                raise OperationFailure(f"Unrecognized pipeline stage name: '{name}'", 40324)
+        return docs
+
+    def _lookup(self, doc: dict, spec: dict) -> dict:
+        foreign = self[spec["from"]]
+        local = list(_expand(_resolve(doc, spec["localField"].split("."))))
+        # a missing local field joins on null
+        local = [v for v in local if not isinstance(v, list)] or [None]
+        ids = foreign._find_ids({spec["foreignField"]: {"$in": local}})
+        joined = [_copy(foreign._docs[i]) for i in ids]
+        doc[spec["as"]] = self._pipeline(joined, spec.get("pipeline", []))
+        return doc
+
+
+class MemoryClient:
+    def __init__(self):
+        self._databases: dict[str, MemoryDatabase] = {}
+        self.admin = self["admin"]
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        return self.get_database(name)
+
+    def get_database(self, name: str, **kwargs) -> MemoryDatabase:
+        db = self._databases.get(name)
+        if db is None:
+            db = self._databases[name] = MemoryDatabase(self, name)
+        return db
+
+    async def list_database_names(self, **kwargs) -> list[str]:
+        return sorted(name for name, db in self._databases.items() if db._created)
+
+    async def drop_database(self, name_or_database, **kwargs):
+        name = name_or_database if isinstance(name_or_database, str) else name_or_database.name
+        self._databases.pop(name, None)
+
+    def close(self):
+        pass
@@ -0,0 +1,252 @@
+# metrics.py
+# Request and Mongo command metrics, rendered in Prometheus text format on /metrics.
+# Histograms use one fixed bucket layout and are created once per label set, so the
+# hot path is a dict lookup, a bisect and a few integer adds.
+import time
+from bisect import bisect_left
+
+from pymongo import monitoring
+
+# seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# documents per batched lookup (loader.py)
+BATCH_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> list[str]:
+        out = []
+        acc = 0
+        for le, n in zip(tuple(repr(b) for b in self.buckets) + ("+Inf",), self.counts):
+            acc += n
+            out.append(f'{name}_bucket{{{labels},le="{le}"}} {acc}')
+        out.append(f"{name}_sum{{{labels}}} {self.sum}")
+        out.append(f"{name}_count{{{labels}}} {self.count}")
+        return out
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry:
+    def __init__(self):
+        # id(route object) -> (template, {(method, status): Histogram}); routes live
+        # as long as the app, and aren't hashable in every FastAPI version
+        self.http: dict = {}
+        # (collection, command) -> Histogram
+        self.mongo: dict[tuple[str, str], Histogram] = {}
+        self.mongo_docs: dict[tuple[str, str], int] = {}
+        self.mongo_failures: dict[tuple[str, str], int] = {}
+        self.pool_wait = Histogram()
+        self.pool_checkout_failures = 0
+        # collection -> Histogram of loader batch sizes
+        self.loader_batches: dict[str, Histogram] = {}
+        # request class -> Histogram of time spent queued by admission.py
+        self.queue_wait: dict[str, Histogram] = {}
+
+    def observe_request(self, scope: dict, status: int, seconds: float):
+        route = id(scope.get("route"))
+        entry = self.http.get(route)
+        if entry is None:
+            entry = self.http[route] = (route_template(scope), {})
+        key = (scope["method"], status)
+        hist = entry[1].get(key)
+        if hist is None:
+            hist = entry[1][key] = Histogram()
+        hist.observe(seconds)
+
+    def observe_command(self, collection: str, command: str, seconds: float, docs: int):
+        key = (collection, command)
+        hist = self.mongo.get(key)
+        if hist is None:
+            hist = self.mongo[key] = Histogram()
+            self.mongo_docs[key] = 0
+        hist.observe(seconds)
+        self.mongo_docs[key] += docs
+
+    def observe_batch(self, collection: str, size: int):
+        hist = self.loader_batches.get(collection)
+        if hist is None:
+            hist = self.loader_batches[collection] = Histogram(BATCH_BUCKETS)
+        hist.observe(size)
+
+    def observe_queue_wait(self, klass: str, seconds: float):
+        hist = self.queue_wait.get(klass)
+        if hist is None:
+            hist = self.queue_wait[klass] = Histogram()
+        hist.observe(seconds)
+
+    def command_failed(self, collection: str, command: str):
+        key = (collection, command)
+        self.mongo_failures[key] = self.mongo_failures.get(key, 0) + 1
+
+    def render(self, gauges: dict[str, float] | None = None) -> str:
+        lines = [
+            "# HELP http_request_duration_seconds Request latency by route template, method and status.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for template, hists in list(self.http.values()):
+            for (method, status), hist in list(hists.items()):
+                labels = f'route="{_escape(template)}",method="{method}",status="{status}"'
+                lines.extend(hist.render("http_request_duration_seconds", labels))
+
+        lines += [
+            "# HELP mongo_command_duration_seconds Mongo command latency by collection and command.",
+            "# TYPE mongo_command_duration_seconds histogram",
+        ]
+        for (coll, cmd), hist in list(self.mongo.items()):
+            lines.extend(hist.render("mongo_command_duration_seconds", f'collection="{coll}",command="{cmd}"'))
+        lines += [
+            "# HELP mongo_command_documents_total Documents returned by Mongo commands.",
+            "# TYPE mongo_command_documents_total counter",
+        ]
+        for (coll, cmd), n in list(self.mongo_docs.items()):
+            lines.append(f'mongo_command_documents_total{{collection="{coll}",command="{cmd}"}} {n}')
+        lines += [
+            "# HELP mongo_command_failures_total Failed Mongo commands.",
+            "# TYPE mongo_command_failures_total counter",
+        ]
+        for (coll, cmd), n in list(self.mongo_failures.items()):
+            lines.append(f'mongo_command_failures_total{{collection="{coll}",command="{cmd}"}} {n}')
+
+        lines += [
+            "# HELP mongo_pool_checkout_wait_seconds Time spent waiting for a pooled connection.",
+            "# TYPE mongo_pool_checkout_wait_seconds histogram",
+        ]
+        lines.extend(self.pool_wait.render("mongo_pool_checkout_wait_seconds", 'pool="default"'))
+        lines.append("# TYPE mongo_pool_checkout_failures_total counter")
+        lines.append(f"mongo_pool_checkout_failures_total {self.pool_checkout_failures}")
+
+        lines += [
+            "# HELP loader_batch_size Lookups merged into one Mongo query by the document loaders.",
+            "# TYPE loader_batch_size histogram",
+        ]
+        for coll, hist in list(self.loader_batches.items()):
+            lines.extend(hist.render("loader_batch_size", f'collection="{coll}"'))
+
+        lines += [
+            "# HELP admission_queue_wait_seconds Time requests spent queued for admission.",
+            "# TYPE admission_queue_wait_seconds histogram",
+        ]
+        for klass, hist in list(self.queue_wait.items()):
+            lines.extend(hist.render("admission_queue_wait_seconds", f'class="{klass}"'))
+
+        # gauge keys may carry labels, e.g. 'app_cache_hits{cache="bets"}'
+        typed = set()
+        for name, value in (gauges or {}).items():
+            base = name.split("{", 1)[0]
+            if base not in typed:
+                typed.add(base)
+                lines.append(f"# TYPE {base} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def route_template(scope: dict) -> str:
+    # routes of an included router may only know their own part of the path, so take
+    # the prefix from the concrete path; done once per route, the registry caches it
+    route = scope.get("route")
+    if route is None:
+        return "<unmatched>"
+    template = (getattr(route, "path_format", None) or getattr(route, "path", "")).strip("/")
+    segments = scope["path"].strip("/").split("/")
+    own = template.split("/") if template else []
+    return "/" + "/".join(segments[: max(len(segments) - len(own), 0)] + own)
+
+
+REGISTRY = Registry()
+
+
+class MetricsMiddleware:
+    def __init__(self, app, registry: Registry = REGISTRY):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.registry.observe_request(scope, status, time.perf_counter() - t0)
+
+
+def _collection_of(event) -> str:
+    name = event.command_name
+    target = event.command.get(name)
+    if name == "getMore":
+        return event.command.get("collection", "")
+    return target if isinstance(target, str) else ""
+
+
+def _docs_in(reply: dict) -> int:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or ())
+    if "value" in reply:
+        return 0 if reply["value"] is None else 1
+    return 0
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    # pymongo calls these from whichever thread ran the command
+    def __init__(self, registry: Registry = REGISTRY):
+        self.registry = registry
+        self._inflight: dict[tuple, str] = {}
+
+    def started(self, event):
+        self._inflight[(event.connection_id, event.request_id)] = _collection_of(event)
+
+    def succeeded(self, event):
+        coll = self._inflight.pop((event.connection_id, event.request_id), "")
+        self.registry.observe_command(coll, event.command_name, event.duration_micros / 1e6, _docs_in(event.reply))
+
+    def failed(self, event):
+        coll = self._inflight.pop((event.connection_id, event.request_id), "")
+        self.registry.command_failed(coll, event.command_name)
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    def __init__(self, registry: Registry = REGISTRY):
+        self.registry = registry
+
+    def connection_checked_out(self, event):
+        # duration covers the whole checkout, including waiting for a free connection
+        self.registry.pool_wait.observe(getattr(event, "duration", 0.0))
+
+    def connection_check_out_failed(self, event):
+        self.registry.pool_checkout_failures += 1
+
+    # the rest of the pool lifecycle isn't interesting here
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_created(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+    def connection_check_out_started(self, event): pass
+    def connection_checked_in(self, event): pass
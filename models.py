@@ -3,7 +3,9 @@ from __future__ import annotations
 from typing import Optional, List, Dict
 from datetime import datetime, UTC
 from enum import Enum
-from pydantic import BaseModel, Field, EmailStr
+from functools import lru_cache
+from pydantic import BaseModel, Field, EmailStr, create_model
+from pymongo import IndexModel
 
 
 class BetStatus(str, Enum):
@@ -19,6 +21,52 @@ class BetProgress(BaseModel):
     last_updated: datetime = Field(default_factory=lambda: datetime.now(UTC))
 
 
+class BetProgressBatchItem(BetProgress):
+    bet_id: str
+
+
+class ProgressResultStatus(str, Enum):
+    updated = "updated"
+    inserted = "inserted"
+    superseded = "superseded"
+    not_found = "not_found"
+    invalid = "invalid"
+
+
+class HistoryUnit(str, Enum):
+    minute = "minute"
+    hour = "hour"
+    day = "day"
+    week = "week"
+
+
+class ProgressBucket(BaseModel):
+    # start of the bucket; progress is the last value in it
+    t: datetime
+    progress: float
+    min: float
+    max: float
+    points: int
+
+
+class ProgressSeries(BaseModel):
+    user_id: str
+    buckets: List[ProgressBucket] = []
+
+
+class ProgressHistory(BaseModel):
+    bet_id: str
+    unit: HistoryUnit
+    bin_size: int
+    series: List[ProgressSeries] = []
+
+
+class BetProgressResult(BaseModel):
+    bet_id: str
+    user_id: str
+    status: ProgressResultStatus
+
+
 class BetBase(BaseModel):
     group_id: str
     title: str
@@ -71,6 +119,56 @@ class GroupOut(GroupBase):
     id: str = Field(alias="_id")
 
 
+class MemberSummary(BaseModel):
+    id: str = Field(alias="_id")
+    username: str
+    profile_url: str
+    average_spending: float
+
+
+class ProgressWithUser(BetProgress):
+    username: Optional[str] = None
+
+
+class OverviewBet(BetOut):
+    user_progress: List[ProgressWithUser] = []
+
+
+class BetSummary(BaseModel):
+    id: str = Field(alias="_id")
+    title: str
+    status: BetStatus
+    start_date: datetime
+    end_date: datetime
+
+
+class GroupOverview(BaseModel):
+    group: GroupOut
+    members: List[MemberSummary] = []
+    current_bet: Optional[OverviewBet] = None
+    past_bets: List[BetSummary] = []
+
+
+class BetCompletion(BaseModel):
+    bet_id: str
+    participants: int
+    mean_progress: Optional[float] = None
+    # progress bucket ("0-25" ... "100+") -> participants
+    distribution: Dict[str, int] = {}
+
+
+class GroupStats(BaseModel):
+    group_id: str
+    member_count: int = 0
+    mean_spending: Optional[float] = None
+    # interpolated inside the spending buckets, not the exact median
+    median_spending_estimate: Optional[float] = None
+    # spending bucket ("0-5" ... "5000+") -> members
+    spending_distribution: Dict[str, int] = {}
+    current_bet: Optional[BetCompletion] = None
+    updated_at: Optional[datetime] = None
+
+
 class UserBase(BaseModel):
     profile_url: str
     username: str
@@ -83,6 +181,11 @@ class UserCreate(UserBase):
     password: str
 
 
+class UserLogin(BaseModel):
+    email: EmailStr
+    password: str
+
+
 class UserUpdate(BaseModel):
     profile_url: Optional[str] = None
     username: Optional[str] = None
@@ -94,3 +197,57 @@ class UserUpdate(BaseModel):
 
 class UserOut(UserBase):
     id: str = Field(alias="_id")
+
+
+
+# a response model cut down to the fields of a sparse fieldset (?fields=), plus _id;
+# the fields keep their types, defaults and aliases
+@lru_cache(maxsize=256)
+def partial_model(model: type[BaseModel], fields: tuple[str, ...]) -> type[BaseModel]:
+    keep = {
+        name: (f.annotation, f)
+        for name, f in model.model_fields.items()
+        if (f.alias or name) in fields or f.alias == "_id"
+    }
+    return create_model(f"{model.__name__}Partial", **keep)
+
+# index definitions per collection; indexes.ensure_indexes creates whichever are
+# missing at startup (or offline via `python indexes.py`)
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel("email", unique=True),
+        IndexModel("group_ids"),
+        # prefix search (GET /users/search)
+        IndexModel("username_lc"),
+    ],
+    "groups": [
+        IndexModel("name", unique=True),
+        IndexModel("user_ids"),
+        IndexModel("current_bet_id"),
+        IndexModel("past_bet_ids"),
+        # prefix search (GET /groups/search); names differing only in case may coexist
+        IndexModel("name_lc"),
+    ],
+    "bets": [
+        IndexModel([("group_id", 1), ("status", 1), ("start_date", 1)]),
+        # the scheduler's deadline scans (scheduler.TRANSITIONS): due planned and
+        # active bets without touching the ones that aren't due
+        IndexModel([("status", 1), ("start_date", 1)]),
+        IndexModel([("status", 1), ("end_date", 1)]),
+        # a user's bets in _id order (GET /users/{id}/bets); the prefix also serves
+        # plain user_progress.user_id lookups, so the old single-field index is
+        # retired (RETIRED_INDEXES)
+        IndexModel([("user_progress.user_id", 1), ("_id", 1)]),
+        # a group's bet history, newest first (GET /groups/{id}/bets/history)
+        IndexModel([("group_id", 1), ("status", 1), ("_id", 1)]),
+    ],
+}
+
+# indexes that something in INDEXES has replaced, as key specs; `python indexes.py`
+# drops them once their replacements exist (the app itself never drops indexes)
+RETIRED_INDEXES: Dict[str, List[List[tuple]]] = {
+    "bets": [
+        # covered by the (user_progress.user_id, _id) prefix
+        [("user_progress.user_id", 1)],
+    ],
+}
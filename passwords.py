@@ -0,0 +1,100 @@
+# passwords.py
+# Runs password hashing and verification on a bounded worker pool so a slow KDF
+# never blocks the event loop. Waiting callers are capped too: past max_waiting a
+# request's hash or verify raises PoolFull, which main.py turns into a 503, so a
+# login flood gets backpressure instead of an unbounded queue. Batch callers (the
+# importer) pass wait=True: they queue regardless and are counted apart, so a big
+# import never fills the cap that interactive requests are shed against. They
+# bound themselves instead, a few pool-fulls at a time (HASH_CHUNK_FACTOR).
+import asyncio
+import secrets
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from utils import hash_password, verify_password
+
+PASSWORD_POOL_KIND = "thread"  # or "process"
+PASSWORD_POOL_SIZE = 4
+PASSWORD_MAX_WAITING = 256
+# batch callers keep at most size * HASH_CHUNK_FACTOR hashes queued
+HASH_CHUNK_FACTOR = 2
+
+
+class PoolFull(Exception):
+    pass
+
+
+class PasswordPool:
+    def __init__(
+        self,
+        size: int = PASSWORD_POOL_SIZE,
+        kind: str = PASSWORD_POOL_KIND,
+        max_waiting: int = PASSWORD_MAX_WAITING,
+    ):
+        # hashlib.scrypt releases the GIL, so threads are enough; a process pool
+        # is there for KDFs that don't
+        if kind == "process":
+            self._executor = ProcessPoolExecutor(max_workers=size)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="pwhash")
+        self.size = size
+        self.max_waiting = max_waiting
+        self._slots = asyncio.Semaphore(size)
+        self._dummy_hash: str | None = None
+        self.waiting = 0
+        self.batch_waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def _run(self, fn, *args, wait: bool = False):
+        if not wait and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise PoolFull()
+        counter = "batch_waiting" if wait else "waiting"
+        setattr(self, counter, getattr(self, counter) + 1)
+        try:
+            await self._slots.acquire()
+        finally:
+            setattr(self, counter, getattr(self, counter) - 1)
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._slots.release()
+
+    async def hash(self, pw: str, wait: bool = False) -> str:
+        return await self._run(hash_password, pw, wait=wait)
+
+    async def hash_many(self, pws: list[str]) -> list[str]:
+        # for batch jobs: hashed a chunk at a time, so interactive callers queue
+        # behind at most one chunk
+        chunk = self.size * HASH_CHUNK_FACTOR
+        out: list[str] = []
+        for i in range(0, len(pws), chunk):
+            out.extend(await asyncio.gather(*(self.hash(pw, wait=True) for pw in pws[i:i + chunk])))
+        return out
+
+    async def verify(self, pw: str, stored: str) -> tuple[bool, bool]:
+        return await self._run(verify_password, pw, stored)
+
+    async def verify_missing(self, pw: str):
+        # a login for an unknown account pays for a verify too, so the response time
+        # doesn't tell which emails are registered
+        if self._dummy_hash is None:
+            self._dummy_hash = await self.hash(secrets.token_urlsafe(16))
+        await self.verify(pw, self._dummy_hash)
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "waiting": self.waiting,
+            "batch_waiting": self.batch_waiting,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,88 @@
+# past_bets.py
+# Groups keep only their most recent finished bets in past_bet_ids, at most
+# RECENT_PAST_BETS of them; the full history is read from the bets collection
+# (GET /groups/{id}/bets/history, on the (group_id, status, _id) index). Before the
+# cap, finish_bet's $addToSet grew the array for as long as a group was active, and
+# every group read carried the whole history.
+#
+# Groups written before the cap are trimmed by a one-off migration. A trimmed id
+# loses nothing as long as its bet carries the group's id and status "finished";
+# the dry run counts the ones that don't, to be fixed in bets before trimming:
+#
+#   python past_bets.py --dry-run
+#   python past_bets.py
+import argparse
+import asyncio
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from versions import bumped
+
+# the overview's OVERVIEW_PAST_BETS come out of this window
+RECENT_PAST_BETS = 20
+MIGRATION_BATCH_SIZE = 500
+
+
+def push_past_bet_op(gid: ObjectId, bid: ObjectId) -> UpdateOne:
+    # append and cap in one update; guarded so a bet already listed doesn't move or
+    # bump the group's version
+    return UpdateOne(
+        {"_id": gid, "past_bet_ids": {"$ne": bid}},
+        bumped({"$push": {"past_bet_ids": {"$each": [bid], "$slice": -RECENT_PAST_BETS}}}),
+    )
+
+
+async def _unfinished(bets, gid: ObjectId, ids: list[ObjectId]) -> list[ObjectId]:
+    # ids that the bets collection wouldn't list in this group's history
+    found = set()
+    async for b in bets.find({"_id": {"$in": ids}, "group_id": gid, "status": "finished"}, {"_id": 1}):
+        found.add(b["_id"])
+    return [bid for bid in ids if bid not in found]
+
+
+async def migrate(db, dry_run: bool = False, batch_size: int = MIGRATION_BATCH_SIZE) -> dict:
+    groups, bets = db["groups"], db["bets"]
+    report = {"groups": 0, "trimmed_ids": 0, "not_in_history": 0}
+    ops = []
+    # groups with more than the window, i.e. with an element at index RECENT_PAST_BETS
+    async for g in groups.find({f"past_bet_ids.{RECENT_PAST_BETS}": {"$exists": True}}, {"past_bet_ids": 1}):
+        ids = g["past_bet_ids"]
+        old = ids[:-RECENT_PAST_BETS]
+        report["groups"] += 1
+        report["trimmed_ids"] += len(old)
+        report["not_in_history"] += len(await _unfinished(bets, g["_id"], old))
+        if dry_run:
+            continue
+        # matching on the array read keeps a concurrent finish from being lost;
+        # that group is simply left for the next run
+        ops.append(UpdateOne(
+            {"_id": g["_id"], "past_bet_ids": ids},
+            bumped({"$set": {"past_bet_ids": ids[-RECENT_PAST_BETS:]}}),
+        ))
+        if len(ops) >= batch_size:
+            await groups.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await groups.bulk_write(ops, ordered=False)
+    return report
+
+
+async def main():
+    from db import create_client, DB_NAME
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dry-run", action="store_true", help="report what would be trimmed without writing")
+    args = ap.parse_args()
+
+    client = await create_client()
+    try:
+        report = await migrate(client[DB_NAME], dry_run=args.dry_run)
+    finally:
+        client.close()
+    print(f"{'would trim' if args.dry_run else 'trimmed'} {report['trimmed_ids']} ids in {report['groups']} group(s); "
+          f"{report['not_in_history']} of them aren't finished bets of their group and won't show in its history")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
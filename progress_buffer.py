@@ -0,0 +1,162 @@
+# progress_buffer.py
+# Opt-in write-behind buffer for bet progress updates. Clients that post progress
+# every few seconds only care about the latest value, so updates are held in memory
+# keyed by (bet_id, user_id) and written out with one unordered bulk_write per flush.
+# A flush reads the bets it writes first, so the group stats get the same completion
+# deltas the unbuffered paths apply (group_stats.batch_progress_ops).
+import asyncio
+import logging
+from datetime import datetime, UTC
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+import group_stats
+from versions import bumped
+
+PROGRESS_BUFFER_ENABLED = False
+FLUSH_INTERVAL_S = 2.0
+FLUSH_THRESHOLD = 1_000
+MAX_PENDING = 50_000
+
+log = logging.getLogger(__name__)
+
+
+def progress_write_ops(bid: ObjectId, uid: ObjectId, progress: float, ts: datetime) -> list[UpdateOne]:
+    # same effect as set_user_progress: update the entry in place, or append it when
+    # the user has none yet. the second filter excludes bets that already have the
+    # entry, so the pair gives the same result in whatever order the server runs it
+    return [
+        UpdateOne(
+            {"_id": bid, "user_progress.user_id": uid},
+            bumped({"$set": {"user_progress.$.progress": progress, "user_progress.$.last_updated": ts}}),
+        ),
+        UpdateOne(
+            {"_id": bid, "user_progress.user_id": {"$ne": uid}},
+            bumped({"$push": {"user_progress": {"user_id": uid, "progress": progress, "last_updated": ts}}}),
+        ),
+    ]
+
+
+class ProgressBuffer:
+    def __init__(
+        self,
+        col,
+        interval: float = FLUSH_INTERVAL_S,
+        threshold: int = FLUSH_THRESHOLD,
+        max_pending: int = MAX_PENDING,
+        cache=None,
+        history=None,
+        stats_col=None,
+    ):
+        self.col = col
+        self.cache = cache
+        # the group_stats collection
+        self.stats_col = stats_col
+        # progress_history.ProgressHistory; gets the value each flush wrote
+        self.history = history
+        self.interval = interval
+        self.threshold = threshold
+        self.max_pending = max_pending
+        self._pending: dict[tuple[ObjectId, ObjectId], tuple[float, datetime]] = {}
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self.received = 0
+        self.merged = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+
+    # returns False when the buffer is full and the update was dropped
+    def add(self, bid: ObjectId, uid: ObjectId, progress: float) -> bool:
+        key = (bid, uid)
+        self.received += 1
+        if key in self._pending:
+            self.merged += 1
+        elif len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return False
+        self._pending[key] = (progress, datetime.now(UTC))
+        if len(self._pending) >= self.threshold:
+            self._wake.set()
+        return True
+
+    async def flush(self) -> int:
+        async with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            ops = []
+            for (bid, uid), (progress, ts) in batch.items():
+                ops.extend(progress_write_ops(bid, uid, progress, ts))
+            before = None
+            try:
+                if self.stats_col is not None and group_stats.GROUP_STATS_ENABLED:
+                    before = await group_stats.progress_before(self.col, {bid for bid, _ in batch})
+                await self.col.bulk_write(ops, ordered=False)
+            except PyMongoError:
+                log.exception("progress flush failed, requeueing %d updates", len(batch))
+                self.failed_flushes += 1
+                self._requeue(batch)
+                return 0
+            if self.cache is not None:
+                self.cache.invalidate(*{bid for bid, _ in batch})
+            if before is not None:
+                writes = [(bid, uid, progress) for (bid, uid), (progress, _) in batch.items()]
+                try:
+                    await group_stats.apply(self.stats_col, group_stats.batch_progress_ops(before, writes))
+                except PyMongoError:
+                    # the progress is written; only the summary drifts until a rebuild
+                    log.exception("group stats update for a progress flush failed")
+            if self.history is not None:
+                for (bid, uid), (progress, ts) in batch.items():
+                    self.history.add(bid, uid, progress, ts)
+            self.flushes += 1
+            self.flushed += len(batch)
+            return len(batch)
+
+    def _requeue(self, batch: dict):
+        for key, value in batch.items():
+            if key in self._pending:
+                # a newer value arrived while the flush was in flight
+                self.merged += 1
+            elif len(self._pending) >= self.max_pending:
+                self.dropped += 1
+            else:
+                self._pending[key] = value
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        # let an in-flight flush finish rather than cancelling it mid bulk_write
+        self._closing = True
+        self._wake.set()
+        if self._task:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "received": self.received,
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+        }
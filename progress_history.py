@@ -0,0 +1,197 @@
+# progress_history.py
+# Progress over time. Bets only keep each participant's latest progress, so every
+# progress write also appends a point to the progress_history time-series
+# collection, one measurement per (bet, user) with the bet and user as metadata.
+# Appends are queued in memory and written with one unordered insert_many per
+# flush, off the request path. Points expire after RETENTION_DAYS.
+#
+# Charts read it through GET /bets/{id}/progress/history, which buckets points
+# server-side with $dateTrunc, so clients never download raw points.
+# Time-series collections need MongoDB 5.0+ ($dateTrunc too).
+import asyncio
+import logging
+from datetime import datetime, UTC
+
+from bson import ObjectId
+from pymongo import IndexModel
+from pymongo.errors import CollectionInvalid, OperationFailure, PyMongoError
+
+PROGRESS_HISTORY_ENABLED = True
+HISTORY_COLLECTION = "progress_history"
+RETENTION_DAYS = 180
+# how the server lays out buckets; progress arrives every few seconds to minutes
+GRANULARITY = "minutes"
+FLUSH_INTERVAL_S = 1.0
+FLUSH_THRESHOLD = 1_000
+MAX_PENDING = 100_000
+# created with the collection; MongoDB 6.3+ would add an equivalent one itself
+HISTORY_INDEX = IndexModel([("meta.bet_id", 1), ("meta.user_id", 1), ("ts", 1)])
+
+log = logging.getLogger(__name__)
+
+
+def point(bid: ObjectId, uid: ObjectId, progress: float, ts: datetime) -> dict:
+    return {"ts": ts, "meta": {"bet_id": bid, "user_id": uid}, "progress": progress}
+
+
+async def ensure_collection(db, retention_days: int = RETENTION_DAYS):
+    expire = retention_days * 86400
+    try:
+        await db.create_collection(
+            HISTORY_COLLECTION,
+            timeseries={"timeField": "ts", "metaField": "meta", "granularity": GRANULARITY},
+            expireAfterSeconds=expire,
+        )
+        await db[HISTORY_COLLECTION].create_indexes([HISTORY_INDEX])
+    except CollectionInvalid:
+        # already there; keep its retention in line with the setting
+        await db.command("collMod", HISTORY_COLLECTION, expireAfterSeconds=expire)
+
+
+class ProgressHistory:
+    def __init__(
+        self,
+        db,
+        interval: float = FLUSH_INTERVAL_S,
+        threshold: int = FLUSH_THRESHOLD,
+        max_pending: int = MAX_PENDING,
+    ):
+        self.db = db
+        self.col = db[HISTORY_COLLECTION]
+        self.interval = interval
+        self.threshold = threshold
+        self.max_pending = max_pending
+        self.available = False
+        self._pending: list[dict] = []
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self.received = 0
+        self.dropped = 0
+        self.written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+
+    # no I/O: callers on the progress path only queue the point
+    def add(self, bid: ObjectId, uid: ObjectId, progress: float, ts: datetime | None = None):
+        if not self.available:
+            return
+        self.received += 1
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append(point(bid, uid, progress, ts or datetime.now(UTC)))
+        if len(self._pending) >= self.threshold:
+            self._wake.set()
+
+    def add_entries(self, bid: ObjectId, entries: list[dict]):
+        # a whole user_progress list, as written by create/patch/import
+        for p in entries:
+            self.add(bid, p["user_id"], p.get("progress", 0.0), p.get("last_updated"))
+
+    async def flush(self) -> int:
+        async with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, []
+            try:
+                await self.col.insert_many(batch, ordered=False)
+            except PyMongoError:
+                log.exception("progress history flush failed, requeueing %d points", len(batch))
+                self.failed_flushes += 1
+                room = max(self.max_pending - len(self._pending), 0)
+                self.dropped += max(len(batch) - room, 0)
+                # oldest first, so the points that still fit are the older ones
+                self._pending[:0] = batch[:room]
+                return 0
+            self.flushes += 1
+            self.written += len(batch)
+            return len(batch)
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def start(self):
+        try:
+            await ensure_collection(self.db)
+        except OperationFailure as e:
+            log.warning("progress history disabled, no time-series collection: %s", e)
+            return
+        self.available = True
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        self._closing = True
+        self._wake.set()
+        if self._task:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "available": self.available,
+            "pending": len(self._pending),
+            "received": self.received,
+            "dropped": self.dropped,
+            "written": self.written,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+# chart queries
+BUCKET_UNITS = ("minute", "hour", "day", "week")
+UNIT_SECONDS = {"minute": 60, "hour": 3600, "day": 86400, "week": 7 * 86400}
+# buckets per series one request may ask for
+MAX_BUCKETS = 2_000
+
+
+def history_pipeline(bid: ObjectId, uid: ObjectId | None, since: datetime, until: datetime,
+                     unit: str, bin_size: int) -> list[dict]:
+    # one bucket per (user, unit) with the last value in it, plus min/max for the
+    # band and the number of raw points it stands for
+    match = {"meta.bet_id": bid, "ts": {"$gte": since, "$lt": until}}
+    if uid is not None:
+        match["meta.user_id"] = uid
+    return [
+        {"$match": match},
+        {"$sort": {"ts": 1}},
+        {"$group": {
+            "_id": {
+                "user_id": "$meta.user_id",
+                "t": {"$dateTrunc": {"date": "$ts", "unit": unit, "binSize": bin_size}},
+            },
+            "progress": {"$last": "$progress"},
+            "min": {"$min": "$progress"},
+            "max": {"$max": "$progress"},
+            "points": {"$sum": 1},
+        }},
+        {"$sort": {"_id.user_id": 1, "_id.t": 1}},
+    ]
+
+
+def shape_history(bid: ObjectId, unit: str, bin_size: int, rows: list[dict]) -> dict:
+    series: dict = {}
+    for r in rows:
+        uid = str(r["_id"]["user_id"])
+        series.setdefault(uid, []).append({
+            "t": r["_id"]["t"],
+            "progress": r["progress"],
+            "min": r["min"],
+            "max": r["max"],
+            "points": r["points"],
+        })
+    return {
+        "bet_id": str(bid),
+        "unit": unit,
+        "bin_size": bin_size,
+        "series": [{"user_id": uid, "buckets": b} for uid, b in series.items()],
+    }
@@ -1,21 +1,68 @@
 # routers/bets.py
+import asyncio
+import json
 from typing import List, Optional
-from datetime import datetime, UTC
+from datetime import datetime, timedelta, UTC
 
-from fastapi import APIRouter, Request, HTTPException, Query
-from pymongo import ReturnDocument
+from fastapi import APIRouter, Request, Response, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from pymongo import ReturnDocument, UpdateOne
 from bson import ObjectId
 
-from models import BetCreate, BetUpdate, BetOut, BetStatus
-from utils import to_oid
+from models import (
+    BetCreate, BetUpdate, BetOut, BetStatus,
+    BetProgress, BetProgressBatchItem, BetProgressResult, ProgressResultStatus,
+    HistoryUnit, ProgressHistory,
+)
+import group_stats
+from changefeed import progress_event
+from db import DB_NAME
+from export import ndjson_export, EXPORT_BATCH_SIZE, MAX_EXPORT_BATCH_SIZE
+from importer import import_rows, import_format, IMPORT_BATCH_SIZE
+from past_bets import push_past_bet_op
+from progress_buffer import progress_write_ops
+from progress_history import history_pipeline, shape_history, UNIT_SECONDS, MAX_BUCKETS
+from serialize import respond, fieldset, bet_shape
+from utils import to_oid, encode_cursor, decode_cursor
+from versions import VERSION_FIELD, bumped, etag, version_of, not_modified
 
 router = APIRouter()
 
+MAX_PROGRESS_BATCH = 10_000
+SSE_KEEPALIVE_S = 15.0
+# GET /{id}/progress/history without since
+HISTORY_WINDOW = timedelta(days=7)
+
 def bets_col(req: Request):
-    return req.app.state.mongo["hackathon"]["bets"]
+    return req.app.state.mongo[DB_NAME]["bets"]
 
 def groups_col(req: Request):
-    return req.app.state.mongo["hackathon"]["groups"]
+    return req.app.state.mongo[DB_NAME]["groups"]
+
+def stats_col(req: Request):
+    return req.app.state.mongo[DB_NAME]["group_stats"]
+
+def bets_cache(req: Request):
+    return req.app.state.caches["bets"]
+
+def groups_cache(req: Request):
+    return req.app.state.caches["groups"]
+
+def bets_loader(req: Request):
+    return req.app.state.loaders["bets"]
+
+def progress_history(req: Request):
+    return req.app.state.progress_history
+
+# keep the lifecycle scheduler's view of deadlines current
+def reschedule(req: Request, doc: dict | None = None, bid: ObjectId | None = None):
+    sched = req.app.state.scheduler
+    if sched is None:
+        return
+    if doc is not None:
+        sched.schedule(doc)
+    elif bid is not None:
+        sched.unschedule(bid)
 
 # helpers
 def oid_str(x):
@@ -24,10 +71,11 @@ def oid_str(x):
 def normalize_bet(doc: dict) -> dict:
     d = dict(doc)
     d["_id"] = oid_str(d["_id"])
-    d["group_id"] = oid_str(d["group_id"])
-    up = d.get("user_progress") or []
-    for p in up:
-        p["user_id"] = oid_str(p.get("user_id"))
+    if "group_id" in d:
+        d["group_id"] = oid_str(d["group_id"])
+    if isinstance(d.get("user_progress"), list):
+        # copy the entries too: loaded documents are shared between requests
+        d["user_progress"] = [{**p, "user_id": oid_str(p.get("user_id"))} for p in d["user_progress"]]
     return d
 
 def to_oid_progress_list(items: list[dict] | None) -> list[dict]:
@@ -41,42 +89,132 @@ def to_oid_progress_list(items: list[dict] | None) -> list[dict]:
         out.append(q)
     return out
 
-@router.post("", response_model=BetOut, status_code=201)
-async def create_bet(request: Request, payload: BetCreate):
-    c = bets_col(request)
+def bet_to_storage(payload: BetCreate) -> dict:
     doc = payload.model_dump()
     # convert ids to ObjectId for storage
     doc["group_id"] = to_oid(doc["group_id"])
     doc["user_progress"] = to_oid_progress_list(doc.get("user_progress"))
+    doc[VERSION_FIELD] = 1
+    return doc
+
+@router.post("", response_model=BetOut, status_code=201)
+async def create_bet(request: Request, payload: BetCreate):
+    c = bets_col(request)
+    doc = bet_to_storage(payload)
     res = await c.insert_one(doc)
+    if doc["user_progress"]:
+        if group_stats.is_open(doc):
+            await group_stats.apply(stats_col(request), [
+                group_stats.set_bet_op(doc["group_id"], res.inserted_id, doc["user_progress"])
+            ])
+        progress_history(request).add_entries(res.inserted_id, doc["user_progress"])
     saved = await c.find_one({"_id": res.inserted_id})
+    reschedule(request, saved)
     return normalize_bet(saved)
 
+@router.post("/import")
+async def import_bets(request: Request, batch_size: int = Query(IMPORT_BATCH_SIZE, ge=1, le=10_000)):
+    sched = request.app.state.scheduler
+    history = progress_history(request)
+
+    async def on_inserted(docs: list[dict]):
+        if sched is not None:
+            for d in docs:
+                sched.schedule(d)
+        for d in docs:
+            history.add_entries(d["_id"], d["user_progress"])
+        await group_stats.apply(stats_col(request), [
+            group_stats.set_bet_op(d["group_id"], d["_id"], d["user_progress"])
+            for d in docs if d["user_progress"] and group_stats.is_open(d)
+        ])
+
+    return await import_rows(
+        bets_col(request),
+        request.stream(),
+        import_format(request.headers.get("content-type")),
+        BetCreate,
+        bet_to_storage,
+        batch_size=batch_size,
+        on_inserted=on_inserted,
+    )
+
 @router.get("", response_model=List[BetOut])
 async def list_bets(
     request: Request,
+    response: Response,
     limit: int = Query(50, ge=1, le=200),
     skip: int = 0,
+    after: Optional[str] = None,
+    group_id: Optional[str] = None,
+    status: Optional[BetStatus] = None,
+    fields: Optional[str] = None,
+):
+    c = bets_col(request)
+    shape, model, projection = fieldset(bet_shape, BetOut, fields)
+    filt = {}
+    if group_id:
+        filt["group_id"] = to_oid(group_id)
+    if status:
+        filt["status"] = status
+    cursor_filters = {"group_id": group_id, "status": status.value if status else None}
+    if after:
+        # keyset page: seek past the last _id instead of walking skipped docs
+        filt["_id"] = {"$gt": decode_cursor(after, cursor_filters)}
+    cur = c.find(filt, projection).sort("_id", 1).skip(skip).limit(limit)
+    docs = [d async for d in cur]
+    if len(docs) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(docs[-1]["_id"], cursor_filters)
+    return respond(docs, shape, normalize_bet, response, model=model)
+
+@router.get("/export")
+async def export_bets(
+    request: Request,
+    batch_size: int = Query(EXPORT_BATCH_SIZE, ge=1, le=MAX_EXPORT_BATCH_SIZE),
+    after: Optional[str] = None,
     group_id: Optional[str] = None,
     status: Optional[BetStatus] = None,
+    fields: Optional[str] = None,
 ):
     c = bets_col(request)
+    shape, model, projection = fieldset(bet_shape, BetOut, fields)
     filt = {}
     if group_id:
         filt["group_id"] = to_oid(group_id)
     if status:
         filt["status"] = status
-    cur = c.find(filt).sort("_id", 1).skip(skip).limit(limit)
-    docs = [normalize_bet(d) async for d in cur]
-    return docs
+    if after:
+        filt["_id"] = {"$gt": to_oid(after)}
+    cur = c.find(filt, projection).sort("_id", 1).batch_size(batch_size)
+    return ndjson_export(request, cur, shape, normalize_bet, model or BetOut)
 
 @router.get("/{id}", response_model=BetOut)
-async def get_bet(request: Request, id: str):
+async def get_bet(request: Request, response: Response, id: str, fields: Optional[str] = None):
     c = bets_col(request)
-    doc = await c.find_one({"_id": to_oid(id)})
+    cache = bets_cache(request)
+    shape, model, projection = fieldset(bet_shape, BetOut, fields)
+    bid = to_oid(id)
+    cached = cache.get(bid)
+    unchanged = await not_modified(request, c, bid, cached, fields)
+    if unchanged is not None:
+        return unchanged
+    if cached is not None:
+        response.headers["ETag"] = etag(bid, version_of(cached), fields)
+        return respond(cached, shape, normalize_bet, response, model=model)
+    if projection is not None:
+        # read only the requested fields; a partial doc can't go in the cache
+        doc = await c.find_one({"_id": bid}, {**projection, VERSION_FIELD: 1})
+        if not doc:
+            raise HTTPException(404, "Not found")
+        response.headers["ETag"] = etag(bid, version_of(doc), fields)
+        return respond(doc, shape, normalize_bet, response, model=model)
+    gen = cache.generation()
+    doc = await bets_loader(request).load(bid)
     if not doc:
         raise HTTPException(404, "Not found")
-    return normalize_bet(doc)
+    out = normalize_bet(doc)
+    cache.put(bid, out, gen)
+    response.headers["ETag"] = etag(bid, version_of(out), fields)
+    return respond(out, bet_shape, normalize_bet, response)
 
 @router.patch("/{id}", response_model=BetOut)
 async def patch_bet(request: Request, id: str, patch: BetUpdate):
@@ -89,24 +227,52 @@ async def patch_bet(request: Request, id: str, patch: BetUpdate):
     if "user_progress" in data and data["user_progress"] is not None:
         data["user_progress"] = to_oid_progress_list(data["user_progress"])
 
+    bid = to_oid(id)
     doc = await c.find_one_and_update(
-        {"_id": to_oid(id)},
-        {"$set": data} if data else {},
+        {"_id": bid},
+        bumped({"$set": data}) if data else {},
         return_document=ReturnDocument.AFTER,
     )
+    bets_cache(request).invalidate(bid)
     if not doc:
         raise HTTPException(404, "Not found")
+    if not group_stats.is_open(doc):
+        # patched to finished or cancelled, or a closed bet that keeps no entry
+        await group_stats.apply(stats_col(request), [group_stats.unset_bet_op(doc["group_id"], bid)])
+    elif data.get("user_progress") is not None:
+        await group_stats.apply(stats_col(request), [
+            group_stats.set_bet_op(doc["group_id"], bid, data["user_progress"])
+        ])
+    if data.get("user_progress") is not None:
+        progress_history(request).add_entries(bid, data["user_progress"])
+    reschedule(request, doc)
     return normalize_bet(doc)
 
 @router.delete("/{id}", status_code=204)
 async def delete_bet(request: Request, id: str):
     c = bets_col(request)
-    res = await c.delete_one({"_id": to_oid(id)})
-    if res.deleted_count == 0:
+    bid = to_oid(id)
+    doc = await c.find_one_and_delete({"_id": bid}, projection={"group_id": 1})
+    bets_cache(request).invalidate(bid)
+    reschedule(request, bid=bid)
+    if not doc:
         raise HTTPException(404, "Not found")
+    await group_stats.apply(stats_col(request), [group_stats.unset_bet_op(doc["group_id"], bid)])
     return
 
 # lifecycle
+# the group side of a transition, shared with the deadline scheduler
+
+def activation_group_ops(gid: ObjectId, bid: ObjectId) -> list[UpdateOne]:
+    return [UpdateOne({"_id": gid}, bumped({"$set": {"current_bet_id": bid}}))]
+
+def finish_group_ops(gid: ObjectId, bid: ObjectId) -> list[UpdateOne]:
+    return [
+        # capped to the recent window; the rest of the history is read from bets
+        push_past_bet_op(gid, bid),
+        # only unset current if it matches this bet
+        UpdateOne({"_id": gid, "current_bet_id": bid}, bumped({"$unset": {"current_bet_id": ""}})),
+    ]
 
 @router.post("/{bet_id}/activate", response_model=BetOut)
 async def activate_bet(request: Request, bet_id: str):
@@ -116,14 +282,17 @@ async def activate_bet(request: Request, bet_id: str):
 
     bet = await bc.find_one_and_update(
         {"_id": bid},
-        {"$set": {"status": "active"}},
+        bumped({"$set": {"status": "active"}}),
         return_document=ReturnDocument.AFTER,
     )
     if not bet:
         raise HTTPException(404, "Bet not found")
 
     gid = bet["group_id"]
-    await gc.update_one({"_id": gid}, {"$set": {"current_bet_id": bid}})
+    await gc.bulk_write(activation_group_ops(gid, bid))
+    bets_cache(request).invalidate(bid)
+    groups_cache(request).invalidate(gid)
+    reschedule(request, bet)
     return normalize_bet(bet)
 
 @router.post("/{bet_id}/finish", response_model=BetOut)
@@ -134,42 +303,194 @@ async def finish_bet(request: Request, bet_id: str):
 
     bet = await bc.find_one_and_update(
         {"_id": bid},
-        {"$set": {"status": "finished"}},
+        bumped({"$set": {"status": "finished"}}),
         return_document=ReturnDocument.AFTER,
     )
     if not bet:
         raise HTTPException(404, "Bet not found")
 
     gid = bet["group_id"]
-    # only unset current if it matches this bet
-    await gc.update_one(
-        {"_id": gid},
-        {"$addToSet": {"past_bet_ids": bid}}
-    )
-    await gc.update_one(
-        {"_id": gid, "current_bet_id": bid},
-        {"$unset": {"current_bet_id": ""}}
-    )
+    await gc.bulk_write(finish_group_ops(gid, bid))
+    await group_stats.apply(stats_col(request), [group_stats.unset_bet_op(gid, bid)])
+    bets_cache(request).invalidate(bid)
+    groups_cache(request).invalidate(gid)
+    reschedule(request, bet)
     return normalize_bet(bet)
 
 @router.post("/{bet_id}/progress/{user_id}", response_model=BetOut)
-async def set_user_progress(request: Request, bet_id: str, user_id: str, progress: float):
+async def set_user_progress(
+    request: Request, bet_id: str, user_id: str, progress: float, buffered: bool = False
+):
     bc = bets_col(request)
     bid = to_oid(bet_id)
     uid = to_oid(user_id)
+
+    # opt-in write-behind: queue the latest value and let the buffer flush it
+    buf = request.app.state.progress_buffer
+    if buffered and buf is not None:
+        if not buf.add(bid, uid, progress):
+            raise HTTPException(503, "Progress buffer full")
+        return JSONResponse({"queued": True}, status_code=202)
+
     now = datetime.now(UTC)
 
-    # try update existing progress entry
-    res = await bc.update_one(
+    # try update existing progress entry; the entry as it was feeds the group stats
+    before = await bc.find_one_and_update(
         {"_id": bid, "user_progress.user_id": uid},
-        {"$set": {"user_progress.$.progress": progress, "user_progress.$.last_updated": now}},
+        bumped({"$set": {"user_progress.$.progress": progress, "user_progress.$.last_updated": now}}),
+        projection={"group_id": 1, "status": 1, "user_progress": {"$elemMatch": {"user_id": uid}}},
     )
-    if res.matched_count == 0:
+    old = None
+    if before is None:
         # insert new entry, build dict directly with ObjectId
         entry = {"user_id": uid, "progress": progress, "last_updated": now}
-        await bc.update_one({"_id": bid}, {"$addToSet": {"user_progress": entry}})
+        before = await bc.find_one_and_update(
+            {"_id": bid}, bumped({"$addToSet": {"user_progress": entry}}), projection={"group_id": 1, "status": 1}
+        )
+    else:
+        old = before["user_progress"][0].get("progress", 0.0)
+    bets_cache(request).invalidate(bid)
+    if before is not None:
+        if group_stats.is_open(before):
+            await group_stats.apply(stats_col(request), [
+                group_stats.progress_op(before["group_id"], group_stats.progress_inc(bid, old, progress))
+            ])
+        progress_history(request).add(bid, uid, progress, now)
 
     doc = await bc.find_one({"_id": bid})
     if not doc:
         raise HTTPException(404, "Bet not found after update")
     return normalize_bet(doc)
+
+# progress over time for charts, bucketed server-side from the progress_history
+# time-series collection: per participant (or just user_id), the last value in each
+# unit * bin_size bucket between since and until
+@router.get("/{bet_id}/progress/history", response_model=ProgressHistory)
+async def get_progress_history(
+    request: Request,
+    bet_id: str,
+    user_id: Optional[str] = None,
+    unit: HistoryUnit = HistoryUnit.hour,
+    bin_size: int = Query(1, ge=1, le=1000),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    history = progress_history(request)
+    if not history.available:
+        raise HTTPException(503, "Progress history is not available")
+    bid = to_oid(bet_id)
+    uid = to_oid(user_id) if user_id else None
+    until = until or datetime.now(UTC)
+    since = since or until - HISTORY_WINDOW
+    # query datetimes without an offset are taken as UTC
+    since, until = (d if d.tzinfo else d.replace(tzinfo=UTC) for d in (since, until))
+    if since >= until:
+        raise HTTPException(400, "since must be before until")
+    if (until - since).total_seconds() / (UNIT_SECONDS[unit.value] * bin_size) > MAX_BUCKETS:
+        raise HTTPException(400, f"More than {MAX_BUCKETS} buckets, use a larger unit or bin_size")
+    pipeline = history_pipeline(bid, uid, since, until, unit.value, bin_size)
+    rows = await history.col.aggregate(pipeline).to_list(None)
+    if not rows and not await bets_col(request).find_one({"_id": bid}, {"_id": 1}):
+        raise HTTPException(404, "Bet not found")
+    return shape_history(bid, unit.value, bin_size, rows)
+
+# live progress over server-sent events, fed by the change stream in changefeed.py
+@router.get("/{bet_id}/progress/stream")
+async def stream_progress(request: Request, bet_id: str):
+    feed = request.app.state.changefeed
+    if feed is None or not feed.available:
+        raise HTTPException(503, "Live progress is not available")
+    broker = request.app.state.progress_broker
+    bid = to_oid(bet_id)
+    # subscribe before reading the snapshot so no change slips in between
+    sub = broker.subscribe(bid)
+    doc = await bets_col(request).find_one({"_id": bid}, {"status": 1, "user_progress": 1})
+    if not doc:
+        broker.unsubscribe(sub)
+        raise HTTPException(404, "Bet not found")
+
+    async def events():
+        try:
+            yield f"event: progress\ndata: {json.dumps(progress_event(bid, doc))}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), timeout=SSE_KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: progress\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broker.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
+
+# batch ingestion: one read plus one unordered bulk_write, however big the batch.
+# each entry gets the same upsert-into-array treatment as set_user_progress; when a
+# (bet, user) pair appears more than once the last entry wins and the earlier ones
+# are reported as superseded
+async def apply_progress_batch(bc, entries: list[tuple[str, BetProgress]], cache=None, stats=None,
+                               history=None) -> list[dict]:
+    results = [
+        {"bet_id": bet_id, "user_id": p.user_id, "status": ProgressResultStatus.invalid}
+        for bet_id, p in entries
+    ]
+    latest: dict[tuple[ObjectId, ObjectId], int] = {}
+    for i, (bet_id, p) in enumerate(entries):
+        if not (ObjectId.is_valid(bet_id) and ObjectId.is_valid(p.user_id)):
+            continue
+        key = (ObjectId(bet_id), ObjectId(p.user_id))
+        if key in latest:
+            results[latest[key]]["status"] = ProgressResultStatus.superseded
+        latest[key] = i
+    if not latest:
+        return results
+
+    # one read to learn which bets exist and who already has an entry (with what
+    # progress, for the group stats)
+    before = await group_stats.progress_before(bc, {bid for bid, _ in latest})
+
+    ops = []
+    applied = []
+    for (bid, uid), i in latest.items():
+        if bid not in before:
+            results[i]["status"] = ProgressResultStatus.not_found
+            continue
+        results[i]["status"] = (
+            ProgressResultStatus.updated if uid in before[bid]["progress"] else ProgressResultStatus.inserted
+        )
+        p = entries[i][1]
+        ops.extend(progress_write_ops(bid, uid, p.progress, p.last_updated))
+        applied.append((bid, uid, p))
+    if ops:
+        await bc.bulk_write(ops, ordered=False)
+        if cache is not None:
+            cache.invalidate(*before)
+        if stats is not None:
+            await group_stats.apply(stats, group_stats.batch_progress_ops(
+                before, [(bid, uid, p.progress) for bid, uid, p in applied]
+            ))
+        if history is not None:
+            for bid, uid, p in applied:
+                history.add(bid, uid, p.progress, p.last_updated)
+    return results
+
+@router.post("/progress:batch", response_model=List[BetProgressResult])
+async def set_progress_batch(request: Request, entries: List[BetProgressBatchItem]):
+    if len(entries) > MAX_PROGRESS_BATCH:
+        raise HTTPException(413, f"At most {MAX_PROGRESS_BATCH} entries per batch")
+    return await apply_progress_batch(
+        bets_col(request), [(e.bet_id, e) for e in entries], bets_cache(request), stats_col(request),
+        progress_history(request),
+    )
+
+@router.post("/{bet_id}/progress:batch", response_model=List[BetProgressResult])
+async def set_bet_progress_batch(request: Request, bet_id: str, entries: List[BetProgress]):
+    if len(entries) > MAX_PROGRESS_BATCH:
+        raise HTTPException(413, f"At most {MAX_PROGRESS_BATCH} entries per batch")
+    to_oid(bet_id)
+    return await apply_progress_batch(
+        bets_col(request), [(bet_id, e) for e in entries], bets_cache(request), stats_col(request),
+        progress_history(request),
+    )
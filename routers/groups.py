@@ -1,20 +1,52 @@
 # routers/groups.py
 from typing import List, Optional
 
-from fastapi import APIRouter, Request, HTTPException, Query
+from fastapi import APIRouter, Request, Response, HTTPException, Query
 from pymongo import ReturnDocument
 from bson import ObjectId
 
-from models import GroupCreate, GroupUpdate, GroupOut
-from utils import to_oid  # your existing helper
+import group_stats
+from db import DB_NAME
+from models import GroupCreate, GroupUpdate, GroupOut, GroupOverview, GroupStats, BetOut
+from export import ndjson_export, EXPORT_BATCH_SIZE, MAX_EXPORT_BATCH_SIZE
+from importer import import_rows, import_format, IMPORT_BATCH_SIZE
+from routers.bets import normalize_bet
+from search import prefix_search, folded, SEARCH_LIMIT, MAX_SEARCH_LIMIT, MAX_QUERY_LENGTH
+from serialize import respond, fieldset, group_shape, bet_shape
+from utils import to_oid, encode_cursor, decode_cursor  # your existing helpers
+from versions import VERSION_FIELD, bumped, etag, version_of, not_modified
 
 router = APIRouter()
 
+# at most past_bets.RECENT_PAST_BETS
+OVERVIEW_PAST_BETS = 10
+
 def groups_col(req: Request):
-    return req.app.state.mongo["hackathon"]["groups"]
+    return req.app.state.mongo[DB_NAME]["groups"]
 
 def users_col(req: Request):
-    return req.app.state.mongo["hackathon"]["users"]
+    return req.app.state.mongo[DB_NAME]["users"]
+
+def bets_col(req: Request):
+    return req.app.state.mongo[DB_NAME]["bets"]
+
+def stats_col(req: Request):
+    return req.app.state.mongo[DB_NAME]["group_stats"]
+
+# summaries for groups created or patched with a whole member list
+async def rebuild_stats(req: Request, gids: list[ObjectId]):
+    if group_stats.GROUP_STATS_ENABLED:
+        for gid in gids:
+            await group_stats.rebuild(req.app.state.mongo[DB_NAME], gid)
+
+def groups_cache(req: Request):
+    return req.app.state.caches["groups"]
+
+def groups_loader(req: Request):
+    return req.app.state.loaders["groups"]
+
+def users_cache(req: Request):
+    return req.app.state.caches["users"]
 
 # helpers for this router
 def to_oid_list(ids: list[str] | None) -> list[ObjectId]:
@@ -36,39 +68,229 @@ def normalize_group(doc: dict) -> dict:
         d["current_bet_id"] = oid_str(d["current_bet_id"])
     return d
 
-@router.post("", response_model=GroupOut, status_code=201)
-async def create_group(request: Request, payload: GroupCreate):
-    c = groups_col(request)
+def group_to_storage(payload: GroupCreate) -> dict:
     doc = payload.model_dump()
     # convert incoming string ids to ObjectId for storage
     doc["user_ids"] = to_oid_list(doc.get("user_ids"))
     doc["past_bet_ids"] = to_oid_list(doc.get("past_bet_ids"))
     if doc.get("current_bet_id") is not None:
         doc["current_bet_id"] = to_oid(doc["current_bet_id"])
+    doc.update(folded("name", doc["name"]))
+    doc[VERSION_FIELD] = 1
+    return doc
+
+@router.post("", response_model=GroupOut, status_code=201)
+async def create_group(request: Request, payload: GroupCreate):
+    c = groups_col(request)
+    doc = group_to_storage(payload)
     res = await c.insert_one(doc)
+    if doc["user_ids"]:
+        await rebuild_stats(request, [res.inserted_id])
     saved = await c.find_one({"_id": res.inserted_id})
     return normalize_group(saved)
 
+@router.post("/import")
+async def import_groups(request: Request, batch_size: int = Query(IMPORT_BATCH_SIZE, ge=1, le=10_000)):
+    return await import_rows(
+        groups_col(request),
+        request.stream(),
+        import_format(request.headers.get("content-type")),
+        GroupCreate,
+        group_to_storage,
+        batch_size=batch_size,
+        on_inserted=lambda docs: rebuild_stats(request, [d["_id"] for d in docs if d["user_ids"]]),
+    )
+
 @router.get("", response_model=List[GroupOut])
 async def list_groups(
     request: Request,
+    response: Response,
     limit: int = Query(50, ge=1, le=200),
     skip: int = 0,
+    after: Optional[str] = None,
     name: Optional[str] = None,
+    fields: Optional[str] = None,
 ):
     c = groups_col(request)
+    shape, model, projection = fieldset(group_shape, GroupOut, fields)
     filt = {"name": name} if name else {}
-    cur = c.find(filt).sort("_id", 1).skip(skip).limit(limit)
-    docs = [normalize_group(d) async for d in cur]
-    return docs
+    cursor_filters = {"name": name}
+    if after:
+        filt["_id"] = {"$gt": decode_cursor(after, cursor_filters)}
+    cur = c.find(filt, projection).sort("_id", 1).skip(skip).limit(limit)
+    docs = [d async for d in cur]
+    if len(docs) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(docs[-1]["_id"], cursor_filters)
+    return respond(docs, shape, normalize_group, response, model=model)
+
+@router.get("/export")
+async def export_groups(
+    request: Request,
+    batch_size: int = Query(EXPORT_BATCH_SIZE, ge=1, le=MAX_EXPORT_BATCH_SIZE),
+    after: Optional[str] = None,
+    name: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    c = groups_col(request)
+    shape, model, projection = fieldset(group_shape, GroupOut, fields)
+    filt = {"name": name} if name else {}
+    if after:
+        filt["_id"] = {"$gt": to_oid(after)}
+    cur = c.find(filt, projection).sort("_id", 1).batch_size(batch_size)
+    return ndjson_export(request, cur, shape, normalize_group, model or GroupOut)
+
+# type-ahead: case-insensitive group name prefix, a range on the name_lc index
+@router.get("/search", response_model=List[GroupOut])
+async def search_groups(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=MAX_QUERY_LENGTH),
+    limit: int = Query(SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+    fields: Optional[str] = None,
+):
+    shape, model, projection = fieldset(group_shape, GroupOut, fields)
+    projection = projection or {f: 1 for f in group_shape.getters if f != "_id"}
+    docs = await prefix_search(groups_col(request), "name", q, projection, limit)
+    return respond(docs, shape, normalize_group, response, model=model)
 
 @router.get("/{id}", response_model=GroupOut)
-async def get_group(request: Request, id: str):
+async def get_group(request: Request, response: Response, id: str, fields: Optional[str] = None):
     c = groups_col(request)
-    doc = await c.find_one({"_id": to_oid(id)})
+    cache = groups_cache(request)
+    shape, model, projection = fieldset(group_shape, GroupOut, fields)
+    gid = to_oid(id)
+    cached = cache.get(gid)
+    unchanged = await not_modified(request, c, gid, cached, fields)
+    if unchanged is not None:
+        return unchanged
+    if cached is not None:
+        response.headers["ETag"] = etag(gid, version_of(cached), fields)
+        return respond(cached, shape, normalize_group, response, model=model)
+    if projection is not None:
+        # read only the requested fields; a partial doc can't go in the cache
+        doc = await c.find_one({"_id": gid}, {**projection, VERSION_FIELD: 1})
+        if not doc:
+            raise HTTPException(404, "Not found")
+        response.headers["ETag"] = etag(gid, version_of(doc), fields)
+        return respond(doc, shape, normalize_group, response, model=model)
+    gen = cache.generation()
+    doc = await groups_loader(request).load(gid)
     if not doc:
         raise HTTPException(404, "Not found")
-    return normalize_group(doc)
+    out = normalize_group(doc)
+    cache.put(gid, out, gen)
+    response.headers["ETag"] = etag(gid, version_of(out), fields)
+    return respond(out, group_shape, normalize_group, response)
+
+# everything a group screen needs in one aggregation: members, the current bet with
+# usernames on its progress entries, and summaries of the most recent past bets.
+# every $lookup joins on _id. the localField + pipeline form needs MongoDB 5.0+
+def overview_pipeline(gid: ObjectId) -> list[dict]:
+    return [
+        {"$match": {"_id": gid}},
+        {"$lookup": {
+            "from": "users",
+            "localField": "user_ids",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"username": 1, "profile_url": 1, "average_spending": 1}}],
+            "as": "members",
+        }},
+        {"$lookup": {
+            "from": "bets",
+            "localField": "current_bet_id",
+            "foreignField": "_id",
+            "pipeline": [{"$lookup": {
+                "from": "users",
+                "localField": "user_progress.user_id",
+                "foreignField": "_id",
+                "pipeline": [{"$project": {"username": 1}}],
+                "as": "participants",
+            }}],
+            "as": "current_bet",
+        }},
+        {"$addFields": {"recent_past_bet_ids": {"$slice": [{"$ifNull": ["$past_bet_ids", []]}, -OVERVIEW_PAST_BETS]}}},
+        {"$lookup": {
+            "from": "bets",
+            "localField": "recent_past_bet_ids",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"title": 1, "status": 1, "start_date": 1, "end_date": 1}}],
+            "as": "past_bets",
+        }},
+    ]
+
+def shape_overview(doc: dict) -> dict:
+    members = [{**m, "_id": oid_str(m["_id"])} for m in doc.pop("members", [])]
+    current = None
+    if doc.get("current_bet"):
+        bet = doc["current_bet"][0]
+        names = {p["_id"]: p.get("username") for p in bet.pop("participants", [])}
+        current = {
+            **bet,
+            "_id": oid_str(bet["_id"]),
+            "group_id": oid_str(bet["group_id"]),
+            "user_progress": [
+                {**p, "user_id": oid_str(p.get("user_id")), "username": names.get(p.get("user_id"))}
+                for p in bet.get("user_progress") or []
+            ],
+        }
+    # most recent first, in past_bet_ids order; $lookup doesn't preserve it
+    by_id = {b["_id"]: b for b in doc.pop("past_bets", [])}
+    past = [
+        {**by_id[bid], "_id": oid_str(bid)}
+        for bid in reversed(doc.pop("recent_past_bet_ids", []))
+        if bid in by_id
+    ]
+    doc.pop("current_bet", None)
+    return {"group": normalize_group(doc), "members": members, "current_bet": current, "past_bets": past}
+
+@router.get("/{id}/overview", response_model=GroupOverview)
+async def group_overview(request: Request, id: str):
+    c = groups_col(request)
+    docs = await c.aggregate(overview_pipeline(to_oid(id))).to_list(1)
+    if not docs:
+        raise HTTPException(404, "Not found")
+    return shape_overview(docs[0])
+
+# served from the group_stats summary; the size of the read doesn't grow with the group
+@router.get("/{id}/stats", response_model=GroupStats)
+async def get_group_stats(request: Request, id: str):
+    gid = to_oid(id)
+    group = await groups_col(request).find_one({"_id": gid}, {"current_bet_id": 1})
+    if not group:
+        raise HTTPException(404, "Not found")
+    bid = group.get("current_bet_id")
+    projection = {"member_count": 1, "spending_sum": 1, "spending_hist": 1, "updated_at": 1}
+    if bid is not None:
+        projection[f"completion.{bid}"] = 1
+    doc = await stats_col(request).find_one({"_id": gid}, projection)
+    return group_stats.shape_stats(gid, doc, bid)
+
+# the group's finished bets, newest first, read from bets on the
+# (group_id, status, _id) index; the group document only keeps the most recent
+# past_bets.RECENT_PAST_BETS of them
+@router.get("/{id}/bets/history", response_model=List[BetOut])
+async def group_bet_history(
+    request: Request,
+    response: Response,
+    id: str,
+    limit: int = Query(50, ge=1, le=200),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    gid = to_oid(id)
+    shape, model, projection = fieldset(bet_shape, BetOut, fields)
+    filt = {"group_id": gid, "status": "finished"}
+    cursor_filters = {"history": id}
+    if after:
+        filt["_id"] = {"$lt": decode_cursor(after, cursor_filters)}
+    cur = bets_col(request).find(filt, projection).sort("_id", -1).limit(limit)
+    docs = [d async for d in cur]
+    # an empty page is the only case where a missing group needs telling apart
+    if not docs and not after and not await groups_col(request).find_one({"_id": gid}, {"_id": 1}):
+        raise HTTPException(404, "Not found")
+    if len(docs) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(docs[-1]["_id"], cursor_filters)
+    return respond(docs, shape, normalize_bet, response, model=model)
 
 @router.patch("/{id}", response_model=GroupOut)
 async def patch_group(request: Request, id: str, patch: GroupUpdate):
@@ -83,33 +305,54 @@ async def patch_group(request: Request, id: str, patch: GroupUpdate):
         data["current_bet_id"] = (
             None if data["current_bet_id"] is None else to_oid(data["current_bet_id"])
         )
+    if "name" in data:
+        data.update(folded("name", data["name"]))
+    gid = to_oid(id)
     doc = await c.find_one_and_update(
-        {"_id": to_oid(id)},
-        {"$set": data} if data else {},
+        {"_id": gid},
+        bumped({"$set": data}) if data else {},
         return_document=ReturnDocument.AFTER,
     )
+    groups_cache(request).invalidate(gid)
     if not doc:
         raise HTTPException(404, "Not found")
+    if "user_ids" in data:
+        await rebuild_stats(request, [gid])
     return normalize_group(doc)
 
 @router.delete("/{id}", status_code=204)
 async def delete_group(request: Request, id: str):
     c = groups_col(request)
-    res = await c.delete_one({"_id": to_oid(id)})
+    gid = to_oid(id)
+    res = await c.delete_one({"_id": gid})
+    groups_cache(request).invalidate(gid)
+    await stats_col(request).delete_one({"_id": gid})
     if res.deleted_count == 0:
         raise HTTPException(404, "Not found")
     return
 
 # membership
 
+# read only when the group side changed; a guarded user update that matched nothing
+# can't tell a missing user from one already (or no longer) in the group
+async def member_spending(uc, uid: ObjectId) -> dict | None:
+    return await uc.find_one({"_id": uid}, {"average_spending": 1})
+
 @router.post("/{group_id}/join/{user_id}", response_model=GroupOut)
 async def join_group(request: Request, group_id: str, user_id: str):
     gc = groups_col(request)
     uc = users_col(request)
     gid = to_oid(group_id)
     uid = to_oid(user_id)
-    await gc.update_one({"_id": gid}, {"$addToSet": {"user_ids": uid}})
-    await uc.update_one({"_id": uid}, {"$addToSet": {"group_ids": gid}})
+    # the filters skip no-op updates on both sides, which would only bump the versions
+    res = await gc.update_one({"_id": gid, "user_ids": {"$ne": uid}}, bumped({"$addToSet": {"user_ids": uid}}))
+    await uc.update_one({"_id": uid, "group_ids": {"$ne": gid}}, bumped({"$addToSet": {"group_ids": gid}}))
+    # only count a member the first time they're added, and only a user that exists
+    user = await member_spending(uc, uid) if res.modified_count else None
+    if user is not None:
+        await group_stats.apply(stats_col(request), [group_stats.member_op(gid, user.get("average_spending", 0.0), 1)])
+    groups_cache(request).invalidate(gid)
+    users_cache(request).invalidate(uid)
     doc = await gc.find_one({"_id": gid})
     if not doc:
         raise HTTPException(404, "Group not found")
@@ -121,8 +364,13 @@ async def leave_group(request: Request, group_id: str, user_id: str):
     uc = users_col(request)
     gid = to_oid(group_id)
     uid = to_oid(user_id)
-    await gc.update_one({"_id": gid}, {"$pull": {"user_ids": uid}})
-    await uc.update_one({"_id": uid}, {"$pull": {"group_ids": gid}})
+    res = await gc.update_one({"_id": gid, "user_ids": uid}, bumped({"$pull": {"user_ids": uid}}))
+    await uc.update_one({"_id": uid, "group_ids": gid}, bumped({"$pull": {"group_ids": gid}}))
+    user = await member_spending(uc, uid) if res.modified_count else None
+    if user is not None:
+        await group_stats.apply(stats_col(request), [group_stats.member_op(gid, user.get("average_spending", 0.0), -1)])
+    groups_cache(request).invalidate(gid)
+    users_cache(request).invalidate(uid)
     doc = await gc.find_one({"_id": gid})
     if not doc:
         raise HTTPException(404, "Group not found")
@@ -1,19 +1,51 @@
 # routers/users.py
 from typing import List, Optional
 
-from fastapi import APIRouter, Request, HTTPException, Query
+from fastapi import APIRouter, Request, Response, HTTPException, Query
 from pymongo import ReturnDocument
 from bson import ObjectId
 
-from models import UserCreate, UserUpdate, UserOut
-from utils import to_oid, hash_password  # keep your existing helpers
+import group_stats
+from db import DB_NAME
+from models import UserCreate, UserUpdate, UserOut, UserLogin, BetOut, BetStatus
+from export import ndjson_export, EXPORT_BATCH_SIZE, MAX_EXPORT_BATCH_SIZE
+from importer import import_rows, import_format, IMPORT_BATCH_SIZE
+from routers.bets import normalize_bet
+from search import prefix_search, folded, SEARCH_LIMIT, MAX_SEARCH_LIMIT, MAX_QUERY_LENGTH
+from serialize import respond, fieldset, user_shape, bet_shape
+from utils import to_oid, encode_cursor, decode_cursor  # keep your existing helpers
+from versions import VERSION_FIELD, bumped, etag, version_of, not_modified
 
 router = APIRouter()
 
 def users_col(req: Request):
-    return req.app.state.mongo["hackathon"]["users"]
+    return req.app.state.mongo[DB_NAME]["users"]
+
+def bets_col(req: Request):
+    return req.app.state.mongo[DB_NAME]["bets"]
+
+def groups_col(req: Request):
+    return req.app.state.mongo[DB_NAME]["groups"]
+
+def stats_col(req: Request):
+    return req.app.state.mongo[DB_NAME]["group_stats"]
+
+def users_cache(req: Request):
+    return req.app.state.caches["users"]
+
+def users_loader(req: Request):
+    return req.app.state.loaders["users"]
+
+def password_pool(req: Request):
+    return req.app.state.password_pool
 
 # helpers for this router
+async def member_of(request: Request, uid: ObjectId) -> list[ObjectId]:
+    # the groups that count this user in their stats: membership lives in
+    # groups.user_ids (join/leave, group_stats.compute), not in users.group_ids,
+    # which create and patch can set without joining
+    return [g["_id"] async for g in groups_col(request).find({"user_ids": uid}, {"_id": 1})]
+
 def to_oid_list(ids: list[str] | None) -> list[ObjectId]:
     if not ids:
         return []
@@ -29,63 +61,217 @@ def normalize_user(doc: dict) -> dict:
     d.pop("password_hash", None)
     return d
 
+# storage shape without the password; callers hash it through the password pool
+def user_to_storage(payload: UserCreate) -> dict:
+    doc = payload.model_dump(exclude={"password"})
+    # store group ids as ObjectId in Mongo
+    doc["group_ids"] = to_oid_list(doc.get("group_ids"))
+    doc.update(folded("username", doc["username"]))
+    doc[VERSION_FIELD] = 1
+    return doc
+
 @router.post("/", response_model=UserOut, status_code=201)
 async def create_user(request: Request, payload: UserCreate):
     c = users_col(request)
     if await c.find_one({"email": payload.email}):
         raise HTTPException(409, "Email already exists")
-    doc = payload.model_dump()
-    # store group ids as ObjectId in Mongo
-    doc["group_ids"] = to_oid_list(doc.get("group_ids"))
-    pw = doc.pop("password")
-    doc["password_hash"] = hash_password(pw)
+    doc = user_to_storage(payload)
+    doc["password_hash"] = await password_pool(request).hash(payload.password)
     res = await c.insert_one(doc)
     saved = await c.find_one({"_id": res.inserted_id}, {"password_hash": 0})
     return normalize_user(saved)
 
+@router.post("/import")
+async def import_users(request: Request, batch_size: int = Query(IMPORT_BATCH_SIZE, ge=1, le=10_000)):
+    return await import_rows(
+        users_col(request),
+        request.stream(),
+        import_format(request.headers.get("content-type")),
+        UserCreate,
+        user_to_storage,
+        password_pool=password_pool(request),
+        batch_size=batch_size,
+    )
+
+@router.post("/login", response_model=UserOut)
+async def login(request: Request, creds: UserLogin):
+    c = users_col(request)
+    pool = password_pool(request)
+    doc = await c.find_one({"email": creds.email})
+    if not doc or not doc.get("password_hash"):
+        await pool.verify_missing(creds.password)
+        raise HTTPException(401, "Invalid email or password")
+    ok, needs_rehash = await pool.verify(creds.password, doc["password_hash"])
+    if not ok:
+        raise HTTPException(401, "Invalid email or password")
+    if needs_rehash:
+        # upgrade legacy sha256 (or outdated scrypt) hashes now that we have the password;
+        # matching on the old hash keeps a concurrent password change from being overwritten
+        new_hash = await pool.hash(creds.password)
+        await c.update_one(
+            {"_id": doc["_id"], "password_hash": doc["password_hash"]},
+            bumped({"$set": {"password_hash": new_hash}}),
+        )
+    return normalize_user(doc)
+
 @router.get("/", response_model=List[UserOut])
 async def list_users(
     request: Request,
+    response: Response,
     limit: int = Query(50, ge=1, le=200),
     skip: int = Query(0, ge=0),
+    after: Optional[str] = None,
     email: Optional[str] = None,
+    fields: Optional[str] = None,
 ):
     c = users_col(request)
+    # an inclusion projection leaves password_hash out on its own
+    shape, model, projection = fieldset(user_shape, UserOut, fields)
+    projection = projection or {"password_hash": 0}
     filt = {"email": email} if email else {}
-    cur = c.find(filt, {"password_hash": 0}).sort("_id", 1).skip(skip).limit(limit)
-    docs = [normalize_user(d) async for d in cur]
-    return docs
+    cursor_filters = {"email": email}
+    if after:
+        filt["_id"] = {"$gt": decode_cursor(after, cursor_filters)}
+    cur = c.find(filt, projection).sort("_id", 1).skip(skip).limit(limit)
+    docs = [d async for d in cur]
+    if len(docs) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(docs[-1]["_id"], cursor_filters)
+    return respond(docs, shape, normalize_user, response, model=model)
+
+@router.get("/export")
+async def export_users(
+    request: Request,
+    batch_size: int = Query(EXPORT_BATCH_SIZE, ge=1, le=MAX_EXPORT_BATCH_SIZE),
+    after: Optional[str] = None,
+    email: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    c = users_col(request)
+    # an inclusion projection leaves password_hash out on its own
+    shape, model, projection = fieldset(user_shape, UserOut, fields)
+    projection = projection or {"password_hash": 0}
+    filt = {"email": email} if email else {}
+    if after:
+        filt["_id"] = {"$gt": to_oid(after)}
+    cur = c.find(filt, projection).sort("_id", 1).batch_size(batch_size)
+    return ndjson_export(request, cur, shape, normalize_user, model or UserOut)
+
+# type-ahead: case-insensitive username prefix, a range on the username_lc index
+@router.get("/search", response_model=List[UserOut])
+async def search_users(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=MAX_QUERY_LENGTH),
+    limit: int = Query(SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+    fields: Optional[str] = None,
+):
+    shape, model, projection = fieldset(user_shape, UserOut, fields)
+    # an inclusion projection, so password_hash stays out
+    projection = projection or {f: 1 for f in user_shape.getters if f != "_id"}
+    docs = await prefix_search(users_col(request), "username", q, projection, limit)
+    return respond(docs, shape, normalize_user, response, model=model)
 
 @router.get("/{id}", response_model=UserOut)
-async def get_user(request: Request, id: str):
+async def get_user(request: Request, response: Response, id: str, fields: Optional[str] = None):
     c = users_col(request)
-    doc = await c.find_one({"_id": to_oid(id)}, {"password_hash": 0})
+    cache = users_cache(request)
+    shape, model, projection = fieldset(user_shape, UserOut, fields)
+    uid = to_oid(id)
+    cached = cache.get(uid)
+    unchanged = await not_modified(request, c, uid, cached, fields)
+    if unchanged is not None:
+        return unchanged
+    if cached is not None:
+        response.headers["ETag"] = etag(uid, version_of(cached), fields)
+        return respond(cached, shape, normalize_user, response, model=model)
+    if projection is not None:
+        # read only the requested fields; a partial doc can't go in the cache
+        doc = await c.find_one({"_id": uid}, {**projection, VERSION_FIELD: 1})
+        if not doc:
+            raise HTTPException(404, "Not found")
+        response.headers["ETag"] = etag(uid, version_of(doc), fields)
+        return respond(doc, shape, normalize_user, response, model=model)
+    gen = cache.generation()
+    doc = await users_loader(request).load(uid)
     if not doc:
         raise HTTPException(404, "Not found")
-    return normalize_user(doc)
+    out = normalize_user(doc)
+    cache.put(uid, out, gen)
+    response.headers["ETag"] = etag(uid, version_of(out), fields)
+    return respond(out, user_shape, normalize_user, response)
+
+# the user's bets across all their groups in one query on the
+# (user_progress.user_id, _id) index, which also gives the keyset order. each bet
+# carries only the user's own progress entry
+@router.get("/{id}/bets", response_model=List[BetOut])
+async def list_user_bets(
+    request: Request,
+    response: Response,
+    id: str,
+    limit: int = Query(50, ge=1, le=200),
+    after: Optional[str] = None,
+    status: Optional[BetStatus] = None,
+    fields: Optional[str] = None,
+):
+    uid = to_oid(id)
+    shape, model, projection = fieldset(bet_shape, BetOut, fields)
+    if projection is None:
+        projection = {f: 1 for f in bet_shape.getters if f != "_id"}
+    if "user_progress" in projection:
+        projection["user_progress"] = {"$elemMatch": {"user_id": uid}}
+    filt = {"user_progress.user_id": uid}
+    if status:
+        filt["status"] = status
+    cursor_filters = {"user": id, "status": status.value if status else None}
+    if after:
+        filt["_id"] = {"$gt": decode_cursor(after, cursor_filters)}
+    cur = bets_col(request).find(filt, projection).sort("_id", 1).limit(limit)
+    docs = [d async for d in cur]
+    # an empty page is the only case where a missing user needs telling apart
+    if not docs and not after and not await users_col(request).find_one({"_id": uid}, {"_id": 1}):
+        raise HTTPException(404, "Not found")
+    if len(docs) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(docs[-1]["_id"], cursor_filters)
+    return respond(docs, shape, normalize_bet, response, model=model)
 
 @router.patch("/{id}", response_model=UserOut)
 async def patch_user(request: Request, id: str, patch: UserUpdate):
     c = users_col(request)
     data = patch.model_dump(exclude_unset=True)
     if "password" in data and data["password"] is not None:
-        data["password_hash"] = hash_password(data.pop("password"))
+        data["password_hash"] = await password_pool(request).hash(data.pop("password"))
     if "group_ids" in data and data["group_ids"] is not None:
         data["group_ids"] = to_oid_list(data["group_ids"])
-    doc = await c.find_one_and_update(
-        {"_id": to_oid(id)},
-        {"$set": data} if data else {},
-        return_document=ReturnDocument.AFTER,
+    if "username" in data:
+        data.update(folded("username", data["username"]))
+    uid = to_oid(id)
+    # the previous spending is needed to move this member between stats buckets
+    before = await c.find_one_and_update(
+        {"_id": uid},
+        bumped({"$set": data}) if data else {},
+        return_document=ReturnDocument.BEFORE,
         projection={"password_hash": 0},
     )
-    if not doc:
+    users_cache(request).invalidate(uid)
+    if not before:
         raise HTTPException(404, "Not found")
-    return normalize_user(doc)
+    if data.get("average_spending") is not None and group_stats.GROUP_STATS_ENABLED:
+        await group_stats.apply(stats_col(request), group_stats.spending_ops(
+            await member_of(request, uid), before.get("average_spending", 0.0), data["average_spending"]
+        ))
+    return normalize_user({**before, **data})
 
 @router.delete("/{id}", status_code=204)
 async def delete_user(request: Request, id: str):
     c = users_col(request)
-    res = await c.delete_one({"_id": to_oid(id)})
-    if res.deleted_count == 0:
+    uid = to_oid(id)
+    doc = await c.find_one_and_delete({"_id": uid}, projection={"average_spending": 1})
+    users_cache(request).invalidate(uid)
+    if not doc:
         raise HTTPException(404, "Not found")
+    # groups may still list the id, but the member no longer counts
+    if group_stats.GROUP_STATS_ENABLED:
+        await group_stats.apply(stats_col(request), [
+            group_stats.member_op(gid, doc.get("average_spending", 0.0), -1) for gid in await member_of(request, uid)
+        ])
     return
@@ -0,0 +1,254 @@
+# scheduler.py
+# In-process deadline scheduler for bet lifecycle transitions: planned bets become
+# active at start_date, active bets finish at end_date. Upcoming deadlines sit in a
+# min-heap and the task sleeps until the next one. Only the worker holding the
+# lease document fires transitions; the others keep their heap warm and take over
+# when the lease expires. A bet created or rescheduled through another worker only
+# reaches that worker's heap, so the leader also asks the database for due bets on
+# every tick, and a transition only applies while its deadline has passed.
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import socket
+from datetime import datetime, timedelta, UTC
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+import group_stats
+from routers.bets import activation_group_ops, finish_group_ops
+from versions import bumped, version_of, VERSION_FIELD
+
+SCHEDULER_ENABLED = True
+LOOKAHEAD_S = 3600
+BATCH_SIZE = 500
+LEASE_ID = "bet-lifecycle"
+LEASE_TTL_S = 30
+ERROR_BACKOFF_S = 5
+
+# transition -> (from status, to status, deadline field)
+TRANSITIONS = {
+    "activate": ("planned", "active", "start_date"),
+    "finish": ("active", "finished", "end_date"),
+}
+
+log = logging.getLogger(__name__)
+
+
+def _utc(dt: datetime) -> datetime:
+    # mongo hands back naive UTC datetimes; compare everything that way
+    return dt.astimezone(UTC).replace(tzinfo=None) if dt.tzinfo else dt
+
+
+def _now() -> datetime:
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+class BetScheduler:
+    def __init__(self, db, caches: dict, worker_id: str | None = None):
+        self.bets = db["bets"]
+        self.groups = db["groups"]
+        self.leases = db["leases"]
+        self.stats_col = db["group_stats"]
+        self.caches = caches
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._heap: list[tuple[datetime, int, ObjectId, str]] = []
+        # the live deadline per bet; heap entries that don't match it are stale
+        self._due: dict[ObjectId, tuple[str, datetime]] = {}
+        self._seq = itertools.count()
+        self._window_end = _now()
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.leader = False
+        self._lease_until = _now()
+        self.fired = 0
+
+    # scheduling
+
+    def schedule(self, bet: dict):
+        bid = bet["_id"]
+        status = bet.get("status")
+        if status == "planned" and bet.get("start_date"):
+            self._push(bid, "activate", _utc(bet["start_date"]))
+        elif status == "active" and bet.get("end_date"):
+            self._push(bid, "finish", _utc(bet["end_date"]))
+        else:
+            self.unschedule(bid)
+
+    def unschedule(self, bid: ObjectId):
+        self._due.pop(bid, None)
+
+    def _push(self, bid: ObjectId, transition: str, when: datetime):
+        if when > self._window_end:
+            # beyond the loaded window, the next reload picks it up
+            self._due.pop(bid, None)
+            return
+        if self._due.get(bid) == (transition, when):
+            return
+        self._due[bid] = (transition, when)
+        heapq.heappush(self._heap, (when, next(self._seq), bid, transition))
+        if self._heap[0][2] == bid:
+            self._wake.set()
+
+    async def _load(self):
+        # both scans run on the (status, deadline) indexes in models.INDEXES, so only
+        # keys inside the window are read
+        now = _now()
+        self._window_end = now + timedelta(seconds=LOOKAHEAD_S)
+        self._heap.clear()
+        self._due.clear()
+        planned = self.bets.find(
+            {"status": "planned", "start_date": {"$lte": self._window_end}},
+            {"status": 1, "start_date": 1, "end_date": 1},
+        )
+        async for bet in planned:
+            self.schedule(bet)
+        active = self.bets.find(
+            {"status": "active", "end_date": {"$lte": self._window_end}},
+            {"status": 1, "start_date": 1, "end_date": 1},
+        )
+        async for bet in active:
+            self.schedule(bet)
+
+    # leader lease
+
+    async def _hold_lease(self) -> bool:
+        now = _now()
+        if self.leader and self._lease_until - now > timedelta(seconds=LEASE_TTL_S / 3):
+            return True
+        try:
+            doc = await self.leases.find_one_and_update(
+                {"_id": LEASE_ID, "$or": [{"owner": self.worker_id}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.worker_id, "expires_at": now + timedelta(seconds=LEASE_TTL_S)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # someone else holds a live lease, so the upsert collided with it
+            doc = None
+        else:
+            doc = doc or {"owner": self.worker_id}
+        was_leader = self.leader
+        self.leader = doc is not None
+        if self.leader:
+            self._lease_until = now + timedelta(seconds=LEASE_TTL_S)
+            if not was_leader:
+                log.info("bet scheduler lease acquired by %s", self.worker_id)
+        return self.leader
+
+    # firing
+
+    def _pop_due(self, now: datetime) -> dict[str, list[ObjectId]]:
+        due: dict[str, list[ObjectId]] = {"activate": [], "finish": []}
+        while self._heap and self._heap[0][0] <= now:
+            when, _, bid, transition = heapq.heappop(self._heap)
+            if self._due.get(bid) != (transition, when):
+                continue
+            del self._due[bid]
+            due[transition].append(bid)
+        return due
+
+    async def _sweep(self, now: datetime) -> dict[str, list[ObjectId]]:
+        # due bets whatever the heap says, so deadlines set through other workers
+        # fire within a tick; on the (status, deadline) indexes this reads only keys
+        # already due, so a tick with nothing due is two empty index seeks
+        due: dict[str, list[ObjectId]] = {}
+        for transition, (src, _, field) in TRANSITIONS.items():
+            cur = self.bets.find({"status": src, field: {"$lte": now}}, {"_id": 1})
+            due[transition] = [b["_id"] async for b in cur.limit(BATCH_SIZE)]
+        return due
+
+    async def _fire(self, transition: str, bids: list[ObjectId], now: datetime):
+        src, dst, field = TRANSITIONS[transition]
+        for i in range(0, len(bids), BATCH_SIZE):
+            batch = bids[i:i + BATCH_SIZE]
+            # the deadline is checked again: another worker may have moved it since
+            # this one scheduled it
+            bets = await self.bets.find(
+                {"_id": {"$in": batch}, "status": src, field: {"$lte": now}},
+                {"group_id": 1, "end_date": 1, VERSION_FIELD: 1},
+            ).to_list(None)
+            if not bets:
+                continue
+            ids = [b["_id"] for b in bets]
+            res = await self.bets.update_many(
+                {"_id": {"$in": ids}, "status": src, field: {"$lte": now}}, bumped({"$set": {"status": dst}})
+            )
+            if res.modified_count != len(bets):
+                # something moved some of them between the read and the write; keep
+                # only the ones this update changed, one version on and in dst
+                moved = {
+                    b["_id"]: version_of(b)
+                    async for b in self.bets.find({"_id": {"$in": ids}, "status": dst}, {VERSION_FIELD: 1})
+                }
+                bets = [b for b in bets if moved.get(b["_id"]) == version_of(b) + 1]
+                if not bets:
+                    continue
+                ids = [b["_id"] for b in bets]
+            ops = []
+            for b in bets:
+                build = activation_group_ops if transition == "activate" else finish_group_ops
+                ops.extend(build(b["group_id"], b["_id"]))
+            await self.groups.bulk_write(ops)
+            if transition == "finish":
+                # finished bets keep no completion entry in the group summary
+                await group_stats.apply(self.stats_col, [
+                    group_stats.unset_bet_op(b["group_id"], b["_id"]) for b in bets
+                ])
+            self.caches["bets"].invalidate(*ids)
+            self.caches["groups"].invalidate(*{b["group_id"] for b in bets})
+            self.fired += len(ids)
+            if transition == "activate":
+                for b in bets:
+                    self.schedule({**b, "status": "active"})
+
+    async def _run(self):
+        while True:
+            try:
+                if _now() >= self._window_end - timedelta(seconds=LOOKAHEAD_S / 2):
+                    await self._load()
+                sleep = LEASE_TTL_S / 3
+                if await self._hold_lease():
+                    now = _now()
+                    due = self._pop_due(now)
+                    for transition, bids in (await self._sweep(now)).items():
+                        due[transition] = list(dict.fromkeys(due[transition] + bids))
+                    for transition, bids in due.items():
+                        if bids:
+                            await self._fire(transition, bids, now)
+                    if self._heap:
+                        sleep = min(sleep, max((self._heap[0][0] - _now()).total_seconds(), 0))
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=sleep)
+                except asyncio.TimeoutError:
+                    pass
+            except Exception:
+                # anything escaping here would end the task and stop every transition
+                log.exception("bet scheduler tick failed")
+                # popped deadlines may not have fired; reload them from the database
+                self._window_end = _now()
+                await asyncio.sleep(ERROR_BACKOFF_S)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.leader:
+            try:
+                await self.leases.update_one(
+                    {"_id": LEASE_ID, "owner": self.worker_id}, {"$set": {"expires_at": _now()}}
+                )
+            except PyMongoError:
+                pass
+
+    def stats(self) -> dict:
+        return {"leader": self.leader, "scheduled": len(self._due), "fired": self.fired}
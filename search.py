@@ -0,0 +1,117 @@
+# search.py
+# Prefix type-ahead over usernames and group names (GET /users/search,
+# GET /groups/search). Each searchable field has a folded copy next to it
+# (username_lc, name_lc) that every path writing the field keeps current, indexed
+# in models.INDEXES. A prefix is then a range on that index, [prefix, next prefix),
+# so a lookup reads only the keys it returns however large the collection gets. A
+# case-insensitive collation index would spare the extra field, but $regex ignores
+# collation, so a prefix match on it couldn't use the index.
+#
+# Documents written before the folded fields existed are backfilled by a one-off
+# migration; until then they don't show up in search:
+#
+#   python search.py --dry-run
+#   python search.py
+import argparse
+import asyncio
+import unicodedata
+
+from pymongo import UpdateOne
+
+# searchable field -> its folded copy
+SEARCH_KEYS = {"username": "username_lc", "name": "name_lc"}
+SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+MAX_QUERY_LENGTH = 64
+# matches read in index order per result asked for; ranking picks from these
+CANDIDATE_FACTOR = 4
+BACKFILL_BATCH_SIZE = 500
+
+
+def fold(s: str) -> str:
+    # full-width and composed forms match their plain spelling, case doesn't matter
+    return unicodedata.normalize("NFKC", s).casefold()
+
+
+def folded(field: str, value: str | None) -> dict:
+    # the folded copy to store next to a written searchable field
+    return {SEARCH_KEYS[field]: fold(value) if value is not None else None}
+
+
+def prefix_range(prefix: str) -> dict:
+    # strings compare by code point (UTF-8 bytes on the server), so everything
+    # starting with prefix sorts before prefix with its last character bumped
+    last = ord(prefix[-1]) + 1
+    if 0xD800 <= last <= 0xDFFF:
+        # surrogates can't be encoded; the next character that can is U+E000
+        last = 0xE000
+    if last > 0x10FFFF:
+        return {"$gte": prefix}
+    return {"$gte": prefix, "$lt": prefix[:-1] + chr(last)}
+
+
+def rank(docs: list[dict], field: str, q: str) -> list[dict]:
+    # exact matches first, then shorter names, then names spelled with the query's
+    # case, then in index order
+    key, want = SEARCH_KEYS[field], fold(q)
+    return sorted(docs, key=lambda d: (
+        d[key] != want,
+        len(d[key]),
+        not d[field].startswith(q),
+        d[key],
+    ))
+
+
+async def prefix_search(col, field: str, q: str, projection: dict, limit: int = SEARCH_LIMIT) -> list[dict]:
+    key = SEARCH_KEYS[field]
+    cur = col.find(
+        {key: prefix_range(fold(q))},
+        {**projection, field: 1, key: 1},
+    ).sort(key, 1).limit(limit * CANDIDATE_FACTOR)
+    docs = await cur.to_list(None)
+    return rank(docs, field, q)[:limit]
+
+
+async def backfill(col, field: str, dry_run: bool = False, batch_size: int = BACKFILL_BATCH_SIZE) -> dict:
+    key = SEARCH_KEYS[field]
+    report = {"scanned": 0, "stale": 0}
+    ops = []
+    async for d in col.find({}, {field: 1, key: 1}):
+        report["scanned"] += 1
+        want = fold(d[field]) if d.get(field) is not None else None
+        if key in d and d[key] == want:
+            continue
+        report["stale"] += 1
+        if dry_run:
+            continue
+        # matching on the value read keeps a concurrent rename from being overwritten;
+        # that document already got its folded copy from the rename
+        ops.append(UpdateOne({"_id": d["_id"], field: d.get(field)}, {"$set": {key: want}}))
+        if len(ops) >= batch_size:
+            await col.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await col.bulk_write(ops, ordered=False)
+    return report
+
+
+async def main():
+    from db import create_client, DB_NAME
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dry-run", action="store_true", help="report what would be written without writing")
+    args = ap.parse_args()
+
+    client = await create_client()
+    try:
+        db = client[DB_NAME]
+        for col, field in (("users", "username"), ("groups", "name")):
+            report = await backfill(db[col], field, dry_run=args.dry_run)
+            print(f"{col}: {'would set' if args.dry_run else 'set'} {SEARCH_KEYS[field]} on "
+                  f"{report['stale']} of {report['scanned']} document(s)")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,157 @@
+# serialize.py
+# Fast response path: build the response-model shape straight from BSON documents
+# (or cached normalized ones) and encode with orjson, skipping the normalize_* copy
+# plus the response_model validate/serialize round trip. The output is meant to be
+# byte-for-byte what FastAPI produces for BetOut/GroupOut/UserOut; tests/test_serialize.py
+# checks that and bench/serialization.py times it. Turn SERIALIZE_DEBUG on to go back
+# through the response models.
+#
+# The same field getters back sparse fieldsets (?fields=) through fieldset().
+from datetime import datetime, UTC
+
+import orjson
+from bson import ObjectId
+from fastapi import HTTPException, Response
+
+from models import partial_model
+
+SERIALIZE_DEBUG = False
+
+_OPTS = orjson.OPT_UTC_Z
+
+
+class _Fallback(Exception):
+    # raised when a document can't be encoded with guaranteed parity
+    pass
+
+
+def _id(x):
+    return str(x) if isinstance(x, ObjectId) else x
+
+
+def _float(x) -> float:
+    x = float(x)
+    # pydantic writes 1e16 and up as "1e+16" where orjson writes "1e16";
+    # inf/nan are also rare enough to leave to the slow path
+    if not -1e16 < x < 1e16:
+        raise _Fallback
+    return x
+
+
+def _email(x: str) -> str:
+    # EmailStr lower-cases the domain. it also decodes IDNA, NFC-normalizes and
+    # unwraps "Name <addr>"; plain ASCII addresses only need the first, the others
+    # take the validated path
+    local, _, domain = x.rpartition("@")
+    if not (local and x.isascii() and "xn--" not in domain.lower() and not any(c in x for c in ' \t<>"')):
+        raise _Fallback
+    return f"{local}@{domain.lower()}"
+
+
+def _now():
+    return datetime.now(UTC)
+
+
+def _progress(p: dict) -> dict:
+    return {
+        "user_id": _id(p["user_id"]),
+        "progress": _float(p.get("progress", 0.0)),
+        "last_updated": p["last_updated"] if "last_updated" in p else _now(),
+    }
+
+
+class Shape:
+    # response-model field name -> getter, in model order with _id last. calling it
+    # shapes a document; only() narrows it to a sparse fieldset (?fields=)
+    def __init__(self, getters: dict):
+        self.getters = getters
+        self._items = tuple(getters.items())
+
+    def __call__(self, d: dict) -> dict:
+        return {k: get(d) for k, get in self._items}
+
+    def only(self, fields) -> "Shape":
+        return Shape({k: get for k, get in self.getters.items() if k in fields or k == "_id"})
+
+
+bet_shape = Shape({
+    "group_id": lambda d: _id(d["group_id"]),
+    "title": lambda d: d["title"],
+    "user_progress": lambda d: [_progress(p) for p in d.get("user_progress", [])],
+    "start_date": lambda d: d["start_date"],
+    "end_date": lambda d: d["end_date"],
+    "status": lambda d: d.get("status", "planned"),
+    "meta": lambda d: d.get("meta", {}),
+    "_id": lambda d: _id(d["_id"]),
+})
+
+group_shape = Shape({
+    "name": lambda d: d["name"],
+    "description": lambda d: d.get("description"),
+    "user_ids": lambda d: [_id(x) for x in d.get("user_ids", [])],
+    "current_bet_id": lambda d: _id(d.get("current_bet_id")),
+    "created_at": lambda d: d["created_at"] if "created_at" in d else _now(),
+    "is_active": lambda d: d.get("is_active", True),
+    "_id": lambda d: _id(d["_id"]),
+})
+
+user_shape = Shape({
+    "profile_url": lambda d: d["profile_url"],
+    "username": lambda d: d["username"],
+    "email": lambda d: _email(d["email"]),
+    "group_ids": lambda d: [_id(x) for x in d.get("group_ids", [])],
+    "average_spending": lambda d: _float(d["average_spending"]),
+    "_id": lambda d: _id(d["_id"]),
+})
+
+
+def encode_line(doc: dict, shape, normalize, model) -> bytes:
+    # one NDJSON record, identical to the same document in a regular API response
+    try:
+        return orjson.dumps(shape(doc), option=_OPTS) + b"\n"
+    except (_Fallback, KeyError, TypeError, ValueError, orjson.JSONEncodeError):
+        return model.model_validate(normalize(doc)).model_dump_json(by_alias=True).encode("utf-8") + b"\n"
+
+
+def fieldset(shape: Shape, model, fields: str | None):
+    # ?fields=title,status -> (narrowed shape, partial response model, mongo projection).
+    # without it: the full shape, no partial model and no projection
+    if not fields:
+        return shape, None, None
+    wanted = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = wanted - set(shape.getters) - {"_id"}
+    if unknown:
+        raise HTTPException(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+    selected = tuple(k for k in shape.getters if k in wanted and k != "_id")
+    # _id alone still needs an inclusion: an empty projection reads every field
+    projection = {f: 1 for f in selected} or {"_id": 1}
+    return shape.only(selected), partial_model(model, selected), projection
+
+
+def _validated(payload, normalize, model) -> bytes:
+    if isinstance(payload, list):
+        return b"[" + b",".join(model.model_validate(normalize(d)).model_dump_json(by_alias=True).encode("utf-8") for d in payload) + b"]"
+    return model.model_validate(normalize(payload)).model_dump_json(by_alias=True).encode("utf-8")
+
+
+def respond(payload, shape, normalize, response: Response | None = None, status_code: int = 200, model=None):
+    # payload is one document or a list of them. returns ready JSON bytes, or the
+    # normalized payload for FastAPI to validate when debugging or on a fallback.
+    # sparse fieldsets pass their partial model, which the route's response_model
+    # would reject, so those are validated and encoded here instead
+    headers = dict(response.headers) if response is not None else None
+    if not SERIALIZE_DEBUG:
+        try:
+            if isinstance(payload, list):
+                body = orjson.dumps([shape(d) for d in payload], option=_OPTS)
+            else:
+                body = orjson.dumps(shape(payload), option=_OPTS)
+        except (_Fallback, KeyError, TypeError, ValueError, orjson.JSONEncodeError):
+            pass
+        else:
+            return Response(body, status_code=status_code, headers=headers, media_type="application/json")
+    if model is not None:
+        return Response(_validated(payload, normalize, model), status_code=status_code, headers=headers, media_type="application/json")
+    if isinstance(payload, list):
+        return [normalize(d) for d in payload]
+    return normalize(payload)
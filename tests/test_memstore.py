@@ -0,0 +1,281 @@
+# tests/test_memstore.py
+# The memory backend (memstore.py) against the real thing: the query and update
+# shapes the routers send, run on each backend in BACKENDS. "memory" always runs;
+# "mongod" runs when the server at db.MONGO_URI answers and is skipped otherwise;
+# "mongomock" (mongomock-motor) runs the cases it implements, as a second opinion
+# when no mongod is around. A case passing on memory but failing on mongod is a
+# memstore bug.
+#
+#   pip install -r tests/requirements.txt
+#   python -m pytest -q tests
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from pymongo import InsertOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+
+import db
+from indexes import ensure_indexes
+from memstore import MemoryClient
+from past_bets import RECENT_PAST_BETS, push_past_bet_op
+from progress_history import history_pipeline
+from routers.groups import overview_pipeline
+from search import folded, prefix_search
+
+BACKENDS = ("memory", "mongomock", "mongod")
+# cases mongomock doesn't implement ($lookup with a pipeline, $dateTrunc, _id
+# ordering, UpdateOne in bulk_write with this pymongo) or gets wrong (positional $
+# with several array entries)
+NOT_IN_MONGOMOCK = {
+    "test_lookup_overview",
+    "test_date_trunc_history",
+    "test_id_first",
+    "test_push_slice_caps_past_bets",
+    "test_positional_update_and_elem_match",
+}
+
+_mongod_up: bool | None = None
+
+
+async def _client(backend: str):
+    global _mongod_up
+    if backend == "memory":
+        return MemoryClient()
+    if backend == "mongomock":
+        mongomock_motor = pytest.importorskip("mongomock_motor")
+        return mongomock_motor.AsyncMongoMockClient()
+    if _mongod_up is False:
+        pytest.skip(f"no mongod at {db.MONGO_URI}")
+    try:
+        client = await db.create_client()
+    except PyMongoError:
+        _mongod_up = False
+        pytest.skip(f"no mongod at {db.MONGO_URI}")
+    _mongod_up = True
+    return client
+
+
+@pytest.fixture(params=BACKENDS)
+def run(request):
+    # runs an async case against a fresh database on the backend
+    backend = request.param
+    if backend == "mongomock" and request.node.originalname in NOT_IN_MONGOMOCK:
+        pytest.skip("not implemented by mongomock")
+
+    def go(case):
+        async def main():
+            client = await _client(backend)
+            database = client[f"memstore_test_{ObjectId()}"]
+            try:
+                await case(database)
+            finally:
+                await client.drop_database(database.name)
+                client.close()
+        asyncio.run(main())
+
+    return go
+
+
+def _bet(gid: ObjectId, uids: list[ObjectId], status: str = "active") -> dict:
+    now = datetime(2026, 10, 12, 9, 30)
+    return {
+        "_id": ObjectId(),
+        "group_id": gid,
+        "title": "bet",
+        "user_progress": [{"user_id": u, "progress": 10.0 * i, "last_updated": now} for i, u in enumerate(uids)],
+        "start_date": now,
+        "end_date": now + timedelta(days=7),
+        "status": status,
+        "meta": {},
+    }
+
+
+def test_positional_update_and_elem_match(run):
+    # set_user_progress: positional $set, and the $elemMatch projection of the entry
+    async def case(d):
+        uids = [ObjectId() for _ in range(3)]
+        bet = _bet(ObjectId(), uids)
+        await d["bets"].insert_one(bet)
+        before = await d["bets"].find_one_and_update(
+            {"_id": bet["_id"], "user_progress.user_id": uids[1]},
+            {"$set": {"user_progress.$.progress": 55.0}},
+            projection={"group_id": 1, "user_progress": {"$elemMatch": {"user_id": uids[1]}}},
+        )
+        assert before["user_progress"] == [bet["user_progress"][1]]
+        after = await d["bets"].find_one({"_id": bet["_id"]})
+        assert [p["progress"] for p in after["user_progress"]] == [0.0, 55.0, 20.0]
+        missing = await d["bets"].find_one_and_update(
+            {"_id": bet["_id"], "user_progress.user_id": ObjectId()},
+            {"$set": {"user_progress.$.progress": 1.0}},
+        )
+        assert missing is None
+    run(case)
+
+
+def test_add_to_set_and_pull(run):
+    # join/leave: a repeated $addToSet or $pull matches but modifies nothing
+    async def case(d):
+        gid, uid = ObjectId(), ObjectId()
+        await d["groups"].insert_one({"_id": gid, "name": "g", "user_ids": []})
+        res = await d["groups"].update_one({"_id": gid}, {"$addToSet": {"user_ids": uid}})
+        assert (res.matched_count, res.modified_count) == (1, 1)
+        res = await d["groups"].update_one({"_id": gid}, {"$addToSet": {"user_ids": uid}})
+        assert (res.matched_count, res.modified_count) == (1, 0)
+        res = await d["groups"].update_one({"_id": gid}, {"$pull": {"user_ids": uid}})
+        assert res.modified_count == 1
+        assert (await d["groups"].find_one({"_id": gid}))["user_ids"] == []
+    run(case)
+
+
+def test_push_slice_caps_past_bets(run):
+    async def case(d):
+        gid = ObjectId()
+        await d["groups"].insert_one({"_id": gid, "name": "g", "past_bet_ids": []})
+        bids = [ObjectId() for _ in range(RECENT_PAST_BETS + 5)]
+        await d["groups"].bulk_write([push_past_bet_op(gid, bid) for bid in bids])
+        # already listed: the $ne guard skips it
+        res = await d["groups"].bulk_write([push_past_bet_op(gid, bids[-1])])
+        assert res.modified_count == 0
+        doc = await d["groups"].find_one({"_id": gid})
+        assert doc["past_bet_ids"] == bids[-RECENT_PAST_BETS:]
+    run(case)
+
+
+def test_negative_slice(run):
+    # the overview's recent past bets ($slice expression) and a $slice projection,
+    # on arrays shorter and longer than the slice
+    async def case(d):
+        await d["groups"].insert_many([{"_id": n, "ids": list(range(n))} for n in (3, 15)])
+        rows = await d["groups"].aggregate([
+            {"$project": {"recent": {"$slice": ["$ids", -10]}}}, {"$sort": {"_id": 1}},
+        ]).to_list(None)
+        assert [r["recent"] for r in rows] == [[0, 1, 2], list(range(5, 15))]
+        docs = await d["groups"].find({}, {"ids": {"$slice": -4}}).sort("_id", 1).to_list(None)
+        assert [doc["ids"] for doc in docs] == [[0, 1, 2], [11, 12, 13, 14]]
+    run(case)
+
+
+def test_unordered_bulk_duplicates(run):
+    # the importer: duplicates are reported per row and the other rows still land
+    async def case(d):
+        await ensure_indexes(d)
+        rows = [{"email": e, "username": e} for e in ("a@x", "b@x", "a@x", "c@x")]
+        with pytest.raises(BulkWriteError) as e:
+            await d["users"].insert_many(rows, ordered=False)
+        errors = e.value.details["writeErrors"]
+        assert [(err["index"], err["code"]) for err in errors] == [(2, 11000)]
+        assert e.value.details["nInserted"] == 3
+        assert await d["users"].count_documents({}) == 3
+        with pytest.raises(BulkWriteError) as e:
+            await d["users"].bulk_write([InsertOne({"email": "d@x"}), InsertOne({"email": "b@x"}),
+                                         InsertOne({"email": "e@x"})], ordered=False)
+        assert [err["index"] for err in e.value.details["writeErrors"]] == [1]
+        assert await d["users"].count_documents({}) == 5
+    run(case)
+
+
+def test_upsert_into_held_lease(run):
+    # the scheduler's lease: an upsert that doesn't match a live lease collides on _id
+    async def case(d):
+        now = datetime(2026, 10, 17, 12, 0)
+        await d["leases"].insert_one({"_id": "l", "owner": "a", "expires_at": now + timedelta(seconds=30)})
+        with pytest.raises(DuplicateKeyError):
+            await d["leases"].find_one_and_update(
+                {"_id": "l", "$or": [{"owner": "b"}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": "b"}},
+                upsert=True,
+            )
+        doc = await d["leases"].find_one_and_update(
+            {"_id": "l", "$or": [{"owner": "a"}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"expires_at": now + timedelta(seconds=60)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        assert doc["owner"] == "a"
+    run(case)
+
+
+def test_history_page_on_index(run):
+    # GET /groups/{id}/bets/history: newest first, keyset on _id
+    async def case(d):
+        await ensure_indexes(d)
+        gid = ObjectId()
+        bets = [_bet(gid, [], "finished") for _ in range(30)] + [_bet(ObjectId(), [], "finished")]
+        await d["bets"].insert_many(bets)
+        filt = {"group_id": gid, "status": "finished"}
+        page = await d["bets"].find(filt, {"_id": 1}).sort("_id", -1).limit(10).to_list(None)
+        ids = sorted((b["_id"] for b in bets[:30]), reverse=True)
+        assert [b["_id"] for b in page] == ids[:10]
+        filt["_id"] = {"$lt": page[-1]["_id"]}
+        page = await d["bets"].find(filt, {"_id": 1}).sort("_id", -1).limit(10).to_list(None)
+        assert [b["_id"] for b in page] == ids[10:20]
+    run(case)
+
+
+def test_prefix_search(run):
+    async def case(d):
+        await ensure_indexes(d)
+        names = ["Alice", "alicia", "ALI", "Al", "bob", "álvaro"]
+        await d["users"].insert_many([{"email": n, "username": n, **folded("username", n)} for n in names])
+        found = await prefix_search(d["users"], "username", "al", {"username": 1}, 10)
+        assert [u["username"] for u in found] == ["Al", "ALI", "Alice", "alicia"]
+    run(case)
+
+
+def test_lookup_overview(run):
+    async def case(d):
+        uids = [ObjectId() for _ in range(3)]
+        gid = ObjectId()
+        await d["users"].insert_many([
+            {"_id": u, "username": f"u{i}", "profile_url": "x", "average_spending": 1.0, "password_hash": "h"}
+            for i, u in enumerate(uids)
+        ])
+        current = _bet(gid, uids[:2])
+        past = [_bet(gid, [], "finished") for _ in range(3)]
+        await d["bets"].insert_many([current, *past])
+        await d["groups"].insert_one({
+            "_id": gid, "name": "g", "user_ids": uids, "current_bet_id": current["_id"],
+            "past_bet_ids": [b["_id"] for b in past],
+        })
+        doc = (await d["groups"].aggregate(overview_pipeline(gid)).to_list(None))[0]
+        assert sorted(m["username"] for m in doc["members"]) == ["u0", "u1", "u2"]
+        assert all("password_hash" not in m for m in doc["members"])
+        bet = doc["current_bet"][0]
+        assert sorted(p["username"] for p in bet["participants"]) == ["u0", "u1"]
+        assert sorted(b["_id"] for b in doc["past_bets"]) == sorted(b["_id"] for b in past)
+        assert set(doc["past_bets"][0]) == {"_id", "title", "status", "start_date", "end_date"}
+    run(case)
+
+
+def test_date_trunc_history(run):
+    # the chart buckets: $dateTrunc by hour and by week (weeks start on Sunday)
+    async def case(d):
+        bid, uid = ObjectId(), ObjectId()
+        t0 = datetime(2026, 10, 14, 10, 5)
+        points = [{"ts": t0 + timedelta(minutes=20 * i), "meta": {"bet_id": bid, "user_id": uid}, "progress": float(i)}
+                  for i in range(6)]
+        await d["progress_history"].insert_many(points)
+        rows = await d["progress_history"].aggregate(
+            history_pipeline(bid, None, t0, t0 + timedelta(days=1), "hour", 1)
+        ).to_list(None)
+        assert [(r["_id"]["t"], r["progress"], r["min"], r["max"], r["points"]) for r in rows] == [
+            (datetime(2026, 10, 14, 10), 2.0, 0.0, 2.0, 3),
+            (datetime(2026, 10, 14, 11), 5.0, 3.0, 5.0, 3),
+        ]
+        rows = await d["progress_history"].aggregate(
+            history_pipeline(bid, uid, t0, t0 + timedelta(days=1), "week", 1)
+        ).to_list(None)
+        assert [(r["_id"]["t"], r["points"]) for r in rows] == [(datetime(2026, 10, 11), 6)]
+    run(case)
+
+
+def test_id_first(run):
+    # the server stores _id first whatever order the document was built in
+    async def case(d):
+        await d["users"].insert_one({"username": "x", "_id": ObjectId()})
+        assert list(await d["users"].find_one({})) == ["_id", "username"]
+        await d["users"].update_one({"username": "y"}, {"$set": {"email": "y"}}, upsert=True)
+        assert list(await d["users"].find_one({"username": "y"}))[0] == "_id"
+    run(case)
@@ -0,0 +1,146 @@
+# tests/test_serialize.py
+# The fast response path (serialize.respond) against what the response models
+# produce for the same documents: model_validate on the normalized document, then
+# model_dump_json(by_alias=True). The bytes have to be equal for every shape, on the
+# document shapes mongo and the cache hand back: naive and aware datetimes, missing
+# optional fields, and values the models normalize, like mixed-case email domains.
+#
+#   python -m pytest -q tests/test_serialize.py
+from datetime import datetime, timedelta, timezone, UTC
+
+import pytest
+from bson import ObjectId
+from pydantic import TypeAdapter
+
+from models import BetOut, GroupOut, UserOut
+from routers.bets import normalize_bet
+from routers.groups import normalize_group
+from routers.users import normalize_user
+from serialize import respond, fieldset, bet_shape, group_shape, user_shape
+
+# what mongo hands back: naive UTC, millisecond precision
+NAIVE = datetime(2026, 10, 12, 9, 30, 15, 123000)
+AWARE = datetime(2026, 10, 12, 9, 30, 15, tzinfo=UTC)
+OFFSET = datetime(2026, 10, 12, 11, 30, tzinfo=timezone(timedelta(hours=2)))
+
+
+def _bet(**fields) -> dict:
+    return {
+        "_id": ObjectId(),
+        "group_id": ObjectId(),
+        "title": "Walk 10k steps ☃",
+        "user_progress": [
+            {"user_id": ObjectId(), "progress": 12.5, "last_updated": NAIVE},
+            {"user_id": ObjectId(), "progress": 0, "last_updated": AWARE},
+            {"user_id": ObjectId(), "progress": 100.0, "last_updated": OFFSET},
+        ],
+        "start_date": NAIVE,
+        "end_date": NAIVE + timedelta(days=7),
+        "status": "active",
+        "meta": {"stake": "5", "unit": "steps"},
+        **fields,
+    }
+
+
+def _group(**fields) -> dict:
+    return {
+        "_id": ObjectId(),
+        "name": "weekend runners",
+        "description": 'the "early" crowd',
+        "user_ids": [ObjectId(), ObjectId()],
+        "past_bet_ids": [ObjectId()],
+        "current_bet_id": ObjectId(),
+        "created_at": NAIVE,
+        "is_active": True,
+        **fields,
+    }
+
+
+def _user(**fields) -> dict:
+    return {
+        "_id": ObjectId(),
+        "profile_url": "https://cdn.example.com/u/1.png",
+        "username": "Bob",
+        "email": "bob@example.com",
+        "group_ids": [ObjectId()],
+        "average_spending": 12.75,
+        "password_hash": "scrypt$never-returned",
+        **fields,
+    }
+
+
+def _drop(doc: dict, *fields) -> dict:
+    return {k: v for k, v in doc.items() if k not in fields}
+
+
+SHAPES = {
+    "bet": (BetOut, normalize_bet, bet_shape),
+    "group": (GroupOut, normalize_group, group_shape),
+    "user": (UserOut, normalize_user, user_shape),
+}
+
+CASES = [
+    ("bet", _bet()),
+    ("bet", _bet(start_date=AWARE, end_date=OFFSET)),
+    ("bet", _bet(user_progress=[{"user_id": ObjectId(), "progress": 7, "last_updated": NAIVE}])),
+    ("bet", _drop(_bet(), "user_progress", "status", "meta")),
+    ("bet", _bet(meta={"note": 'say "hi"\n\u2028', "emoji": "🏃"})),
+    ("group", _group()),
+    ("group", _group(created_at=AWARE)),
+    ("group", _group(created_at=OFFSET, current_bet_id=None, description=None)),
+    ("group", _drop(_group(), "description", "current_bet_id", "user_ids", "is_active")),
+    ("user", _user()),
+    ("user", _user(email="Bob@Example.COM")),
+    ("user", _user(email="Bob.Smith+bets@EXAMPLE.co.UK")),
+    ("user", _user(email="bob@exämple.com")),
+    ("user", _user(email="BOB@xn--exmple-cua.COM")),
+    ("user", _user(email="Bob <Bob@Example.com>")),
+    ("user", _user(average_spending=0)),
+    ("user", _user(average_spending=1e20)),
+    ("user", _drop(_user(), "group_ids", "password_hash")),
+]
+
+
+def _expected(model, normalize, payload) -> bytes:
+    adapter = TypeAdapter(list[model] if isinstance(payload, list) else model)
+    value = [normalize(d) for d in payload] if isinstance(payload, list) else normalize(payload)
+    return adapter.dump_json(adapter.validate_python(value), by_alias=True)
+
+
+@pytest.mark.parametrize("kind,doc", CASES, ids=[f"{kind}-{i}" for i, (kind, _) in enumerate(CASES)])
+def test_get_parity(kind, doc):
+    model, normalize, shape = SHAPES[kind]
+    expected = model.model_validate(normalize(doc)).model_dump_json(by_alias=True).encode("utf-8")
+    assert respond(doc, shape, normalize, model=model).body == expected
+
+
+@pytest.mark.parametrize("kind", SHAPES)
+def test_list_parity(kind):
+    model, normalize, shape = SHAPES[kind]
+    docs = [doc for k, doc in CASES if k == kind]
+    assert respond(docs, shape, normalize, model=model).body == _expected(model, normalize, docs)
+    assert respond([], shape, normalize, model=model).body == b"[]"
+
+
+@pytest.mark.parametrize("kind", SHAPES)
+def test_sparse_parity(kind):
+    # ?fields= narrows the shape and the model alike
+    model, normalize, shape = SHAPES[kind]
+    doc = next(doc for k, doc in CASES if k == kind)
+    fields = ",".join(list(shape.getters)[:2])
+    narrowed, partial, _ = fieldset(shape, model, fields)
+    expected = partial.model_validate(normalize(doc)).model_dump_json(by_alias=True).encode("utf-8")
+    assert respond(doc, narrowed, normalize, model=partial).body == expected
+
+
+def test_email_domain_is_lowercased_like_email_str():
+    doc = _user(email="Bob@Example.COM")
+    assert b'"email":"Bob@example.com"' in respond(doc, user_shape, normalize_user, model=UserOut).body
+
+
+def test_id_only_fieldset_projects_id():
+    # an empty projection would read the whole document, password_hash included
+    for shape, model in ((bet_shape, BetOut), (group_shape, GroupOut), (user_shape, UserOut)):
+        narrowed, _, projection = fieldset(shape, model, "_id")
+        assert projection == {"_id": 1}
+        assert list(narrowed.getters) == ["_id"]
@@ -1,13 +1,74 @@
 # utils.py
+import base64
 import hashlib
+import hmac
+import json
+import os
 from fastapi import HTTPException
 from bson import ObjectId
 
+# scrypt cost parameters for new hashes; stored hashes carry their own so these
+# can be raised later and old hashes get upgraded on the next login
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_DKLEN = 32
+
 def to_oid(s: str) -> ObjectId:
     if not ObjectId.is_valid(s):
         raise HTTPException(400, "Invalid id")
     return ObjectId(s)
 
+# password hashing. these are CPU-bound (tens of ms each), call them through
+# passwords.PasswordPool rather than directly from a request handler
+
+def _b64(b: bytes) -> str:
+    return base64.b64encode(b).decode("ascii")
+
 def hash_password(pw: str) -> str:
-    # Simple placeholder. Use passlib[bcrypt] in production.
-    return hashlib.sha256(pw.encode("utf-8")).hexdigest()
+    salt = os.urandom(16)
+    dk = hashlib.scrypt(
+        pw.encode("utf-8"), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dklen=SCRYPT_DKLEN
+    )
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(dk)}"
+
+def verify_password(pw: str, stored: str) -> tuple[bool, bool]:
+    # returns (matches, needs_rehash)
+    if stored.startswith("scrypt$"):
+        try:
+            _, n, r, p, salt, expected = stored.split("$")
+            n, r, p = int(n), int(r), int(p)
+            salt, expected = base64.b64decode(salt), base64.b64decode(expected)
+        except ValueError:
+            return False, False
+        dk = hashlib.scrypt(
+            pw.encode("utf-8"), salt=salt, n=n, r=r, p=p, dklen=len(expected),
+            maxmem=256 * 1024 * 1024,
+        )
+        ok = hmac.compare_digest(dk, expected)
+        return ok, ok and (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    # legacy unsalted sha256 hex digests from before scrypt
+    legacy = hashlib.sha256(pw.encode("utf-8")).hexdigest()
+    ok = hmac.compare_digest(legacy, stored)
+    return ok, ok
+
+# keyset pagination cursors
+# the cursor carries the last _id plus the filters it was issued for, so a client
+# can't reuse it against a different result set
+
+def encode_cursor(last_id, filters: dict) -> str:
+    body = {"id": str(last_id), "f": {k: v for k, v in filters.items() if v is not None}}
+    raw = json.dumps(body, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, filters: dict) -> ObjectId:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        body = json.loads(raw)
+        last_id = body["id"]
+        issued_for = body["f"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(400, "Invalid cursor")
+    if issued_for != {k: v for k, v in filters.items() if v is not None}:
+        raise HTTPException(400, "Cursor does not match filters")
+    return to_oid(last_id)